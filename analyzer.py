@@ -0,0 +1,333 @@
+import codecs
+import io
+from compiled_layout import compile_layout, SPACE, SHIFT, ALT, NEWLINE, PLAIN
+
+ENGINES = ('python', 'numpy')
+
+# Увеличивается при любом изменении модели штрафов: старые записи ResultCache перестают совпадать
+SCORING_VERSION = 2
+
+
+class AnalysisState:
+    """
+    Состояние подсчёта между частями текста: текущие клавиши пальцев,
+    рука предыдущего нажатия (-1 - нажатий ещё не было, 0 - левая, 1 - правая)
+    и накопленные счётчики.
+
+    С track_first=True (только движок numpy) дополнительно запоминаются первый
+    учтённый символ и первая клавиша каждого пальца - этого достаточно, чтобы
+    позже пересчитать стык с предыдущей частью текста (см. parallel.py)
+    """
+
+    __slots__ = ('positions', 'previous_hand', 'penalties', 'total_chars', 'first_char', 'first_keys')
+
+    def __init__(self, compiled, track_first=False):
+        self.positions = list(compiled.home_keys)
+        self.previous_hand = -1
+        self.penalties = [0] * len(compiled.fingers)
+        self.total_chars = 0
+        self.first_char = None
+        self.first_keys = [None] * len(compiled.fingers) if track_first else None
+
+    def copy(self):
+        """
+        Возвращает независимую копию состояния
+        """
+        state = AnalysisState.__new__(AnalysisState)
+        state.positions = list(self.positions)
+        state.previous_hand = self.previous_hand
+        state.penalties = list(self.penalties)
+        state.total_chars = self.total_chars
+        state.first_char = self.first_char
+        state.first_keys = None if self.first_keys is None else list(self.first_keys)
+        return state
+
+    def to_dict(self):
+        """
+        Переводит состояние в словарь для JSON (контрольные точки checkpoint.py)
+        """
+        return {
+            'positions': [int(key) for key in self.positions],
+            'previous_hand': int(self.previous_hand),
+            'penalties': [int(penalty) for penalty in self.penalties],
+            'total_chars': int(self.total_chars),
+        }
+
+    @classmethod
+    def from_dict(cls, compiled, data):
+        """
+        Восстанавливает состояние из словаря to_dict
+
+        Args:
+            compiled: скомпилированная раскладка, для которой состояние было сохранено
+            data: словарь to_dict
+
+        Returns:
+            AnalysisState
+        """
+        state = cls(compiled)
+        if len(data['positions']) != len(state.positions) or len(data['penalties']) != len(state.penalties):
+            raise ValueError('Состояние не подходит к раскладке')
+        state.positions = list(data['positions'])
+        state.previous_hand = data['previous_hand']
+        state.penalties = list(data['penalties'])
+        state.total_chars = data['total_chars']
+        return state
+
+    def result(self, fingers):
+        """
+        Переводит счётчики в формат analyze_text
+
+        Args:
+            fingers: названия пальцев в порядке номеров
+
+        Returns:
+            Cуммарный штраф, штрафы по каждому пальцу, общее количество обработанных символов
+        """
+        return sum(self.penalties), dict(zip(fingers, self.penalties)), self.total_chars
+
+
+def score_text(compiled, text, state):
+    """
+    Подсчитывает штрафы за перемещение пальцев, смену руки и нажатия пробела,
+    shift, enter, alt, продолжая с переданного состояния
+
+    Args:
+        compiled: скомпилированная раскладка
+        text: текст для анализа
+        state: состояние подсчёта (изменяется на месте)
+
+    Returns:
+        None
+    """
+    entries = compiled.entries
+    cost = compiled.cost
+    n_keys = compiled.n_keys
+    f1l, f1r, f5l, f5r = compiled.f1l, compiled.f1r, compiled.f5l, compiled.f5r
+
+    penalties = state.penalties
+    current_positions = state.positions
+    previous_hand = state.previous_hand
+    total_chars = state.total_chars
+
+    for char in text:
+        entry = entries.get(char)
+        if entry is None:
+            if char < '\U00010000' or not compiled.code_of(char):
+                continue
+            entry = entries[char]
+        kind, finger, key, hand = entry
+
+        if kind == PLAIN:
+            penalties[finger] += cost[current_positions[finger] * n_keys + key]
+            current_positions[finger] = key
+            total_chars += 1
+
+            if previous_hand >= 0 and hand != previous_hand:
+                penalties[finger] += 1
+
+            previous_hand = hand
+
+        elif kind == SPACE:
+            penalties[f1l] += 1
+            total_chars += 1
+
+            if previous_hand == 1:
+                penalties[f1l] += 1
+
+            previous_hand = 0
+
+        elif kind == SHIFT:
+            if previous_hand == 1:
+                penalties[f5r] += 1
+                if hand == 0:
+                    penalties[finger] += 1
+            else:
+                penalties[f5l] += 1
+                if hand == 1:
+                    penalties[finger] += 1
+
+            penalties[finger] += cost[current_positions[finger] * n_keys + key]
+            current_positions[finger] = key
+            previous_hand = hand
+            total_chars += 2
+
+        elif kind == ALT:
+            penalties[f1r] += 1
+
+            if previous_hand == 0:
+                penalties[f1r] += 1
+
+            if hand == 0:
+                penalties[finger] += 1
+
+            penalties[finger] += cost[current_positions[finger] * n_keys + key]
+            current_positions[finger] = key
+            previous_hand = hand
+            total_chars += 2
+
+        elif kind == NEWLINE:
+            penalties[f5r] += 2
+            total_chars += 1
+
+            if previous_hand == 0:
+                penalties[f5r] += 1
+
+            previous_hand = 1
+
+    state.previous_hand = previous_hand
+    state.total_chars = total_chars
+
+
+class Analyzer:
+    """
+    Потоковый анализатор: принимает текст частями через feed() и хранит между
+    вызовами позиции пальцев, руку предыдущего нажатия и счётчики.
+    Результат не зависит от того, как текст разбит на части, а память не растёт
+    с размером текста. Части могут быть строками или байтами (байты декодируются
+    инкрементально, переводы строк приводятся к '\\n', как при чтении файла в текстовом режиме).
+    Байты однобайтовых кодировок (cp1251, koi8-r) движок numpy считает без декодирования.
+    С key_stats=True (только numpy) в том же проходе собирается KeyStats (атрибут key_stats),
+    с metrics (True - все метрики или список названий, только numpy) - MetricAccumulator (атрибут metrics)
+    """
+
+    def __init__(self, layout_config, engine='python', encoding='utf-8', key_stats=False, metrics=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Неизвестный движок: {engine}")
+        if key_stats and engine != 'numpy':
+            raise ValueError("Статистика по клавишам собирается только движком numpy")
+        if metrics and engine != 'numpy':
+            raise ValueError("Метрики набора собираются только движком numpy")
+
+        self.compiled = compile_layout(layout_config)
+        self.engine = engine
+        self.encoding = encoding
+        self.state = AnalysisState(self.compiled)
+        self._decoder = None
+        self._single_byte = False
+        self._pending_cr = False
+        self.key_stats = None
+        self.metrics = None
+
+        if engine == 'numpy':
+            from engine import score_bytes, score_points, single_byte_points, text_points
+            self._score_bytes = score_bytes
+            self._score_points = score_points
+            self._text_points = text_points
+            self._single_byte = single_byte_points(encoding) is not None
+            if key_stats:
+                from keystats import KeyStats
+                self.key_stats = KeyStats(self.compiled)
+            if metrics:
+                from metrics import MetricAccumulator
+                self.metrics = MetricAccumulator(self.compiled, None if metrics is True else metrics)
+
+    def feed(self, chunk):
+        """
+        Добавляет часть текста к анализу
+
+        Args:
+            chunk: строка или байты
+
+        Returns:
+            None
+        """
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            if self._single_byte:
+                self._feed_single_byte(chunk)
+                return
+            if self._decoder is None:
+                decoder = codecs.getincrementaldecoder(self.encoding)()
+                self._decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+            chunk = self._decoder.decode(chunk)
+
+        if self.engine == 'numpy':
+            self._score_points(self._text_points(chunk), self.compiled, self.state, self.key_stats, self.metrics)
+        else:
+            score_text(self.compiled, chunk, self.state)
+
+    def _feed_single_byte(self, data):
+        """
+        Подсчёт байтов однобайтовой кодировки без декодирования (см. engine.score_bytes).
+        '\\r' в конце части откладывается до следующей части, чтобы не разорвать пару '\\r\\n'
+
+        Args:
+            data: байты текста
+
+        Returns:
+            None
+        """
+        if self._pending_cr:
+            self._pending_cr = False
+            if data[:1] != b'\n':
+                self._score_bytes(b'\r', self.compiled, self.state, self.encoding, self.key_stats, self.metrics)
+        if data[-1:] == b'\r':
+            self._pending_cr = True
+            data = data[:-1]
+        self._score_bytes(data, self.compiled, self.state, self.encoding, self.key_stats, self.metrics)
+
+    def feed_points(self, points):
+        """
+        Добавляет часть текста, уже переведённую в кодовые точки (только движок numpy)
+
+        Args:
+            points: кодовые точки текста (см. engine.text_points)
+
+        Returns:
+            None
+        """
+        if self.engine != 'numpy':
+            raise ValueError("feed_points доступен только для движка numpy")
+        self._score_points(points, self.compiled, self.state, self.key_stats, self.metrics)
+
+    def feed_iter(self, chunks):
+        """
+        Анализирует все части из итерируемого объекта (генератора, списка строк и т.п.)
+
+        Args:
+            chunks: итерируемый объект со строками или байтами
+
+        Returns:
+            Сам анализатор
+        """
+        for chunk in chunks:
+            self.feed(chunk)
+        self.close()
+        return self
+
+    def feed_stream(self, stream, chunk_size=1024 * 1024):
+        """
+        Читает поток (файл, pipe, sys.stdin) до конца частями по chunk_size
+
+        Args:
+            stream: текстовый или бинарный поток с методом read
+            chunk_size: размер части
+
+        Returns:
+            Сам анализатор
+        """
+        return self.feed_iter(iter(lambda: stream.read(chunk_size), stream.read(0)))
+
+    def close(self):
+        """
+        Дочитывает байты, оставшиеся в декодере; при обрезанном символе выбрасывает UnicodeDecodeError
+
+        Returns:
+            None
+        """
+        if self._pending_cr:
+            self._pending_cr = False
+            self._score_bytes(b'\r', self.compiled, self.state, self.encoding, self.key_stats, self.metrics)
+        if self._decoder is not None:
+            tail = self._decoder.decode(b'', final=True)
+            if tail:
+                self.feed(tail)
+
+    def result(self):
+        """
+        Возвращает накопленный результат
+
+        Returns:
+            Cуммарный штраф, штрафы по каждому пальцу, общее количество обработанных символов
+        """
+        return self.state.result(self.compiled.fingers)
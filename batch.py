@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import csv
+import glob
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from layout import FINGERS
+
+COLUMNS = ('file', 'size', 'mode', 'layout', 'status', 'error', 'total', 'left', 'right', 'chars') + FINGERS + (
+    'seconds',)
+TABLE_FORMATS = ('csv', 'json', 'jsonl')
+POOL_ROUNDS = 2
+
+
+def collect_files(sources, extension='.txt'):
+    """
+    Собирает список файлов из папок (рекурсивно, файлы с расширением extension),
+    шаблонов glob и путей к файлам
+
+    Args:
+        sources: список папок, шаблонов и файлов
+        extension: расширение файлов в папках
+
+    Returns:
+        Список путей без повторов в порядке источников; путь, которого нет,
+        остаётся в списке, чтобы попасть в таблицу со статусом 'missing'
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            found = []
+            for root, _, names in os.walk(source):
+                found.extend(os.path.join(root, name) for name in names if name.endswith(extension))
+            files.extend(sorted(found))
+        elif glob.has_magic(source):
+            files.extend(sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path)))
+        else:
+            files.append(source)
+    return list(dict.fromkeys(files))
+
+
+def _run_job(filename, layouts, mode, engine, encoding, chunk_size):
+    """
+    Считает один файл для всех раскладок в процессе пула. Ошибки не перехватываются,
+    а передаются в основной процесс через future
+
+    Returns:
+        Результаты analyze_file_uncached и время подсчёта в секундах
+    """
+    from main import analyze_file_uncached
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = analyze_file_uncached(filename, layouts, chunk_size, engine, None, mode, encoding)
+    return results, time.perf_counter() - started
+
+
+def _rows(job, layouts, mode, status, error='', results=None, seconds=None):
+    """
+    Составляет строки таблицы по одному файлу: по строке на раскладку
+    """
+    from main import calculate_hand_penalties
+
+    filename, size = job
+    rows = []
+    for i, layout_config in enumerate(layouts):
+        row = dict.fromkeys(COLUMNS)
+        row.update(file=filename, size=size, mode=mode, layout=layout_config['name'], status=status, error=error,
+                   seconds=seconds)
+        if results is not None:
+            total_penalty, finger_penalties, total_chars = results[i]
+            left, right = calculate_hand_penalties(finger_penalties)
+            row.update(total=total_penalty, chars=total_chars, left=left, right=right)
+            row.update((f, finger_penalties.get(f, 0)) for f in FINGERS)
+        rows.append(row)
+    return rows
+
+
+def run_batch(files, layouts, workers=None, mode='text', engine='numpy', encoding='utf-8',
+              chunk_size=1024 * 1024, progress=None):
+    """
+    Считает все файлы на всех раскладках в пуле процессов. Одна задача - один файл
+    (файл читается один раз для всех раскладок), большие файлы ставятся в очередь первыми,
+    чтобы в конце не ждать одного долгого файла.
+
+    Ошибка в файле не останавливает пакет: она попадает в таблицу со статусом 'error',
+    отсутствующий файл - со статусом 'missing'. Если процесс пула падает целиком
+    (BrokenProcessPool), незавершённые задачи перезапускаются в новом пуле, а после
+    POOL_ROUNDS падений - каждая в отдельном процессе, чтобы найти упавший файл (статус 'crashed')
+
+    Args:
+        files: список путей
+        layouts: список данных раскладок
+        workers: количество процессов (None - по количеству ядер)
+        mode: 'text' или 'freq'
+        engine: движок подсчёта
+        encoding: кодировка файлов
+        chunk_size: размер части для чтения
+        progress: функция progress(готово, всего, строки файла), вызывается после каждого файла
+
+    Returns:
+        Список строк таблицы (словари с ключами COLUMNS) в порядке files
+    """
+    rows_by_file = {}
+
+    def finish(job, rows):
+        rows_by_file[job[0]] = rows
+        if progress:
+            progress(len(rows_by_file), len(files), rows)
+
+    def run(pending, max_workers):
+        broken = []
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(_run_job, job[0], layouts, mode, engine, encoding, chunk_size): job
+                       for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    results, seconds = future.result()
+                except BrokenProcessPool:
+                    broken.append(job)
+                except Exception as e:
+                    finish(job, _rows(job, layouts, mode, 'error', f"{type(e).__name__}: {e}"))
+                else:
+                    finish(job, _rows(job, layouts, mode, 'ok', results=results, seconds=seconds))
+        broken.sort(key=lambda job: job[1], reverse=True)
+        return broken
+
+    jobs = []
+    for filename in files:
+        if os.path.isfile(filename):
+            jobs.append((filename, os.path.getsize(filename)))
+        else:
+            finish((filename, None), _rows((filename, None), layouts, mode, 'missing', 'файл не найден'))
+    jobs.sort(key=lambda job: job[1], reverse=True)
+
+    pending = jobs
+    for _ in range(POOL_ROUNDS):
+        if pending:
+            pending = run(pending, workers)
+    for job in pending:
+        if run([job], 1):
+            finish(job, _rows(job, layouts, mode, 'crashed', 'процесс завершился аварийно'))
+
+    return [row for filename in files for row in rows_by_file[filename]]
+
+
+def write_table(rows, filename, table_format=None):
+    """
+    Записывает сводную таблицу результатов
+
+    Args:
+        rows: строки таблицы (см. run_batch)
+        filename: путь к файлу
+        table_format: 'csv', 'json' (по столбцам: имя столбца -> список значений)
+            или 'jsonl' (строка JSON на строку таблицы); None - по расширению файла
+
+    Returns:
+        None
+    """
+    table_format = table_format or os.path.splitext(filename)[1].lstrip('.').lower()
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"Неизвестный формат таблицы: {table_format}")
+
+    if table_format == 'csv':
+        with open(filename, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    elif table_format == 'json':
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump({column: [row[column] for row in rows] for column in COLUMNS}, file, ensure_ascii=False)
+    else:
+        with open(filename, 'w', encoding='utf-8') as file:
+            for row in rows:
+                file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def _print_progress(done, total, rows):
+    """
+    Выводит в stderr строку о завершении файла: время и лучшую раскладку или ошибку
+
+    Args:
+        done: количество обработанных файлов
+        total: общее количество файлов
+        rows: строки таблицы по обработанному файлу (по одной на раскладку)
+
+    Returns:
+        None
+    """
+    row = rows[0]
+    if row['status'] == 'ok':
+        best = min(rows, key=lambda r: r['total'])
+        status = f"{row['seconds']:.2f} с, лучшая раскладка {best['layout']} ({best['total']})"
+    else:
+        status = f"{row['status']}: {row['error']}"
+    print(f"[{done}/{total}] {row['file']}: {status}", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    """
+    Пакетный анализ из командной строки: собирает файлы, считает их в нескольких процессах
+    и записывает сводную таблицу
+
+    Args:
+        argv: аргументы командной строки (None - sys.argv)
+
+    Returns:
+        Код завершения: 1, если хотя бы один файл не удалось обработать, иначе 0
+    """
+    from main import MODES
+    from analyzer import ENGINES
+    from layout_registry import add_layout_arguments, resolve_layouts
+
+    parser = argparse.ArgumentParser(description='Пакетный анализ папок с корпусами на нескольких раскладках')
+    parser.add_argument('sources', nargs='+', metavar='SOURCE', help='папки, шаблоны glob или файлы')
+    add_layout_arguments(parser)
+    parser.add_argument('-o', '--output', default='results.csv',
+                        help='файл сводной таблицы: .csv, .json (по столбцам) или .jsonl')
+    parser.add_argument('--workers', type=int, default=None, help='количество процессов')
+    parser.add_argument('--mode', choices=MODES, default='text', help='режим подсчёта')
+    parser.add_argument('--engine', choices=ENGINES, default='numpy', help='движок подсчёта')
+    parser.add_argument('--encoding', default='utf-8', help='кодировка файлов')
+    parser.add_argument('--extension', default='.txt', help='расширение файлов в папках')
+    args = parser.parse_args(argv)
+
+    if os.path.splitext(args.output)[1].lstrip('.').lower() not in TABLE_FORMATS:
+        parser.error(f"Формат таблицы определяется по расширению: {', '.join(TABLE_FORMATS)}")
+
+    try:
+        layouts = resolve_layouts(args.layouts, args.layout_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    files = collect_files(args.sources, args.extension)
+    if not files:
+        parser.error('Файлы не найдены')
+
+    rows = run_batch(files, layouts, args.workers, args.mode, args.engine, args.encoding,
+                     progress=_print_progress)
+    write_table(rows, args.output)
+
+    failed = {row['file'] for row in rows if row['status'] != 'ok'}
+    print(f"Файлов: {len(files)}, с ошибками: {len(failed)}. Таблица записана в {args.output}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+CORPUS_DIR = '.bench_corpora'
+BASELINE_FILE = 'bench_baseline.json'
+DEFAULT_SIZES = ('1MB', '16MB')
+DEFAULT_THRESHOLD = 0.2
+PATHS = ('python', 'numpy', 'numpy-parallel', 'numpy-cp1251')
+
+WORDS = (
+    'и', 'в', 'не', 'на', 'он', 'что', 'с', 'как', 'это', 'она', 'по', 'но', 'они', 'к', 'у', 'же', 'вы',
+    'за', 'бы', 'из', 'от', 'о', 'так', 'для', 'мы', 'его', 'все', 'было', 'который', 'человек', 'время',
+    'князь', 'война', 'мир', 'жизнь', 'говорить', 'сказал', 'рука', 'день', 'глаза', 'лицо', 'дело',
+    'объявил', 'съезд', 'подъезд', 'объём', 'юный', 'юбка', 'ключ', 'любовь', 'юг', 'этот', 'эхо',
+    'поэт', 'экзамен', 'щука', 'ёлка', 'ещё', 'жёлтый', 'шёпот', 'чувство', 'хотя', 'цель', 'фраза',
+    'голос', 'взгляд', 'ответил', 'сердце', 'вопрос', 'теперь', 'только', 'очень', 'который', 'между',
+)
+NAMES = ('Анна', 'Пьер', 'Наташа', 'Андрей', 'Николай', 'Москва', 'Россия', 'Юлия', 'Эдуард', 'Ёжик')
+SHIFT_PUNCTUATION = ('!', '?', ':', ';', '"', '%', '№', '*', '_', '+', '@')
+
+
+def parse_size(text):
+    """
+    Переводит размер вида '1MB', '256MB', '1GB' в байты
+
+    Args:
+        text: размер
+
+    Returns:
+        Количество байтов
+    """
+    text = text.strip().upper()
+    for suffix, factor in (('GB', 1024 ** 3), ('MB', 1024 ** 2), ('KB', 1024), ('B', 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(text)
+
+
+def _sentence(rng):
+    """
+    Составляет одно предложение: заглавная буква в начале, имена, слова капсом,
+    числа, знаки из набора shift и alt-символы раскладки Вызов (ю, э, ъ, №)
+    """
+    words = []
+    for _ in range(rng.randint(4, 16)):
+        roll = rng.random()
+        if roll < 0.08:
+            word = rng.choice(NAMES)
+        elif roll < 0.1:
+            word = rng.choice(WORDS).upper()
+        elif roll < 0.13:
+            word = str(rng.randint(1, 2000))
+        else:
+            word = rng.choice(WORDS)
+        if rng.random() < 0.1:
+            word += ','
+        elif rng.random() < 0.03:
+            word = '(' + word + ')'
+        elif rng.random() < 0.02:
+            word = rng.choice(SHIFT_PUNCTUATION) + word
+        words.append(word)
+    words[0] = words[0][:1].upper() + words[0][1:]
+    return ' '.join(words) + rng.choice(('.', '.', '.', '!', '?', '...', ':'))
+
+
+def _paragraph(rng, size):
+    """
+    Составляет абзац примерно из size символов
+    """
+    sentences = []
+    length = 0
+    while length < size:
+        sentence = _sentence(rng)
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return ' '.join(sentences) + rng.choice(('\n', '\n', '\n\n'))
+
+
+def generate_corpus(filename, size, seed=0, pool_size=64, paragraph_size=8192):
+    """
+    Генерирует детерминированный синтетический русский корпус: абзацы из общего набора
+    (pool_size абзацев) выбираются случайно с зерном seed, пока размер файла не достигнет size.
+    Одинаковые size и seed всегда дают одинаковый файл
+
+    Args:
+        filename: путь к файлу
+        size: размер в байтах (файл может быть больше на один абзац)
+        seed: зерно генератора
+        pool_size: количество различных абзацев
+        paragraph_size: примерный размер абзаца в символах
+
+    Returns:
+        Количество символов в файле
+    """
+    rng = random.Random(seed)
+    pool = [_paragraph(rng, paragraph_size) for _ in range(pool_size)]
+    encoded = [paragraph.encode('utf-8') for paragraph in pool]
+
+    written = chars = 0
+    with open(filename, 'wb') as file:
+        while written < size:
+            index = rng.randrange(pool_size)
+            file.write(encoded[index])
+            written += len(encoded[index])
+            chars += len(pool[index])
+    return chars
+
+
+def corpus(size, seed=0, encoding='utf-8', directory=CORPUS_DIR):
+    """
+    Возвращает путь к корпусу нужного размера, создавая его при первом обращении
+
+    Args:
+        size: размер в байтах
+        seed: зерно генератора
+        encoding: кодировка файла (utf-8 или однобайтовая)
+        directory: папка для корпусов
+
+    Returns:
+        Путь к файлу и количество символов в нём
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f"corpus_{size}_{seed}_{encoding}.txt")
+    meta_filename = filename + '.json'
+
+    if not (os.path.exists(filename) and os.path.exists(meta_filename)):
+        if encoding == 'utf-8':
+            chars = generate_corpus(filename, size, seed)
+        else:
+            source, chars = corpus(size, seed, 'utf-8', directory)
+            with open(source, 'r', encoding='utf-8', newline='') as src, \
+                    open(filename, 'w', encoding=encoding, newline='') as dst:
+                for chunk in iter(lambda: src.read(1024 * 1024), ''):
+                    dst.write(chunk)
+        with open(meta_filename, 'w', encoding='utf-8') as file:
+            json.dump({'chars': chars}, file)
+
+    with open(meta_filename, encoding='utf-8') as file:
+        return filename, json.load(file)['chars']
+
+
+def _peak_rss_mb():
+    """
+    Возвращает пиковую память процесса и его дочерних процессов в МБ (None, если неизвестно)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / scale
+
+
+def _run_path(path, filename, chars):
+    """
+    Выполняет один замер в отдельном процессе, чтобы пиковая память и время
+    до первого результата (включая импорт модулей) не зависели от предыдущих замеров
+
+    Args:
+        path: путь подсчёта из PATHS
+        filename: путь к корпусу
+        chars: количество символов корпуса
+
+    Returns:
+        Словарь с результатами замера
+    """
+    started = time.perf_counter()
+    from main import analyze_file_multi
+    from layout import qwerty_layout, dictor_layout, vizov_layout
+
+    layouts = [qwerty_layout(), dictor_layout(), vizov_layout()]
+    options = {
+        'python': {'engine': 'python'},
+        'numpy': {'engine': 'numpy'},
+        'numpy-parallel': {'engine': 'numpy', 'workers': os.cpu_count()},
+        'numpy-cp1251': {'engine': 'numpy', 'encoding': 'cp1251'},
+    }[path]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        analysis_started = time.perf_counter()
+        results = analyze_file_multi(filename, layouts, **options)
+        finished = time.perf_counter()
+
+    seconds = finished - analysis_started
+    return {
+        'seconds': seconds,
+        'chars_per_sec': chars * len(layouts) / seconds if seconds else 0.0,
+        'time_to_first_result': finished - started,
+        'peak_rss_mb': _peak_rss_mb(),
+        'total_penalties': [result[0] for result in results],
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, paths=PATHS, seed=0, directory=CORPUS_DIR):
+    """
+    Прогоняет все раскладки через каждый путь подсчёта на корпусах заданных размеров
+
+    Args:
+        sizes: размеры корпусов ('1MB', '1GB', ...)
+        paths: пути подсчёта из PATHS
+        seed: зерно генератора корпусов
+        directory: папка для корпусов
+
+    Returns:
+        Словарь '<путь>/<размер>' -> результаты замера
+    """
+    results = {}
+    context = get_context('spawn')
+    for size_text in sizes:
+        size = parse_size(size_text)
+        for path in paths:
+            encoding = 'cp1251' if path.endswith('cp1251') else 'utf-8'
+            filename, chars = corpus(size, seed, encoding, directory)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(_run_path, path, filename, chars).result()
+            result['chars'] = chars
+            results[f"{path}/{size_text}"] = result
+
+            rss = '?' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.0f}"
+            print(f"{path:>15} {size_text:>6}: {result['chars_per_sec'] / 1e6:8.2f} млн симв/с, "
+                  f"{result['seconds']:7.2f} с, первый результат через {result['time_to_first_result']:7.2f} с, "
+                  f"пиковая память {rss} МБ")
+    return results
+
+
+def check_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Сравнивает скорость с сохранённой базовой
+
+    Args:
+        results: результаты run_benchmarks
+        baseline: базовые результаты (тот же формат)
+        threshold: допустимая доля падения скорости (0.2 - на 20%)
+
+    Returns:
+        Список сообщений о замедлениях (пустой - замедлений нет)
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]['chars_per_sec']
+        if result['chars_per_sec'] < expected * (1 - threshold):
+            regressions.append(f"{name}: {result['chars_per_sec'] / 1e6:.2f} млн симв/с "
+                               f"против {expected / 1e6:.2f} в базовом замере")
+    return regressions
+
+
+def main(argv=None):
+    """
+    Запуск замеров из командной строки: генерирует корпуса, замеряет пути подсчёта
+    и сравнивает скорость с базовыми замерами (или сохраняет их с флагом --save-baseline)
+
+    Args:
+        argv: аргументы командной строки (None - sys.argv)
+
+    Returns:
+        Код завершения: 1, если найдено замедление сверх порога, иначе 0
+    """
+    parser = argparse.ArgumentParser(description='Замеры скорости анализа раскладок на синтетических корпусах')
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help='размеры корпусов через запятую, от 1MB до 1GB')
+    parser.add_argument('--paths', default=','.join(PATHS), help='пути подсчёта через запятую')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора корпусов')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='файл базовых замеров')
+    parser.add_argument('--save-baseline', action='store_true', help='сохранить замеры как базовые')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='допустимое падение скорости относительно базовых замеров (доля)')
+    args = parser.parse_args(argv)
+
+    paths = args.paths.split(',')
+    unknown = [path for path in paths if path not in PATHS]
+    if unknown:
+        parser.error(f"Неизвестные пути подсчёта: {', '.join(unknown)}")
+
+    results = run_benchmarks(args.sizes.split(','), paths, args.seed)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        print(f"Базовые замеры сохранены в {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Файл базовых замеров {args.baseline} не найден, сравнение пропущено")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)
+    regressions = check_regressions(results, baseline, args.threshold)
+    for message in regressions:
+        print(f"Замедление: {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+import codecs
+import hashlib
+import json
+import os
+from analyzer import Analyzer, AnalysisState, SCORING_VERSION
+from compiled_layout import compile_layout
+from compressed import detect_compression
+
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024
+MAX_STATES = 8
+VERIFY_MODES = ('full', 'tail')
+HASH_SIZE = 16
+
+
+def checkpoint_path(filename):
+    """
+    Возвращает путь к файлу контрольных точек рядом с анализируемым файлом
+    """
+    return filename + '.checkpoints.json'
+
+
+def _checkpoint_key(compiled, encoding_name):
+    """
+    Ключ набора контрольных точек: версия модели штрафов, кодировка и хеши раскладок
+    """
+    parts = (SCORING_VERSION, encoding_name, [layout.digest for layout in compiled])
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=HASH_SIZE).hexdigest()
+
+
+def _chain(previous_hash, segment_digest):
+    """
+    Хеш префикса до контрольной точки: хеш предыдущей точки, сцепленный с хешем нового участка.
+    Поэтому хеш всего префикса получается без повторного чтения уже проверенных байтов
+    """
+    return hashlib.blake2b(bytes.fromhex(previous_hash) + segment_digest, digest_size=HASH_SIZE).hexdigest()
+
+
+def _segment_digest(file, start, end, chunk_size):
+    """
+    Хеш байтов файла с start до end
+    """
+    segment = hashlib.blake2b(digest_size=HASH_SIZE)
+    file.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        data = file.read(min(chunk_size, remaining))
+        if not data:
+            break
+        segment.update(data)
+        remaining -= len(data)
+    return segment.digest()
+
+
+def _safe_end(data, utf8):
+    """
+    Возвращает длину начала data, после которого можно поставить контрольную точку:
+    не внутри символа UTF-8 и не между '\\r' и '\\n'
+
+    Args:
+        data: байты
+        utf8: кодировка UTF-8 (иначе однобайтовая)
+
+    Returns:
+        Длина безопасного начала
+    """
+    end = len(data)
+    if utf8:
+        for back in range(1, min(4, end) + 1):
+            byte = data[end - back]
+            if byte & 0xC0 != 0x80:
+                if byte >= 0xC0 and (2 if byte < 0xE0 else 3 if byte < 0xF0 else 4) > back:
+                    end -= back
+                break
+    if end and data[end - 1] == 13:
+        end -= 1
+    return end
+
+
+def load_checkpoints(path):
+    """
+    Читает файл контрольных точек (пустой словарь, если файла нет или он повреждён)
+    """
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoints(path, data):
+    """
+    Записывает файл контрольных точек атомарно: через временный файл и os.replace
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def _last_valid(file, size, chain, states, verify, chunk_size):
+    """
+    Находит последнюю контрольную точку с сохранённым состоянием, префикс до которой не изменился.
+
+    verify='full' пересчитывает цепочку хешей по всему префиксу; verify='tail' перечитывает только участок
+    от предыдущей точки до проверяемой (обычно - данные, дописанные к файлу в прошлый раз) и не замечает
+    изменений раньше этого участка
+
+    Returns:
+        Номер точки в chain или -1, если подходящей нет
+    """
+    candidates = [i for i in range(len(chain) - 1, -1, -1) if chain[i][0] <= size and str(chain[i][0]) in states]
+    if not candidates:
+        return -1
+
+    if verify == 'full':
+        valid = -1
+        previous_offset, previous_hash = 0, ''
+        for i, (offset, chain_hash) in enumerate(chain[:candidates[0] + 1]):
+            if _chain(previous_hash, _segment_digest(file, previous_offset, offset, chunk_size)) != chain_hash:
+                break
+            valid = i
+            previous_offset, previous_hash = offset, chain_hash
+        return next((i for i in candidates if i <= valid), -1)
+
+    for i in candidates:
+        previous_offset, previous_hash = chain[i - 1] if i > 0 else (0, '')
+        if _chain(previous_hash, _segment_digest(file, previous_offset, chain[i][0], chunk_size)) == chain[i][1]:
+            return i
+    return -1
+
+
+def analyze_file_incremental(filename, layouts, engine='python', encoding='utf-8', path=None,
+                             interval=CHECKPOINT_INTERVAL, chunk_size=1024 * 1024, verify='full'):
+    """
+    Анализ растущего файла с контрольными точками: каждые interval байт и в конце файла
+    сохраняются смещение, хеш префикса и состояние каждой раскладки (позиции пальцев,
+    рука предыдущего нажатия, счётчики). Следующий запуск продолжает с последней точки,
+    префикс до которой не изменился (хеш префикса пересчитывается со скоростью чтения диска),
+    и считает штрафы только для новых байтов.
+
+    Результат совпадает с analyze_file_multi: точки ставятся только на границах символов
+    и не между '\\r' и '\\n', а байты после последней точки (обрезанный символ, '\\r')
+    досчитываются уже после сохранения точки
+
+    Args:
+        filename: путь к файлу
+        layouts: список данных раскладок
+        engine: движок подсчёта
+        encoding: UTF-8 или однобайтовая кодировка (cp1251, koi8-r, ...)
+        path: файл контрольных точек (по умолчанию - рядом с файлом, см. checkpoint_path)
+        interval: расстояние между контрольными точками в байтах
+        chunk_size: размер части для чтения
+        verify: 'full' - проверить хешем весь префикс, 'tail' - только участок перед точкой
+            (быстрее, но изменение начала файла без изменения длины останется незамеченным)
+
+    Returns:
+        Список кортежей (сумма штрафов, штраф по каждому пальцу, общее количество символов)
+        в порядке раскладок
+    """
+    if verify not in VERIFY_MODES:
+        raise ValueError(f"Неизвестный режим проверки: {verify}")
+    if detect_compression(filename):
+        raise ValueError(f"Контрольные точки не поддерживаются для сжатых файлов: {filename}")
+    encoding_name = codecs.lookup(encoding).name
+    utf8 = encoding_name == 'utf-8'
+    single_byte = False
+    if not utf8:
+        from engine import single_byte_points
+        single_byte = single_byte_points(encoding) is not None
+        if not single_byte:
+            raise ValueError(f"Контрольные точки поддерживаются только для UTF-8 и однобайтовых кодировок: {encoding}")
+
+    compiled = [compile_layout(layout_config) for layout_config in layouts]
+    analyzers = [Analyzer(layout, engine, encoding) for layout in compiled]
+    path = path or checkpoint_path(filename)
+    key = _checkpoint_key(compiled, encoding_name)
+    stored = load_checkpoints(path)
+    entry = stored.setdefault(key, {'chain': [], 'states': {}})
+    chain, states = entry['chain'], entry['states']
+
+    def feed(data):
+        if engine == 'numpy' and single_byte:
+            for analyzer in analyzers:
+                analyzer.feed(data)
+            return
+        text = data.decode(encoding).replace('\r\n', '\n').replace('\r', '\n')
+        if engine == 'numpy':
+            from engine import text_points
+            points = text_points(text)
+            for analyzer in analyzers:
+                analyzer.feed_points(points)
+        else:
+            for analyzer in analyzers:
+                analyzer.feed(text)
+
+    def add_checkpoint(offset, segment):
+        chain.append([offset, _chain(chain[-1][1] if chain else '', segment.digest())])
+        states[str(offset)] = [analyzer.state.to_dict() for analyzer in analyzers]
+        for stale in sorted(states, key=int)[:-MAX_STATES]:
+            del states[stale]
+        save_checkpoints(path, stored)
+
+    with open(filename, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        index = _last_valid(file, size, chain, states, verify, chunk_size)
+        dropped = len(chain) - index - 1
+        del chain[index + 1:]
+        offset = chain[index][0] if index >= 0 else 0
+        for stale in [saved for saved in states if int(saved) > offset]:
+            del states[stale]
+        if index >= 0:
+            for analyzer, data in zip(analyzers, states[str(offset)]):
+                analyzer.state = AnalysisState.from_dict(analyzer.compiled, data)
+
+        file.seek(offset)
+        segment = hashlib.blake2b(digest_size=HASH_SIZE)
+        next_checkpoint = offset + interval
+        tail = b''
+        for data in iter(lambda: file.read(chunk_size), b''):
+            data = tail + data
+            end = _safe_end(data, utf8)
+            tail = data[end:]
+            if end:
+                feed(data[:end])
+                segment.update(data[:end])
+                offset += end
+            if offset >= next_checkpoint:
+                add_checkpoint(offset, segment)
+                segment = hashlib.blake2b(digest_size=HASH_SIZE)
+                next_checkpoint = offset + interval
+
+    if offset > (chain[-1][0] if chain else 0):
+        add_checkpoint(offset, segment)
+    elif dropped:
+        save_checkpoints(path, stored)
+
+    if tail:
+        feed(tail)
+    for analyzer in analyzers:
+        analyzer.close()
+    return [analyzer.result() for analyzer in analyzers]
@@ -0,0 +1,209 @@
+import hashlib
+from array import array
+from layout import left_hand, shift_symbols
+
+SKIP, SPACE, SHIFT, ALT, NEWLINE, PLAIN = range(6)
+
+BMP_SIZE = 0x10000
+
+_compiled_cache = {}
+_upper_chars = None
+
+
+def classify_char(char, layout_config):
+    """
+    Определяет, в какую ветку analyze_text попадёт символ
+
+    Args:
+        char: символ текста
+        layout_config: данные раскладки
+
+    Returns:
+        Тип нажатия и символ раскладки, по которому ищется позиция (или None)
+    """
+    layout = layout_config['layout']
+
+    if char not in layout and char != ' ' and char != '\n' and not (char.isupper() or char in shift_symbols):
+        return SKIP, None
+    if char == ' ':
+        return SPACE, None
+    if char.isupper() or char in shift_symbols:
+        lower_char = char.lower()
+        if lower_char not in layout:
+            return SKIP, None
+        return SHIFT, lower_char
+    if char in layout_config.get('alt_symbols', ()):
+        return ALT, char
+    if char == '\n':
+        return NEWLINE, None
+    return PLAIN, char
+
+
+def _uppercase_by_lower():
+    """
+    Собирает для символов BMP соответствие: строчный символ -> список заглавных
+
+    Returns:
+        Словарь строчный символ -> список заглавных символов
+    """
+    global _upper_chars
+    if _upper_chars is None:
+        _upper_chars = {}
+        for char in filter(str.isupper, map(chr, range(BMP_SIZE))):
+            _upper_chars.setdefault(char.lower(), []).append(char)
+    return _upper_chars
+
+
+def layout_digest(layout_config):
+    """
+    Вычисляет хеш содержимого раскладки (имя, позиции, домашний ряд, пальцы, alt-символы)
+
+    Args:
+        layout_config: данные раскладки
+
+    Returns:
+        Шестнадцатеричная строка хеша
+    """
+    parts = (
+        layout_config['name'],
+        sorted(layout_config['layout'].items()),
+        list(layout_config['home_positions'].items()),
+        sorted(layout_config['finger_assignment'].items()),
+        sorted(layout_config.get('alt_symbols', ())),
+    )
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class CompiledLayout:
+    """
+    Раскладка, переведённая в плотные таблицы: вместо строк пальцев и
+    кортежей позиций - целые номера пальцев и клавиш.
+
+    Каждому учитываемому символу текста присвоен код (0 - символ пропускается).
+    По коду в массивах kind, finger, key лежат тип нажатия, номер пальца и номер клавиши;
+    shifted и alt - флаги нажатия с Shift и с Alt.
+    Для быстрого цикла на Python те же данные собраны в словарь entries:
+    символ -> (тип нажатия, палец, клавиша, рука пальца).
+    """
+
+    __slots__ = (
+        'name', 'config', 'digest',
+        'fingers', 'finger_index', 'finger_hand', 'f1l', 'f1r', 'f5l', 'f5r',
+        'positions', 'key_index', 'n_keys', 'home_keys', 'cost',
+        'chars', 'char_code', 'kind', 'finger', 'key', 'shifted', 'alt', 'entries',
+        'arrays',
+    )
+
+    def __init__(self, layout_config, digest=None):
+        layout = layout_config['layout']
+        home_positions = layout_config['home_positions']
+
+        self.name = layout_config['name']
+        self.config = layout_config
+        self.digest = digest or layout_digest(layout_config)
+
+        self.fingers = tuple(home_positions)
+        self.finger_index = {f: i for i, f in enumerate(self.fingers)}
+        self.finger_hand = array('b', [0 if f in left_hand else 1 for f in self.fingers])
+        self.f1l = self.finger_index['f1l']
+        self.f1r = self.finger_index['f1r']
+        self.f5l = self.finger_index['f5l']
+        self.f5r = self.finger_index['f5r']
+
+        self.positions = tuple(sorted(set(layout.values()) | set(home_positions.values())))
+        self.key_index = {pos: i for i, pos in enumerate(self.positions)}
+        self.n_keys = len(self.positions)
+        self.home_keys = array('i', [self.key_index[home_positions[f]] for f in self.fingers])
+        self.cost = array('i', [abs(r1 - r2) + abs(c1 - c2)
+                                for r1, c1 in self.positions for r2, c2 in self.positions])
+
+        candidates = {' ', '\n'} | set(shift_symbols)
+        uppers = _uppercase_by_lower()
+        for key in layout:
+            if len(key) == 1:
+                candidates.add(key)
+                candidates.update(uppers.get(key, ()))
+
+        self.chars = [None]
+        self.kind = array('b', [SKIP])
+        self.finger = array('b', [0])
+        self.key = array('i', [0])
+        self.entries = {}
+        for char in sorted(candidates):
+            kind, key_char = classify_char(char, layout_config)
+            if kind != SKIP:
+                self._add_char(char, kind, key_char)
+
+        self.char_code = {char: code for code, char in enumerate(self.chars) if char is not None}
+        self.shifted = array('b', [kind == SHIFT for kind in self.kind])
+        self.alt = array('b', [kind == ALT for kind in self.kind])
+        self.arrays = None
+
+    def _add_char(self, char, kind, key_char):
+        """
+        Добавляет учитываемый символ в таблицы раскладки
+
+        Args:
+            char: символ текста
+            kind: тип нажатия
+            key_char: символ раскладки, по которому ищется позиция
+        """
+        if kind == SPACE:
+            finger, key = self.f1l, 0
+        elif kind == NEWLINE:
+            finger, key = self.f5r, 0
+        else:
+            finger = self.finger_index[self.config['finger_assignment'].get(key_char, 'f1l')]
+            key = self.key_index[self.config['layout'][key_char]]
+
+        self.chars.append(char)
+        self.kind.append(kind)
+        self.finger.append(finger)
+        self.key.append(key)
+        self.entries[char] = (kind, finger, key, self.finger_hand[finger])
+
+    def code_of(self, char):
+        """
+        Возвращает код символа, классифицируя новые символы вне BMP при первом обращении
+
+        Args:
+            char: символ текста
+
+        Returns:
+            Код символа (0 - символ пропускается)
+        """
+        code = self.char_code.get(char)
+        if code is None:
+            kind, key_char = classify_char(char, self.config)
+            if kind == SKIP:
+                self.char_code[char] = 0
+                return 0
+            self._add_char(char, kind, key_char)
+            code = self.char_code[char] = len(self.chars) - 1
+            self.shifted.append(kind == SHIFT)
+            self.alt.append(kind == ALT)
+            self.arrays = None
+        return code
+
+    def __repr__(self):
+        return f"CompiledLayout({self.name!r}, keys={self.n_keys}, chars={len(self.char_code)})"
+
+
+def compile_layout(layout_config):
+    """
+    Компилирует раскладку в плотные таблицы. Результат кешируется по хешу
+    содержимого, поэтому повторные вызовы для одинаковых раскладок ничего не стоят
+
+    Args:
+        layout_config: данные раскладки
+
+    Returns:
+        CompiledLayout
+    """
+    if isinstance(layout_config, CompiledLayout):
+        return layout_config
+    digest = layout_digest(layout_config)
+    compiled = _compiled_cache.get(digest)
+    if compiled is None:
+        compiled = _compiled_cache[digest] = CompiledLayout(layout_config, digest)
+    return compiled
@@ -0,0 +1,129 @@
+# Сигнатуры в начале файла: по ним сжатие определяется независимо от расширения.
+# Модули распаковки и потоков импортируются только для файлов, которым они нужны
+MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zst'),
+)
+PREFETCH = 4
+
+_END = object()
+
+
+def detect_compression(filename):
+    """
+    Определяет сжатие файла по первым байтам. У bz2 после 'BZh' должен идти размер блока '1'-'9',
+    чтобы текстовый файл, начинающийся с 'BZh', не считался сжатым
+
+    Args:
+        filename: путь к файлу
+
+    Returns:
+        'gzip', 'bz2', 'xz', 'zst' или None для несжатого файла
+    """
+    with open(filename, 'rb') as file:
+        head = file.read(6)
+    name = next((name for magic, name in MAGIC if head.startswith(magic)), None)
+    if name == 'bz2' and not b'1' <= head[3:4] <= b'9':
+        return None
+    return name
+
+
+def _open_zstd(filename):
+    """
+    Открывает файл zstd: модулем compression.zstd (Python 3.14+) или пакетом zstandard
+    """
+    try:
+        from compression import zstd
+        return zstd.open(filename, 'rb')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Для файлов zstd нужен Python 3.14+ или пакет zstandard (pip install zstandard)")
+    return zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True)
+
+
+def open_compressed(filename, compression=None):
+    """
+    Открывает сжатый файл для потокового чтения распакованных байтов (без временных файлов)
+
+    Args:
+        filename: путь к файлу
+        compression: сжатие (None - определить по сигнатуре)
+
+    Returns:
+        Бинарный поток с распакованными данными (для несжатого файла - сам файл)
+    """
+    compression = compression or detect_compression(filename)
+    if compression == 'gzip':
+        import gzip
+        return gzip.open(filename, 'rb')
+    if compression == 'bz2':
+        import bz2
+        return bz2.open(filename, 'rb')
+    if compression == 'xz':
+        import lzma
+        return lzma.open(filename, 'rb')
+    if compression == 'zst':
+        return _open_zstd(filename)
+    return open(filename, 'rb')
+
+
+def decompressed_chunks(filename, chunk_size=1024 * 1024, compression=None, prefetch=PREFETCH):
+    """
+    Распаковывает файл в фоновом потоке и выдаёт распакованные части по мере готовности.
+    zlib, bz2 и lzma отпускают GIL во время распаковки, поэтому распаковка следующих частей
+    идёт одновременно с подсчётом текущей, и общее время близко к времени более медленной стадии.
+    Очередь ограничена prefetch частями, так что память не зависит от размера файла
+
+    Args:
+        filename: путь к файлу
+        chunk_size: размер распакованной части
+        compression: сжатие (None - определить по сигнатуре)
+        prefetch: сколько частей может ждать в очереди
+
+    Returns:
+        Генератор байтов; ошибка распаковки выбрасывается в потоке, читающем генератор
+    """
+    import queue
+    import threading
+
+    chunks = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            with open_compressed(filename, compression) as file:
+                for data in iter(lambda: file.read(chunk_size), b''):
+                    if not put(data):
+                        return
+        except BaseException as e:
+            put(e)
+            return
+        put(_END)
+
+    thread = threading.Thread(target=produce, name='decompress', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
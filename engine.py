@@ -0,0 +1,514 @@
+import codecs
+import mmap
+import os
+import numpy as np
+from compiled_layout import compile_layout, BMP_SIZE, SHIFT, ALT, NEWLINE, PLAIN, SPACE
+from analyzer import AnalysisState
+
+_single_byte_cache = {}
+
+
+class _Tables:
+    """
+    Таблицы скомпилированной раскладки в виде массивов NumPy
+    и таблица перевода кодовых точек BMP в коды символов
+    """
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self.fingers = compiled.fingers
+        self.f1l, self.f1r, self.f5l, self.f5r = compiled.f1l, compiled.f1r, compiled.f5l, compiled.f5r
+        self.n_keys = compiled.n_keys
+        self.cost = np.array(compiled.cost, dtype=np.int32)
+        self.home_keys = np.array(compiled.home_keys, dtype=np.int32)
+        self.finger_hand = np.array(compiled.finger_hand, dtype=np.int8)
+
+        self.kind = np.array(compiled.kind, dtype=np.int8)
+        self.finger = np.array(compiled.finger, dtype=np.int8)
+        self.key = np.array(compiled.key, dtype=np.int32)
+
+        self.exit_hand = self.finger_hand[self.finger]
+        self.entry_hand = self.exit_hand.copy()
+        self.entry_hand[self.kind == SPACE] = 0
+        self.entry_hand[(self.kind == NEWLINE) | (self.kind == ALT)] = 1
+        self.entry_hand[self.kind == SHIFT] = -1
+        self.entry_finger = np.where(self.kind == ALT, self.f1r, self.finger).astype(np.int8)
+        self.moves = (self.kind == SHIFT) | (self.kind == ALT) | (self.kind == PLAIN)
+        self.alt_left = ((self.kind == ALT) & (self.exit_hand == 0)).astype(np.int64)
+        self.chars = np.select([self.kind == SHIFT, self.kind == ALT, self.kind != 0], [2, 2, 1], 0)
+
+        # Клавиши для статистики KeyStats: пробел, enter, shift и alt нажимаются на своих позициях раскладки
+        layout, home_positions = compiled.config['layout'], compiled.config['home_positions']
+        self.space_key, self.enter_key, self.lshift_key, self.rshift_key, self.alt_key = (
+            compiled.key_index[layout.get(name, home_positions[finger])]
+            for name, finger in ((' ', 'f1l'), ('enter', 'f5r'), ('shift', 'f5l'), ('SHIFT', 'f5r'), ('alt', 'f1r')))
+        self.slot = self.key.copy()
+        self.slot[self.kind == SPACE] = self.space_key
+        self.slot[self.kind == NEWLINE] = self.enter_key
+        self.entry_slot = np.where(self.kind == ALT, self.alt_key, self.slot)
+        self.own_penalty = np.select([self.kind == SPACE, self.kind == NEWLINE], [1, 2], 0) + self.alt_left
+
+        self.lut = np.zeros(BMP_SIZE, dtype=np.uint16)
+        for char, code in compiled.char_code.items():
+            if ord(char) < BMP_SIZE:
+                self.lut[ord(char)] = code
+        self.byte_tables = {}
+
+    def byte_codes(self, encoding):
+        """
+        Возвращает таблицу из 256 элементов: байт однобайтовой кодировки -> код символа раскладки
+
+        Args:
+            encoding: однобайтовая кодировка (см. single_byte_points)
+
+        Returns:
+            Массив кодов uint16
+        """
+        table = self.byte_tables.get(encoding)
+        if table is None:
+            table = self.byte_tables[encoding] = self.lookup(single_byte_points(encoding)[0])
+        return table
+
+    def codes(self, points):
+        """
+        Переводит кодовые точки текста в массив кодов символов раскладки,
+        пропуская неучитываемые символы
+
+        Args:
+            points: кодовые точки текста (см. text_points)
+
+        Returns:
+            Массив кодов (без нулевого кода пропуска)
+        """
+        codes = self.lookup(points)
+        return codes[codes != 0]
+
+    def lookup(self, points):
+        """
+        Переводит кодовые точки текста в коды символов раскладки один к одному
+
+        Args:
+            points: кодовые точки текста (см. text_points)
+
+        Returns:
+            Массив кодов той же длины (0 - символ пропускается)
+        """
+        astral = np.flatnonzero(points >= BMP_SIZE)
+        if len(astral):
+            points = points.copy()
+            astral_points = points[astral]
+            points[astral] = 0
+            codes = self.lut[points]
+            for point in np.unique(astral_points):
+                code = self.compiled.code_of(chr(int(point)))
+                if code:
+                    codes[astral[astral_points == point]] = code
+        else:
+            codes = self.lut[points]
+        return codes
+
+
+def single_byte_points(encoding):
+    """
+    Проверяет, что кодировка однобайтовая (каждый байт - ровно один символ,
+    '\\r' и '\\n' на своих местах), и строит для неё таблицу байт -> кодовая точка
+
+    Args:
+        encoding: название кодировки
+
+    Returns:
+        Пара (кодовые точки uint32 для 256 байтов, флаги определённых байтов)
+        или None для многобайтовых кодировок
+    """
+    name = codecs.lookup(encoding).name
+    if name not in _single_byte_cache:
+        decoder = codecs.getincrementaldecoder(name)()
+        points = np.zeros(256, dtype=np.uint32)
+        defined = np.ones(256, dtype=bool)
+        result = points, defined
+        for byte in range(256):
+            try:
+                chars = decoder.decode(bytes([byte]))
+            except UnicodeDecodeError:
+                decoder.reset()
+                defined[byte] = False
+                continue
+            if len(chars) != 1:
+                result = None
+                break
+            points[byte] = ord(chars)
+        if result is not None and (points[10] != 10 or points[13] != 13):
+            result = None
+        _single_byte_cache[name] = result
+    return _single_byte_cache[name]
+
+
+def text_points(text):
+    """
+    Переводит текст в массив кодовых точек. Не зависит от раскладки,
+    поэтому один массив можно передать в analyze_points_numpy для нескольких раскладок
+
+    Args:
+        text: текст для анализа
+
+    Returns:
+        Массив кодовых точек uint32
+    """
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+
+def _char_boundary(mapped, position, end):
+    """
+    Сдвигает позицию вперёд до начала символа UTF-8 так, чтобы не разорвать пару '\\r\\n'
+
+    Args:
+        mapped: байты файла (mmap)
+        position: исходная позиция
+        end: конец диапазона
+
+    Returns:
+        Позиция границы символа (не дальше end)
+    """
+    if position >= end:
+        return end
+    while position < end and (mapped[position] & 0xC0) == 0x80:
+        position += 1
+    if position < end and mapped[position - 1] == 13 and mapped[position] == 10:
+        position += 1
+    return position
+
+
+def mapped_points(filename, chunk_size=1024 * 1024, start=0, end=None):
+    """
+    Отображает файл в память (mmap) и по частям переводит его в кодовые точки.
+    Части декодируются прямо из отображения, без чтения в промежуточные bytes,
+    поэтому память ограничена размером части, а страницы файла не дублируются в куче процесса.
+    Переводы строк приводятся к '\\n', как при чтении файла в текстовом режиме
+
+    Args:
+        filename: путь к файлу
+        chunk_size: размер части в байтах
+        start: начало диапазона байтов (граница символа)
+        end: конец диапазона байтов (по умолчанию - конец файла)
+
+    Returns:
+        Генератор массивов кодовых точек uint32
+    """
+    with open(filename, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            position = start
+            while position < end:
+                stop = _char_boundary(mapped, position + chunk_size, end)
+                with view[position:stop] as window:
+                    text = codecs.utf_8_decode(window, 'strict', True)[0]
+                if '\r' in text:
+                    text = text.replace('\r\n', '\n').replace('\r', '\n')
+                yield text_points(text)
+                position = stop
+
+
+def layout_tables(layout_config):
+    """
+    Возвращает (и кеширует в скомпилированной раскладке) таблицы для векторизованного движка
+
+    Args:
+        layout_config: данные раскладки или CompiledLayout
+
+    Returns:
+        Таблицы раскладки
+    """
+    compiled = compile_layout(layout_config)
+    if compiled.arrays is None:
+        compiled.arrays = _Tables(compiled)
+    return compiled.arrays
+
+
+def analyze_text_numpy(text, layout_config):
+    """
+    Векторизованный аналог analyze_text: те же штрафы, но без цикла по символам на Python
+
+    Args:
+        text: текст для анализа
+        layout_config: данные расладки
+
+    Returns:
+        Cуммарный штраф, штрафы по каждому пальцу, общее количество обработанных символов
+    """
+    return analyze_points_numpy(text_points(text), layout_config)
+
+
+def analyze_points_numpy(points, layout_config):
+    """
+    Подсчёт штрафов по уже полученным кодовым точкам текста
+
+    Args:
+        points: кодовые точки текста (см. text_points)
+        layout_config: данные расладки
+
+    Returns:
+        Cуммарный штраф, штрафы по каждому пальцу, общее количество обработанных символов
+    """
+    compiled = compile_layout(layout_config)
+    state = AnalysisState(compiled)
+    score_points(points, compiled, state)
+    return state.result(compiled.fingers)
+
+
+def score_points(points, layout_config, state, stats=None, metrics=None):
+    """
+    Векторизованный подсчёт штрафов, продолжающий с переданного состояния
+    (позиции пальцев, рука предыдущего нажатия, счётчики)
+
+    Args:
+        points: кодовые точки текста (см. text_points)
+        layout_config: данные расладки или CompiledLayout
+        state: AnalysisState (изменяется на месте)
+        stats: KeyStats для статистики по клавишам (None - не собирать)
+        metrics: MetricAccumulator для метрик набора (None - не собирать)
+
+    Returns:
+        None
+    """
+    tables = layout_tables(layout_config)
+    score_codes(tables.codes(points), tables.compiled, state, stats, metrics)
+
+
+def score_bytes(data, layout_config, state, encoding, stats=None, metrics=None):
+    """
+    Подсчёт штрафов прямо по байтам однобайтовой кодировки (cp1251, koi8-r и т.п.),
+    без декодирования в str: каждый байт переводится в код символа раскладки
+    одной таблицей из 256 элементов. Одиночный '\\r' считается переводом строки,
+    '\\r\\n' - одним переводом строки, как при чтении файла в текстовом режиме;
+    '\\r' в конце данных считается одиночным
+
+    Args:
+        data: байты текста
+        layout_config: данные раскладки или CompiledLayout
+        state: AnalysisState (изменяется на месте)
+        encoding: однобайтовая кодировка (см. single_byte_points)
+        stats: KeyStats для статистики по клавишам (None - не собирать)
+
+    Returns:
+        None
+    """
+    points, defined = single_byte_points(encoding)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not defined.all() and not defined[raw].all():
+        bytes(data).decode(encoding)
+
+    tables = layout_tables(layout_config)
+    codes = tables.byte_codes(encoding)[raw]
+
+    carriage = np.flatnonzero(raw == 13)
+    if len(carriage):
+        following = carriage + 1
+        at_end = following == len(raw)
+        following[at_end] = 0
+        codes[carriage[at_end | (raw[following] != 10)]] = tables.lut[10]
+
+    score_codes(codes[codes != 0], tables.compiled, state, stats, metrics)
+
+
+def score_codes(codes, layout_config, state, stats=None, metrics=None):
+    """
+    Подсчёт штрафов по кодам символов раскладки (без кода пропуска), продолжающий
+    с переданного состояния. Со stats те же промежуточные массивы дополнительно
+    раскладываются по клавишам и переходам между пальцами (KeyStats), с metrics -
+    нажатые клавиши передаются в MetricAccumulator
+
+    Args:
+        codes: массив кодов символов (см. _Tables.codes)
+        layout_config: данные расладки или CompiledLayout
+        state: AnalysisState (изменяется на месте)
+        stats: KeyStats (изменяется на месте) или None
+        metrics: MetricAccumulator (изменяется на месте) или None
+
+    Returns:
+        None
+    """
+    tables = layout_tables(layout_config)
+    n_fingers = len(tables.fingers)
+
+    if len(codes) == 0:
+        return
+
+    if state.first_keys is not None and state.first_char is None:
+        state.first_char = tables.compiled.chars[codes[0]]
+    if metrics is not None:
+        metrics.add_keys(tables.slot[codes])
+
+    penalties = np.zeros(n_fingers, dtype=np.int64)
+
+    exit_hand = tables.exit_hand[codes]
+    prev_hand = np.empty(len(codes), dtype=np.int8)
+    prev_hand[0] = state.previous_hand
+    prev_hand[1:] = exit_hand[:-1]
+
+    counts = np.bincount(codes, minlength=len(tables.kind))
+    kind_counts = np.bincount(tables.kind, weights=counts, minlength=6).astype(np.int64)
+
+    penalties[tables.f1l] += kind_counts[SPACE]
+    penalties[tables.f5r] += 2 * kind_counts[NEWLINE]
+    penalties[tables.f1r] += kind_counts[ALT]
+    total_chars = int(kind_counts[SPACE] + kind_counts[NEWLINE] + kind_counts[PLAIN]
+                      + 2 * (kind_counts[SHIFT] + kind_counts[ALT]))
+
+    alt_left = (tables.kind == ALT) & (tables.exit_hand == 0)
+    penalties += np.bincount(tables.finger[alt_left], weights=counts[alt_left],
+                             minlength=n_fingers).astype(np.int64)
+
+    changed = (tables.entry_hand[codes] ^ prev_hand) == 1
+    changed_counts = np.bincount(codes[changed], minlength=len(tables.kind))
+    penalties += np.bincount(tables.entry_finger, weights=changed_counts, minlength=n_fingers).astype(np.int64)
+
+    if stats is not None:
+        n_keys = tables.n_keys
+        stats.presses += np.bincount(tables.slot, weights=counts, minlength=n_keys).astype(np.int64)
+        stats.presses[tables.alt_key] += kind_counts[ALT]
+        key_penalties = np.bincount(tables.slot, weights=counts * tables.own_penalty, minlength=n_keys)
+        key_penalties += np.bincount(tables.entry_slot, weights=changed_counts, minlength=n_keys)
+        key_penalties[tables.alt_key] += kind_counts[ALT]
+
+        fingers = tables.finger[codes].astype(np.intp)
+        transitions = fingers[:-1] * n_fingers
+        transitions += fingers[1:]
+        stats.transitions += np.bincount(transitions, minlength=n_fingers * n_fingers).reshape(n_fingers, n_fingers)
+        if stats.last_finger >= 0:
+            stats.transitions[stats.last_finger, fingers[0]] += 1
+        stats.last_finger = int(fingers[-1])
+
+    shifted = np.flatnonzero(tables.kind[codes] == SHIFT)
+    if len(shifted):
+        shift_hand = (prev_hand[shifted] == 1).view(np.int8)
+        shift_right = int(np.count_nonzero(shift_hand))
+        penalties[tables.f5r] += shift_right
+        penalties[tables.f5l] += len(shifted) - shift_right
+        shift_codes = codes[shifted]
+        switched = shift_codes[tables.exit_hand[shift_codes] != shift_hand]
+        penalties += np.bincount(tables.finger[switched], minlength=n_fingers)
+        if stats is not None:
+            for key, shifts in ((tables.rshift_key, shift_right), (tables.lshift_key, len(shifted) - shift_right)):
+                stats.presses[key] += shifts
+                key_penalties[key] += shifts
+            key_penalties += np.bincount(tables.slot[switched], minlength=n_keys)
+
+    move_codes = codes[tables.moves[codes]]
+    if len(move_codes):
+        move_finger = tables.finger[move_codes]
+        order = np.argsort(move_finger, kind='stable')
+        sorted_finger = move_finger[order]
+        sorted_key = tables.key[move_codes[order]]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_finger)) + 1))
+        ends = np.append(starts[1:], len(sorted_key)) - 1
+        moved_fingers = sorted_finger[starts]
+
+        if state.first_keys is not None:
+            for finger, key in zip(moved_fingers.tolist(), sorted_key[starts].tolist()):
+                if state.first_keys[finger] is None:
+                    state.first_keys[finger] = key
+
+        previous_key = np.empty_like(sorted_key)
+        previous_key[1:] = sorted_key[:-1]
+        previous_key[starts] = np.array(state.positions, dtype=np.int32)[moved_fingers]
+        previous_key *= tables.n_keys
+        previous_key += sorted_key
+        movement = tables.cost[previous_key]
+        penalties[moved_fingers] += np.add.reduceat(movement, starts, dtype=np.int64)
+        if stats is not None:
+            key_penalties += np.bincount(sorted_key, weights=movement, minlength=n_keys)
+
+        for finger, key in zip(moved_fingers.tolist(), sorted_key[ends].tolist()):
+            state.positions[finger] = key
+
+    for finger, penalty in enumerate(penalties.tolist()):
+        state.penalties[finger] += penalty
+    if stats is not None:
+        stats.penalties += key_penalties.astype(np.int64)
+    state.previous_hand = int(exit_hand[-1])
+    state.total_chars += total_chars
+
+
+def score_ngrams(ngrams, weights, layout_config):
+    """
+    Векторизованный подсчёт частотного списка: каждая n-грамма набирается
+    с домашних позиций без предыдущего нажатия, а её штрафы и символы
+    умножаются на вес. Все n-граммы обрабатываются одним проходом по массивам
+
+    Args:
+        ngrams: список n-грамм
+        weights: список весов (количеств) той же длины
+        layout_config: данные раскладки
+
+    Returns:
+        Cуммарный штраф, штрафы по каждому пальцу, общее количество обработанных символов
+    """
+    tables = layout_tables(layout_config)
+    n_fingers = len(tables.fingers)
+    lengths = np.fromiter(map(len, ngrams), dtype=np.int64, count=len(ngrams))
+    points = text_points(''.join(ngrams))
+    raw_codes = tables.lookup(points)
+    tables = layout_tables(tables.compiled)
+
+    kept = np.flatnonzero(raw_codes)
+    codes = raw_codes[kept]
+    segment = np.repeat(np.arange(len(ngrams)), lengths)[kept]
+    weight = np.asarray(weights, dtype=np.int64)[segment]
+    penalties = np.zeros(n_fingers, dtype=np.int64)
+
+    if len(codes) == 0:
+        return 0, {f: 0 for f in tables.fingers}, 0
+
+    code_weights = np.zeros(len(tables.kind), dtype=np.int64)
+    np.add.at(code_weights, codes, weight)
+    kind_weights = np.zeros(6, dtype=np.int64)
+    np.add.at(kind_weights, tables.kind, code_weights)
+    penalties[tables.f1l] += kind_weights[SPACE]
+    penalties[tables.f5r] += 2 * kind_weights[NEWLINE]
+    penalties[tables.f1r] += kind_weights[ALT]
+    np.add.at(penalties, tables.finger, code_weights * tables.alt_left)
+    total_chars = int((code_weights * tables.chars).sum())
+
+    exit_hand = tables.exit_hand[codes]
+    prev_hand = np.empty(len(codes), dtype=np.int8)
+    prev_hand[0] = -1
+    prev_hand[1:] = exit_hand[:-1]
+    prev_hand[1:][segment[1:] != segment[:-1]] = -1
+
+    changed = (tables.entry_hand[codes] ^ prev_hand) == 1
+    np.add.at(penalties, tables.entry_finger[codes[changed]], weight[changed])
+
+    shifted = np.flatnonzero(tables.kind[codes] == SHIFT)
+    if len(shifted):
+        shift_hand = (prev_hand[shifted] == 1).view(np.int8)
+        shift_weight = weight[shifted]
+        penalties[tables.f5r] += shift_weight[shift_hand == 1].sum()
+        penalties[tables.f5l] += shift_weight[shift_hand == 0].sum()
+        shift_codes = codes[shifted]
+        switched = tables.exit_hand[shift_codes] != shift_hand
+        np.add.at(penalties, tables.finger[shift_codes[switched]], shift_weight[switched])
+
+    moving = np.flatnonzero(tables.moves[codes])
+    if len(moving):
+        move_codes = codes[moving]
+        move_finger = tables.finger[move_codes]
+        order = np.argsort(move_finger, kind='stable')
+        sorted_finger = move_finger[order]
+        sorted_key = tables.key[move_codes[order]]
+        sorted_segment = segment[moving][order]
+        starts = np.concatenate(([0], np.flatnonzero((np.diff(sorted_finger) != 0)
+                                                      | (np.diff(sorted_segment) != 0)) + 1))
+
+        previous_key = np.empty_like(sorted_key)
+        previous_key[1:] = sorted_key[:-1]
+        previous_key[starts] = tables.home_keys[sorted_finger[starts]]
+        previous_key *= tables.n_keys
+        previous_key += sorted_key
+        movement = tables.cost[previous_key] * weight[moving][order]
+        np.add.at(penalties, sorted_finger, movement)
+
+    finger_penalties = {f: int(p) for f, p in zip(tables.fingers, penalties)}
+    return int(penalties.sum()), finger_penalties, total_chars
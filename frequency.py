@@ -0,0 +1,119 @@
+import io
+from analyzer import AnalysisState, score_text
+from compiled_layout import compile_layout
+from compressed import detect_compression, open_compressed
+
+
+def parse_frequency_line(line):
+    """
+    Разбирает строку частотного списка вида '<n-грамма> [количество]'
+
+    Args:
+        line: строка файла
+
+    Returns:
+        Пара (n-грамма, количество) или None для пустых строк, комментариев и заголовков
+    """
+    tokens = line.split()
+    if not tokens or tokens[0].startswith('#'):
+        return None
+    if len(tokens) == 1:
+        return tokens[0], 1
+    if tokens[-1].isdigit():
+        return ' '.join(tokens[:-1]), int(tokens[-1])
+    return None
+
+
+def read_frequency_file(filename, encoding='utf-8'):
+    """
+    Читает частотный список (в том числе сжатый gzip, bz2, xz, zstd) и суммирует
+    количества одинаковых n-грамм
+
+    Args:
+        filename: путь к файлу
+        encoding: кодировка файла
+
+    Returns:
+        Словарь n-грамма -> суммарное количество
+    """
+    compression = detect_compression(filename)
+    if compression:
+        with io.TextIOWrapper(open_compressed(filename, compression), encoding=encoding) as file:
+            return count_frequency_lines(file)
+    with open(filename, 'r', encoding=encoding) as file:
+        return count_frequency_lines(file)
+
+
+def count_frequency_lines(lines):
+    """
+    Суммирует количества одинаковых n-грамм в строках частотного списка
+
+    Args:
+        lines: итерируемый объект со строками частотного списка
+
+    Returns:
+        Словарь n-грамма -> суммарное количество
+    """
+    counts = {}
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) == 2 and tokens[1].isdigit() and not tokens[0].startswith('#'):
+            ngram, count = tokens[0], int(tokens[1])
+        else:
+            entry = parse_frequency_line(line)
+            if entry is None:
+                continue
+            ngram, count = entry
+        counts[ngram] = counts.get(ngram, 0) + count
+    return counts
+
+
+def score_frequencies(counts, layout_config, engine='python'):
+    """
+    Считает штрафы частотного списка: каждая различная n-грамма набирается
+    один раз с домашних позиций, а её штрафы умножаются на количество
+
+    Args:
+        counts: словарь n-грамма -> количество
+        layout_config: данные раскладки
+        engine: 'python' - цикл по n-граммам, 'numpy' - engine.score_ngrams
+
+    Returns:
+        Cуммарный штраф, штрафы по каждому пальцу, общее количество обработанных символов
+    """
+    if engine == 'numpy':
+        from engine import score_ngrams
+        return score_ngrams(list(counts), list(counts.values()), layout_config)
+
+    compiled = compile_layout(layout_config)
+    totals = [0] * len(compiled.fingers)
+    total_chars = 0
+
+    for ngram, count in counts.items():
+        state = AnalysisState(compiled)
+        score_text(compiled, ngram, state)
+        if state.total_chars:
+            for finger, penalty in enumerate(state.penalties):
+                if penalty:
+                    totals[finger] += penalty * count
+            total_chars += state.total_chars * count
+
+    return sum(totals), dict(zip(compiled.fingers, totals)), total_chars
+
+
+def analyze_frequency_file_multi(filename, layouts, engine='python', encoding='utf-8'):
+    """
+    Анализ частотного списка (например, 1grams-3.txt или digramms.txt) сразу для нескольких раскладок
+
+    Args:
+        filename: путь к файлу
+        layouts: список данных раскладок
+        engine: движок подсчёта - 'python' или 'numpy'
+        encoding: кодировка файла
+
+    Returns:
+        Список кортежей (сумма штрафов, штраф по каждому пальцу, общее количество символов)
+        в порядке раскладок
+    """
+    counts = read_frequency_file(filename, encoding)
+    return [score_frequencies(counts, layout_config, engine) for layout_config in layouts]
@@ -0,0 +1,179 @@
+import contextlib
+import json
+import time
+from compiled_layout import SKIP, SPACE, SHIFT, ALT, NEWLINE, PLAIN
+
+BRANCHES = {SKIP: 'skipped', SPACE: 'space', SHIFT: 'shift', ALT: 'alt', NEWLINE: 'newline', PLAIN: 'plain'}
+
+_idle = contextlib.nullcontext()
+
+
+class _Timer:
+    """
+    Накопитель времени одной фазы: настенное время, процессорное время и количество вызовов
+    """
+
+    __slots__ = ('wall', 'cpu', 'calls')
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+
+    @contextlib.contextmanager
+    def measure(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.wall += time.perf_counter() - wall
+            self.cpu += time.process_time() - cpu
+            self.calls += 1
+
+    def to_dict(self):
+        return {'wall': self.wall, 'cpu': self.cpu, 'calls': self.calls}
+
+
+class FileProfile:
+    """
+    Замеры по одному файлу: время фаз (чтение и декодирование, подсчёт по каждой раскладке),
+    количество байтов текста (для сжатого файла - распакованных) и символов, нажатия по веткам подсчёта
+    для каждой раскладки. Символы и ветки считаются только при обычном чтении текста в одном процессе;
+    если путь подсчёта (workers, freq, контрольные точки) их не собирает, в отчёте вместо них None
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.bytes = None
+        self.chars = None
+        self.phases = {}
+        self.layouts = {}
+
+    def phase(self, name, layout=None):
+        """
+        Возвращает контекстный менеджер, добавляющий время блока к фазе
+
+        Args:
+            name: название фазы ('total' - вся обработка файла, 'read' - чтение и декодирование,
+                'score' - подсчёт, 'parallel', 'freq', 'incremental')
+            layout: название раскладки, если фаза относится к ней
+
+        Returns:
+            Контекстный менеджер
+        """
+        phases = self.phases if layout is None else self._layout(layout)['phases']
+        timer = phases.get(name)
+        if timer is None:
+            timer = phases[name] = _Timer()
+        return timer.measure()
+
+    def count_bytes(self, size):
+        """
+        Учитывает прочитанные байты текста
+
+        Args:
+            size: количество байтов
+        """
+        self.bytes = (self.bytes or 0) + size
+
+    def count_text(self, text, layouts):
+        """
+        Учитывает часть текста: количество символов и нажатия по веткам для каждой раскладки
+
+        Args:
+            text: строка или кодовые точки (см. engine.text_points)
+            layouts: список данных раскладок
+        """
+        import numpy as np
+        from engine import layout_tables, text_points
+
+        points = text_points(text) if isinstance(text, str) else text
+        self.chars = (self.chars or 0) + len(points)
+        for layout_config in layouts:
+            tables = layout_tables(layout_config)
+            codes = tables.lookup(points)
+            tables = layout_tables(tables.compiled)
+            counts = self._layout(tables.compiled.name)['branches']
+            for kind, count in enumerate(np.bincount(tables.kind[codes], minlength=len(BRANCHES)).tolist()):
+                counts[BRANCHES[kind]] += count
+
+    def _layout(self, name):
+        if name not in self.layouts:
+            self.layouts[name] = {'phases': {}, 'branches': dict.fromkeys(BRANCHES.values(), 0)}
+        return self.layouts[name]
+
+    def to_dict(self):
+        total = self.phases.get('total', _Timer())
+        wall = total.wall
+        return {
+            'bytes': self.bytes,
+            'chars': self.chars,
+            'wall': wall,
+            'cpu': total.cpu,
+            'bytes_per_sec': self.bytes / wall if wall and self.bytes is not None else None,
+            'chars_per_sec': self.chars / wall if wall and self.chars is not None else None,
+            'phases': {name: timer.to_dict() for name, timer in self.phases.items()},
+            'layouts': {name: {'phases': {phase: timer.to_dict() for phase, timer in data['phases'].items()},
+                               'branches': data['branches'] if self.chars is not None else None}
+                        for name, data in self.layouts.items()},
+        }
+
+
+class RunProfile:
+    """
+    Замеры всего запуска (включается флагом --profile): профили файлов
+    и общие фазы, например построение графиков matplotlib
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.phases = {}
+
+    def file(self, filename):
+        """
+        Возвращает профиль файла, создавая его при первом обращении
+        """
+        if filename not in self.files:
+            self.files[filename] = FileProfile(filename)
+        return self.files[filename]
+
+    def phase(self, name):
+        """
+        Возвращает контекстный менеджер, добавляющий время блока к общей фазе
+        """
+        timer = self.phases.get(name)
+        if timer is None:
+            timer = self.phases[name] = _Timer()
+        return timer.measure()
+
+    def to_dict(self):
+        return {
+            'files': {filename: profile.to_dict() for filename, profile in self.files.items()},
+            'phases': {name: timer.to_dict() for name, timer in self.phases.items()},
+        }
+
+    def write(self, filename):
+        """
+        Записывает замеры в файл JSON
+        """
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+
+
+def timed(profile, name, layout=None):
+    """
+    Возвращает фазу профиля или пустой контекстный менеджер, если профилирование выключено
+
+    Args:
+        profile: FileProfile, RunProfile или None
+        name: название фазы
+        layout: название раскладки (только для FileProfile)
+
+    Returns:
+        Контекстный менеджер
+    """
+    if profile is None:
+        return _idle
+    if layout is None:
+        return profile.phase(name)
+    return profile.phase(name, layout)
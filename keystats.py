@@ -0,0 +1,78 @@
+import numpy as np
+
+SPECIAL_LABELS = {' ': '␣', 'space': 'space', 'alt': 'alt', 'shift': 'shift', 'SHIFT': 'SHIFT', 'enter': 'enter'}
+
+
+def key_labels(layout_config):
+    """
+    Подписи клавиш для тепловой карты: первый символ раскладки на каждой позиции
+    (строчные буквы в раскладках идут раньше заглавных), служебные клавиши - по названию
+
+    Args:
+        layout_config: данные раскладки
+
+    Returns:
+        Словарь позиция (ряд, колонка) -> подпись
+    """
+    labels = {}
+    for char, position in layout_config['layout'].items():
+        if position not in labels:
+            labels[position] = SPECIAL_LABELS.get(char, char)
+    return labels
+
+
+class KeyStats:
+    """
+    Статистика по клавишам, которую движок numpy накапливает в том же проходе, что и штрафы
+    (см. engine.score_codes): количество нажатий и вклад в штраф каждой клавиши раскладки
+    (пробел, enter, shift и alt - на своих клавишах) и матрица переходов между пальцами:
+    transitions[i, j] - сколько раз за символом, набранным пальцем i, шёл символ пальца j.
+    Сумма penalties равна суммарному штрафу
+    """
+
+    def __init__(self, compiled):
+        self.name = compiled.name
+        self.positions = list(compiled.positions)
+        self.fingers = compiled.fingers
+        self.labels = key_labels(compiled.config)
+        self.presses = np.zeros(compiled.n_keys, dtype=np.int64)
+        self.penalties = np.zeros(compiled.n_keys, dtype=np.int64)
+        self.transitions = np.zeros((len(self.fingers), len(self.fingers)), dtype=np.int64)
+        self.last_finger = -1
+
+    def grid(self, values):
+        """
+        Раскладывает значения по клавишам в сетку (ряд, колонка) раскладки
+
+        Args:
+            values: массив значений в порядке positions (например, presses или penalties)
+
+        Returns:
+            Двумерный массив float, NaN - на позициях без клавиш
+        """
+        rows = max(row for row, _ in self.positions) + 1
+        columns = max(column for _, column in self.positions) + 1
+        grid = np.full((rows, columns), np.nan)
+        for (row, column), value in zip(self.positions, values):
+            grid[row, column] = value
+        return grid
+
+    def by_key(self):
+        """
+        Returns:
+            Словарь подпись клавиши -> (нажатия, штраф), по убыванию штрафа
+        """
+        keys = sorted(range(len(self.positions)), key=lambda i: -self.penalties[i])
+        return {self.labels.get(self.positions[i], str(self.positions[i])): (int(self.presses[i]),
+                                                                             int(self.penalties[i]))
+                for i in keys if self.presses[i] or self.penalties[i]}
+
+    def to_dict(self):
+        return {
+            'layout': self.name,
+            'keys': [{'position': list(position), 'label': self.labels.get(position), 'presses': int(presses),
+                      'penalty': int(penalty)}
+                     for position, presses, penalty in zip(self.positions, self.presses, self.penalties)],
+            'fingers': list(self.fingers),
+            'transitions': self.transitions.tolist(),
+        }
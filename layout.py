@@ -1,3 +1,10 @@
+left_hand = {'f5l', 'f4l', 'f3l', 'f2l', 'f1l'}
+right_hand = {'f1r', 'f2r', 'f3r', 'f4r', 'f5r'}
+FINGERS = ('f5l', 'f4l', 'f3l', 'f2l', 'f1l', 'f1r', 'f2r', 'f3r', 'f4r', 'f5r')
+
+shift_symbols = '!@"№;%:?*()_+'
+
+
 def qwerty_layout():
     """
     Создаем визуально раскладку Йцукен, со словарями
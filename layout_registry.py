@@ -0,0 +1,426 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import compiled_layout
+from analyzer import SCORING_VERSION
+from compiled_layout import CompiledLayout, _compiled_cache
+from layout import FINGERS, left_hand, right_hand
+
+LAYOUT_EXTENSIONS = ('.json', '.toml')
+DEFAULT_LAYOUT_DIR = 'layouts'
+CACHE_NAME = '.layouts.pickle'
+# Увеличивается при изменении формата кеша или проверки файлов. Кроме него кеш собирается заново
+# при смене SCORING_VERSION и при любом изменении compiled_layout.py (см. cache_version)
+CACHE_VERSION = 1
+
+_cache_version = None
+
+
+def cache_version():
+    """
+    Версия кеша скомпилированных раскладок: CACHE_VERSION, SCORING_VERSION и хеш исходного кода
+    compiled_layout.py, так что изменение CompiledLayout или classify_char не оставляет в кеше старые таблицы
+
+    Returns:
+        Кортеж версий
+    """
+    global _cache_version
+    if _cache_version is None:
+        with open(compiled_layout.__file__, 'rb') as file:
+            source_digest = hashlib.blake2b(file.read(), digest_size=8).hexdigest()
+        _cache_version = (CACHE_VERSION, SCORING_VERSION, source_digest)
+    return _cache_version
+
+
+def parse_layout_file(filename):
+    """
+    Читает файл раскладки JSON или TOML без проверки содержимого
+
+    Args:
+        filename: путь к файлу .json или .toml
+
+    Returns:
+        Словарь из файла
+    """
+    if filename.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError("Для файлов TOML нужен Python 3.11+")
+        with open(filename, 'rb') as file:
+            return tomllib.load(file)
+    with open(filename, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _position(value, where):
+    """
+    Проверяет позицию клавиши из файла раскладки
+
+    Args:
+        value: значение из файла, ожидается пара [ряд, колонка]
+        where: описание места в файле для сообщения об ошибке
+
+    Returns:
+        Кортеж (ряд, колонка)
+    """
+    if (not isinstance(value, (list, tuple)) or len(value) != 2
+            or not all(isinstance(v, int) and not isinstance(v, bool) and v >= 0 for v in value)):
+        raise ValueError(f"{where}: позиция должна быть парой неотрицательных целых [ряд, колонка], а не {value!r}")
+    return tuple(value)
+
+
+def validate_layout(data, source='раскладка'):
+    """
+    Проверяет данные раскладки из файла и приводит их к виду функций layout.py:
+    позиции - кортежи, домашний ряд - в порядке пальцев FINGERS, alt_symbols - множество
+
+    Args:
+        data: словарь с name, layout, home_positions, finger_assignment и необязательным alt_symbols
+        source: откуда данные (для сообщений об ошибках)
+
+    Returns:
+        Данные раскладки
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"{source}: ожидается объект с полями раскладки")
+    missing = [field for field in ('name', 'layout', 'home_positions', 'finger_assignment') if field not in data]
+    if missing:
+        raise ValueError(f"{source}: нет полей {', '.join(missing)}")
+    unknown = set(data) - {'name', 'layout', 'home_positions', 'finger_assignment', 'alt_symbols'}
+    if unknown:
+        raise ValueError(f"{source}: неизвестные поля {', '.join(sorted(unknown))}")
+    if not isinstance(data['name'], str) or not data['name']:
+        raise ValueError(f"{source}: name должно быть непустой строкой")
+    for field in ('layout', 'home_positions', 'finger_assignment'):
+        if not isinstance(data[field], dict):
+            raise ValueError(f"{source}: {field} должно быть объектом")
+
+    layout = {char: _position(value, f"{source}: layout[{char!r}]") for char, value in data['layout'].items()}
+    if '' in layout:
+        raise ValueError(f"{source}: пустой символ в layout")
+
+    home_positions = data['home_positions']
+    if set(home_positions) != left_hand | right_hand:
+        raise ValueError(f"{source}: home_positions должно задавать ровно пальцы {', '.join(FINGERS)}")
+    home_positions = {finger: _position(home_positions[finger], f"{source}: home_positions[{finger!r}]")
+                      for finger in FINGERS}
+
+    finger_assignment = data['finger_assignment']
+    for char, finger in finger_assignment.items():
+        if finger not in home_positions:
+            raise ValueError(f"{source}: finger_assignment[{char!r}] - неизвестный палец {finger!r}")
+        if char not in layout:
+            raise ValueError(f"{source}: finger_assignment[{char!r}] - символа нет в layout")
+
+    layout_config = {
+        'name': data['name'],
+        'layout': layout,
+        'home_positions': home_positions,
+        'finger_assignment': dict(finger_assignment),
+    }
+    if 'alt_symbols' in data:
+        alt_symbols = data['alt_symbols']
+        if not isinstance(alt_symbols, list) or not all(isinstance(char, str) for char in alt_symbols):
+            raise ValueError(f"{source}: alt_symbols должно быть списком символов")
+        absent = [char for char in alt_symbols if char not in layout]
+        if absent:
+            raise ValueError(f"{source}: alt_symbols {', '.join(absent)} нет в layout")
+        layout_config['alt_symbols'] = set(alt_symbols)
+    return layout_config
+
+
+def load_layout_file(filename):
+    """
+    Читает и проверяет файл раскладки
+
+    Args:
+        filename: путь к файлу .json или .toml
+
+    Returns:
+        Данные раскладки
+    """
+    return validate_layout(parse_layout_file(filename), filename)
+
+
+def layout_json(layout_config):
+    """
+    Записывает раскладку в формате файла раскладки JSON (по 6 символов в строке, как в layout.py)
+
+    Args:
+        layout_config: данные раскладки
+
+    Returns:
+        Текст JSON
+    """
+    def mapping(values):
+        items = [f"{json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}"
+                 for key, value in values.items()]
+        lines = [', '.join(items[i:i + 6]) for i in range(0, len(items), 6)]
+        return '{\n    ' + ',\n    '.join(lines) + '\n  }'
+
+    fields = [
+        f'"name": {json.dumps(layout_config["name"], ensure_ascii=False)}',
+        f'"layout": {mapping({char: list(position) for char, position in layout_config["layout"].items()})}',
+        f'"home_positions": {mapping({f: list(position) for f, position in layout_config["home_positions"].items()})}',
+        f'"finger_assignment": {mapping(layout_config["finger_assignment"])}',
+    ]
+    if 'alt_symbols' in layout_config:
+        fields.append(f'"alt_symbols": {json.dumps(sorted(layout_config["alt_symbols"]), ensure_ascii=False)}')
+    return '{\n  ' + ',\n  '.join(fields) + '\n}\n'
+
+
+class LayoutRegistry:
+    """
+    Реестр раскладок из файлов .json и .toml в папке: идентификатор раскладки - имя файла
+    без расширения. Каждый файл проверяется и компилируется (CompiledLayout) один раз,
+    результат сохраняется в двоичном кеше папки (.layouts.pickle). При следующих запусках
+    файл, у которого не изменились размер и время изменения (или, если они изменились, хеш содержимого),
+    берётся из кеша без разбора и проверки; при смене cache_version() кеш собирается заново.
+    Скомпилированная раскладка хранится в кеше отдельным блоком pickle и восстанавливается
+    только при первом обращении к ней, поэтому загрузка сотен раскладок стоит миллисекунды.
+    Восстановленные раскладки попадают в кеш compile_layout
+    """
+
+    def __init__(self, directory=DEFAULT_LAYOUT_DIR, cache_path=None):
+        self.directory = directory
+        self.cache_path = cache_path or os.path.join(directory, CACHE_NAME)
+        self.entries = {}
+        self.files = {}
+        self.errors = {}
+        self.parsed = 0
+        self._compiled = {}
+
+    def _read_cache(self):
+        """
+        Читает кеш разобранных раскладок; кеш другой версии (см. cache_version) или повреждённый не используется
+
+        Returns:
+            Словарь записей кеша по путям файлов (пустой, если кеша нет)
+        """
+        try:
+            with open(self.cache_path, 'rb') as file:
+                cache = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return {}
+        if not isinstance(cache, dict) or cache.get('version') != cache_version():
+            return {}
+        return cache['entries']
+
+    def _write_cache(self, entries):
+        """
+        Записывает кеш через временный файл, чтобы параллельные запуски не прочитали его наполовину;
+        ошибки записи не мешают работе
+
+        Args:
+            entries: словарь записей кеша по путям файлов
+
+        Returns:
+            None
+        """
+        temporary = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, 'wb') as file:
+                pickle.dump({'version': cache_version(), 'entries': entries}, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.cache_path)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def load(self):
+        """
+        Находит файлы раскладок в папке и загружает их: из кеша или, для новых и изменённых файлов,
+        с разбором, проверкой и компиляцией. Файлы с ошибками пропускаются и попадают в errors
+
+        Returns:
+            Сам реестр
+        """
+        cached = self._read_cache()
+        entries = {}
+        changed = False
+        self.entries, self.files, self.errors, self.parsed, self._compiled = {}, {}, {}, 0, {}
+
+        for filename in sorted(os.listdir(self.directory)):
+            name, extension = os.path.splitext(filename)
+            if extension not in LAYOUT_EXTENSIONS or filename.startswith('.'):
+                continue
+            path = os.path.join(self.directory, filename)
+            if name in self.entries:
+                self.errors[path] = f"раскладка {name} уже загружена из {self.files[name]}"
+                continue
+
+            stat = os.stat(path)
+            entry = cached.get(filename)
+            if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                changed = True
+                with open(path, 'rb') as file:
+                    digest = hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+                if entry and entry['digest'] == digest:
+                    entry = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                else:
+                    try:
+                        compiled = CompiledLayout(load_layout_file(path))
+                    except (ValueError, UnicodeDecodeError) as e:
+                        self.errors[path] = str(e)
+                        continue
+                    self.parsed += 1
+                    self._compiled[name] = _compiled_cache.setdefault(compiled.digest, compiled)
+                    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest,
+                             'name': compiled.name, 'compiled': pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL)}
+
+            entries[filename] = self.entries[name] = entry
+            self.files[name] = path
+
+        if changed or entries.keys() != cached.keys():
+            self._write_cache(entries)
+        return self
+
+    def names(self):
+        """
+        Returns:
+            Идентификаторы загруженных раскладок по алфавиту
+        """
+        return sorted(self.entries)
+
+    def compiled(self, name):
+        """
+        Возвращает скомпилированную раскладку, восстанавливая её из кеша при первом обращении
+
+        Args:
+            name: идентификатор раскладки (имя файла без расширения)
+
+        Returns:
+            CompiledLayout
+        """
+        compiled = self._compiled.get(name)
+        if compiled is None:
+            compiled = pickle.loads(self.entries[name]['compiled'])
+            compiled = self._compiled[name] = _compiled_cache.setdefault(compiled.digest, compiled)
+        return compiled
+
+    def get(self, name):
+        """
+        Возвращает данные раскладки по идентификатору (имени файла без расширения)
+
+        Args:
+            name: идентификатор раскладки
+
+        Returns:
+            Данные раскладки
+        """
+        return self.compiled(name).config
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def add_layout_arguments(parser):
+    """
+    Добавляет в разбор аргументов -l/--layout и --layout-dir (общие для main.py и остальных программ)
+
+    Args:
+        parser: argparse.ArgumentParser
+
+    Returns:
+        None
+    """
+    from main import LAYOUTS
+
+    parser.add_argument('-l', '--layout', action='append', dest='layouts', metavar='LAYOUT',
+                        help=f"раскладка: {', '.join(sorted(LAYOUTS))} или файл из --layout-dir "
+                             '(можно указать несколько раз, по умолчанию все)')
+    parser.add_argument('--layout-dir', default=None, metavar='DIR',
+                        help='папка с файлами раскладок .json и .toml (см. layout_registry.py)')
+
+
+def resolve_layout_names(names=None, layout_dir=None):
+    """
+    Находит данные раскладок по идентификаторам: встроенные раскладки main.LAYOUTS и файлы папки layout_dir.
+    Файл с тем же именем, что у встроенной раскладки, заменяет её; повторы в списке убираются с сохранением порядка.
+    Файлы с ошибками пропускаются с сообщением в stderr
+
+    Args:
+        names: идентификаторы раскладок (None - все встроенные и все из папки)
+        layout_dir: папка с файлами раскладок (None - только встроенные)
+
+    Returns:
+        Пара (список идентификаторов, список данных раскладок)
+    """
+    from main import LAYOUTS
+
+    registry = None
+    if layout_dir:
+        try:
+            registry = LayoutRegistry(layout_dir).load()
+        except OSError as e:
+            raise ValueError(f"Папка раскладок {layout_dir} не читается: {e}")
+        for error in registry.errors.values():
+            print(f"Раскладка пропущена: {error}", file=sys.stderr)
+
+    available = list(LAYOUTS) + (registry.names() if registry else [])
+    names = list(dict.fromkeys(names or available))
+    unknown = [name for name in names if name not in LAYOUTS and not (registry and name in registry)]
+    if unknown:
+        raise ValueError(f"Неизвестные раскладки: {', '.join(unknown)}")
+    return names, [registry.get(name) if registry and name in registry else LAYOUTS[name]() for name in names]
+
+
+def resolve_layouts(names=None, layout_dir=None):
+    """
+    Данные раскладок по идентификаторам (см. resolve_layout_names)
+
+    Args:
+        names: идентификаторы раскладок (None - все)
+        layout_dir: папка с файлами раскладок (None - только встроенные)
+
+    Returns:
+        Список данных раскладок
+    """
+    return resolve_layout_names(names, layout_dir)[1]
+
+
+def main(argv=None):
+    """
+    Командная строка файлов раскладок: export выгружает встроенные раскладки в JSON,
+    check проверяет и компилирует раскладки папки
+
+    Args:
+        argv: аргументы командной строки (None - sys.argv)
+
+    Returns:
+        Код завершения: 1, если в папке есть файлы с ошибками, иначе 0
+    """
+    from main import LAYOUTS
+
+    parser = argparse.ArgumentParser(description='Файлы раскладок: выгрузка встроенных раскладок и проверка папки')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='записать встроенные раскладки в файлы JSON')
+    export.add_argument('directory', nargs='?', default=DEFAULT_LAYOUT_DIR, help='папка для файлов')
+    check = commands.add_parser('check', help='проверить и скомпилировать раскладки папки')
+    check.add_argument('directory', nargs='?', default=DEFAULT_LAYOUT_DIR, help='папка раскладок')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        os.makedirs(args.directory, exist_ok=True)
+        for name, layout_function in LAYOUTS.items():
+            path = os.path.join(args.directory, name + '.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(layout_json(layout_function()))
+            print(f"Записан {path}")
+        return 0
+
+    registry = LayoutRegistry(args.directory).load()
+    print(f"Раскладок: {len(registry)}, разобрано заново: {registry.parsed}")
+    for path, error in registry.errors.items():
+        print(f"Ошибка в {path}: {error}")
+    return 1 if registry.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
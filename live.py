@@ -0,0 +1,57 @@
+import time
+from analyzer import Analyzer
+
+READ_SIZE = 64 * 1024
+DEFAULT_FLUSH_SECONDS = 5.0
+
+
+def iter_stream_results(stream, layouts, engine='python', encoding='utf-8', flush_seconds=DEFAULT_FLUSH_SECONDS,
+                        flush_bytes=None, read_size=READ_SIZE):
+    """
+    Подсчёт по потоку без известного размера (stdin, pipe от zcat, выгрузка из базы, лог набора):
+    поток читается частями не больше read_size, байты декодируются по частям (символ UTF-8 и пара '\\r\\n'
+    на границе частей не разрываются), поэтому память не зависит от длины потока.
+    Через каждые flush_seconds секунд или flush_bytes байтов выдаются накопленные с начала потока результаты.
+    Чтение идёт через read1, если он есть, поэтому медленный поток не ждёт заполнения всей части;
+    пока данных нет, промежуточные результаты не выдаются
+
+    Args:
+        stream: бинарный или текстовый поток с методом read (sys.stdin.buffer, файл, сокет.makefile('rb'))
+        layouts: список данных раскладок
+        engine: движок подсчёта
+        encoding: кодировка байтов
+        flush_seconds: период выдачи результатов в секундах (None - не по времени)
+        flush_bytes: период выдачи результатов в байтах (None - не по объёму)
+        read_size: наибольший размер одного чтения
+
+    Returns:
+        Генератор словарей {'bytes': прочитано байтов (символов для текстового потока), 'seconds': время с начала,
+        'final': True для последнего, 'results': список кортежей (сумма штрафов, штраф по каждому пальцу,
+        количество символов) в порядке раскладок}
+    """
+    analyzers = [Analyzer(layout_config, engine, encoding) for layout_config in layouts]
+    read = getattr(stream, 'read1', stream.read)
+    start = last_flush = time.monotonic()
+    total = flushed = 0
+
+    def snapshot(final):
+        return {'bytes': total, 'seconds': round(time.monotonic() - start, 3), 'final': final,
+                'results': [analyzer.result() for analyzer in analyzers]}
+
+    while True:
+        chunk = read(read_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        for analyzer in analyzers:
+            analyzer.feed(chunk)
+
+        now = time.monotonic()
+        if (flush_seconds is not None and now - last_flush >= flush_seconds) or \
+                (flush_bytes is not None and total - flushed >= flush_bytes):
+            last_flush, flushed = now, total
+            yield snapshot(False)
+
+    for analyzer in analyzers:
+        analyzer.close()
+    yield snapshot(True)
@@ -1,10 +1,26 @@
+import argparse
+import codecs
+import contextlib
+import io
+import json
 import os
-import matplotlib.pyplot as plt
-from layout import qwerty_layout, dictor_layout, vizov_layout
-import numpy as np
+import sys
+from layout import qwerty_layout, dictor_layout, vizov_layout, left_hand, right_hand
+from analyzer import Analyzer, ENGINES
+from frequency import analyze_frequency_file_multi
+from compressed import detect_compression
+from result_cache import ResultCache
+from instrumentation import RunProfile, timed
+from layout_registry import add_layout_arguments, resolve_layouts
+from report import DEFAULT_REPORT_DIR, ReportRenderer, has_display
 
-left_hand = {'f5l', 'f4l', 'f3l', 'f2l', 'f1l'}
-right_hand = {'f1r', 'f2r', 'f3r', 'f4r', 'f5r'}
+MODES = ('text', 'freq')
+OUTPUT_FORMATS = ('text', 'json', 'tsv')
+LAYOUTS = {'qwerty': qwerty_layout, 'dictor': dictor_layout, 'vizov': vizov_layout}
+DEFAULT_FILES = (('digramms.txt', 'freq'), ('voina-i-mir.txt', 'text'), ('1grams-3.txt', 'freq'))
+
+# matplotlib, numpy и engine импортируются внутри функций, которым они нужны:
+# подсчёт движком python по одному файлу не тратит на них время запуска
 
 
 def calculate_fines(pos1, pos2):
@@ -48,189 +64,300 @@ def analyze_text(text, layout_config):
     Returns:
         Cуммарный штраф, штрафы по каждому пальцу, общее количество обработанных символов
     """
+    analyzer = Analyzer(layout_config)
+    analyzer.feed(text)
+    return analyzer.result()
 
-    layout = layout_config['layout']
-    home_positions = layout_config['home_positions']
-    finger_assignment = layout_config['finger_assignment']
-
-    finger_penalties = {f: 0 for f in home_positions}
-    current_positions = home_positions.copy()
-    previous_finger = None
-    total_penalty = 0
-    total_chars = 0
-
-    for char in text:
-        if char not in layout and char != ' ' and char != '\n' and not (char.isupper() or char in '!@"№;%:?*()_+'):
-            continue
-
-        if char == ' ':
-            current_finger = 'f1l'
-            finger_penalties[current_finger] += 1
-            total_penalty += 1
-            total_chars += 1
-
-            if previous_finger and current_finger:
-                current_hand = 'left' if current_finger in left_hand else 'right'
-                previous_hand = 'left' if previous_finger in left_hand else 'right'
-                if current_hand != previous_hand:
-                    finger_penalties[current_finger] += 1
-                    total_penalty += 1
-
-            previous_finger = current_finger
-
-        elif char.isupper() or char in '!@"№;%:?*()_+':
-            lower_char = char.lower()
-            if lower_char not in layout:
-                continue
-
-            if previous_finger and previous_finger in right_hand:
-                shift_finger = 'f5r'
-            else:
-                shift_finger = 'f5l'
-
-            letter_finger = finger_assignment.get(char.lower(), 'f1l')
-
-            finger_penalties[shift_finger] += 1
-            total_penalty += 1
-
-            if previous_finger and shift_finger:
-                current_hand = 'left' if shift_finger in left_hand else 'right'
-                previous_hand = 'left' if previous_finger in left_hand else 'right'
-                if current_hand != previous_hand:
-                    finger_penalties[shift_finger] += 1
-                    total_penalty += 1
-
-            if shift_finger and letter_finger:
-                current_hand = 'left' if letter_finger in left_hand else 'right'
-                previous_hand = 'left' if shift_finger in left_hand else 'right'
-                if current_hand != previous_hand:
-                    finger_penalties[letter_finger] += 1
-                    total_penalty += 1
-
-            current_pos = layout[char.lower()]
-            movement_penalty = calculate_fines(current_positions[letter_finger], current_pos)
-            finger_penalties[letter_finger] += movement_penalty
-            total_penalty += movement_penalty
-
-            current_positions[letter_finger] = current_pos
-            previous_finger = letter_finger
-            total_chars += 2
-
-        elif layout_config['name'] == 'Вызов' and char in layout_config.get('alt_symbols', set()):
-            alt_finger = 'f1r'
-
-            letter_finger = finger_assignment.get(char, 'f1l')
 
-            finger_penalties[alt_finger] += 1
-            total_penalty += 1
+def analyze_file(filename, layout_config, chunk_size=1024 * 1024, engine='python', workers=None, mode='text',
+                 cache=None, encoding='utf-8', profile=None, checkpoints=None, sample=None):
+    """
+    Анализ файлов целиком, используя заданную раскладку.
+    Файл читается частями по chunk_size, состояние пальцев переносится между частями,
+    поэтому результат не зависит от размера части, а память - от размера файла
 
-            if previous_finger and alt_finger:
-                current_hand = 'right'
-                previous_hand = 'left' if previous_finger in left_hand else 'right'
-                if current_hand != previous_hand:
-                    finger_penalties[alt_finger] += 1
-                    total_penalty += 1
+    Args:
+        filename: путь к файлу
+        layout_config: данные раскладки
+        chunk_size: размер части для чтения (1мб)
+        engine: движок подсчёта - 'python' (analyze_text) или 'numpy' (analyze_text_numpy)
+        workers: количество процессов для больших файлов (None или 1 - без распараллеливания)
+        mode: 'text' - обычный текст, 'freq' - частотный список строк '<n-грамма> [количество]'
+        cache: ResultCache для сохранения и повторного использования результатов (None - без кеша)
+        encoding: кодировка файла (utf-8, cp1251, koi8-r, ...)
+        profile: FileProfile для замеров времени фаз и нажатий по веткам (None - без замеров)
+        checkpoints: контрольные точки для растущих файлов (см. analyze_file_multi)
+        sample: Sampling для приблизительного подсчёта по выборке блоков (см. analyze_file_multi)
 
-            if letter_finger:
-                letter_hand = 'left' if letter_finger in left_hand else 'right'
-                if letter_hand != 'right':
-                    finger_penalties[letter_finger] += 1
-                    total_penalty += 1
+    Returns:
+        сумма штрафов, штраф по каждому пальцу, общее количество символов
+        (в случае ошибок - 0 и {})
+    """
+    return analyze_file_multi(filename, [layout_config], chunk_size, engine, workers, mode, cache, encoding,
+                              profile, checkpoints, sample=sample)[0]
 
-            current_pos = layout[char]
-            movement_penalty = calculate_fines(current_positions[letter_finger], current_pos)
-            finger_penalties[letter_finger] += movement_penalty
-            total_penalty += movement_penalty
-            current_positions[letter_finger] = current_pos
 
-            previous_finger = letter_finger
-            total_chars += 2
+def analyze_file_multi(filename, layouts, chunk_size=1024 * 1024, engine='python', workers=None, mode='text',
+                       cache=None, encoding='utf-8', profile=None, checkpoints=None, key_stats=None, metrics=None,
+                       sample=None):
+    """
+    Анализ файла сразу для нескольких раскладок: файл читается и декодируется один раз,
+    а каждая часть текста передаётся в отдельный анализатор каждой раскладки
 
-        elif char == '\n':
-            current_finger = 'f5r'
-            finger_penalties[current_finger] += 2
-            total_penalty += 2
-            total_chars += 1
+    Args:
+        filename: путь к файлу; сжатые файлы (gzip, bz2, xz, zstd) определяются по сигнатуре
+            и распаковываются потоково в фоновом потоке, одновременно с подсчётом (см. compressed.py)
+        layouts: список данных раскладок
+        chunk_size: размер части для чтения (1мб)
+        engine: движок подсчёта - 'python' (analyze_text) или 'numpy' (analyze_text_numpy);
+            движок numpy читает файл через mmap (engine.mapped_points)
+        workers: количество процессов для больших файлов (None или 1 - без распараллеливания);
+            файлы больше MIN_PART_SIZE делятся на диапазоны и считаются движком numpy в parallel.py
+        mode: 'text' - обычный текст, 'freq' - частотный список строк '<n-грамма> [количество]',
+            каждая n-грамма набирается с домашних позиций и учитывается с весом (см. frequency.py)
+        cache: ResultCache; раскладки, для которых результат по этому содержимому файла
+            уже есть в кеше, повторно не считаются
+        encoding: кодировка файла; файлы в однобайтовых кодировках (cp1251, koi8-r) движок numpy
+            считает прямо по байтам, без декодирования (engine.score_bytes)
+        profile: FileProfile (см. instrumentation.py) - время чтения и подсчёта по каждой раскладке,
+            количество нажатий по веткам, байты и символы в секунду; None - замеры выключены
+        checkpoints: True или путь к файлу контрольных точек - текст дописываемого файла считается
+            с последней контрольной точки, читаются только новые байты (см. checkpoint.py);
+            кеш и workers при этом не используются. None - файл считается целиком
+        key_stats: словарь, в который записываются KeyStats по названиям раскладок - нажатия
+            и штраф каждой клавиши и переходы между пальцами (см. keystats.py), в том же проходе
+            по тексту; только движок numpy, кеш, workers и checkpoints при этом не используются. None - не собирать
+        metrics: словарь, в который записываются MetricAccumulator по названиям раскладок - гистограммы
+            нажатий и переходов, из которых result() считает метрики набора (см. metrics.py);
+            ограничения те же, что у key_stats. None - не собирать
+        sample: Sampling - считать только случайную выборку блоков файла и экстраполировать
+            результат, доверительные интервалы записываются в sample.estimates (см. sampling.py);
+            только режим text, кеш, workers и checkpoints при этом не используются. None - файл целиком
 
-            if previous_finger and current_finger:
-                current_hand = 'left' if current_finger in left_hand else 'right'
-                previous_hand = 'left' if previous_finger in left_hand else 'right'
-                if current_hand != previous_hand:
-                    finger_penalties[current_finger] += 1
-                    total_penalty += 1
+    Returns:
+        Список кортежей (сумма штрафов, штраф по каждому пальцу, общее количество символов)
+        в порядке раскладок (в случае ошибок - 0 и {} для каждой)
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Неизвестный движок: {engine}")
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим: {mode}")
+    collect = key_stats is not None or metrics is not None
+    if collect and (engine != 'numpy' or mode != 'text'):
+        raise ValueError("Статистика по клавишам и метрики собираются только движком numpy в режиме text")
+    if sample is not None and (collect or mode != 'text'):
+        raise ValueError("Выборка поддерживается только в режиме text, без статистики по клавишам и метрик")
 
-            previous_finger = current_finger
+    try:
+        with timed(profile, 'total'):
+            if sample is not None:
+                from sampling import analyze_file_sampled
+                return analyze_file_sampled(filename, layouts, sample, engine, encoding)
+            if collect:
+                return analyze_file_uncached(filename, layouts, chunk_size, engine, None, mode, encoding, profile,
+                                             key_stats, metrics)
+            if checkpoints and mode == 'text' and detect_compression(filename):
+                print(f"Сжатый файл {filename} считается целиком, без контрольных точек")
+            elif checkpoints and mode == 'text':
+                from checkpoint import analyze_file_incremental
+                print(f"Анализ файла с контрольными точками: {filename}")
+                with timed(profile, 'incremental'):
+                    return analyze_file_incremental(filename, layouts, engine, encoding,
+                                                    None if checkpoints is True else checkpoints,
+                                                    chunk_size=chunk_size)
+            return _analyze_file_multi_cached(filename, layouts, chunk_size, engine, workers, mode, cache,
+                                              encoding, profile)
 
-        elif char in layout:
-            current_finger = finger_assignment.get(char, 'f1l')
-            current_pos = layout[char]
+    except FileNotFoundError:
+        print(f"Файл {filename} не найден")
+        return [(0, {}, 0) for _ in layouts]
+    except Exception as e:
+        print(f"Ошибка при обработке файла: {e}")
+        return [(0, {}, 0) for _ in layouts]
 
-            movement_penalty = calculate_fines(current_positions[current_finger], current_pos)
-            finger_penalties[current_finger] += movement_penalty
-            total_penalty += movement_penalty
 
-            current_positions[current_finger] = current_pos
-            total_chars += 1
+def _analyze_file_multi_cached(filename, layouts, chunk_size, engine, workers, mode, cache, encoding, profile):
+    """
+    Берёт из кеша готовые результаты и считает только недостающие раскладки (см. analyze_file_multi)
+    """
+    if cache is None:
+        return analyze_file_uncached(filename, layouts, chunk_size, engine, workers, mode, encoding, profile)
 
-            if previous_finger and current_finger:
-                current_hand = 'left' if current_finger in left_hand else 'right'
-                previous_hand = 'left' if previous_finger in left_hand else 'right'
-                if current_hand != previous_hand:
-                    finger_penalties[current_finger] += 1
-                    total_penalty += 1
+    encoding_name = codecs.lookup(encoding).name
+    cache_mode = mode if encoding_name == 'utf-8' else f"{mode}:{encoding_name}"
+    digest = cache.file_digest(filename)
+    results = [cache.get(digest, layout_config, cache_mode) for layout_config in layouts]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if len(missing) < len(layouts):
+        print(f"Из кеша: {len(layouts) - len(missing)} из {len(layouts)} раскладок для {filename}")
 
-            previous_finger = current_finger
+    if missing:
+        computed = analyze_file_uncached(filename, [layouts[i] for i in missing], chunk_size, engine, workers,
+                                         mode, encoding, profile)
+        for i, result in zip(missing, computed):
+            cache.put(digest, layouts[i], result, cache_mode)
+            results[i] = result
 
-    return total_penalty, finger_penalties, total_chars
+    return results
 
 
-def analyze_file(filename, layout_config, chunk_size=1024 * 1024):
+def analyze_file_uncached(filename, layouts, chunk_size=1024 * 1024, engine='python', workers=None, mode='text',
+                          encoding='utf-8', profile=None, key_stats=None, metrics=None):
     """
-    Анализ файлов целиком, используя заданную раскладку
+    Анализ файла для нескольких раскладок без кеша, контрольных точек и выборки. В отличие от
+    analyze_file_multi ошибки чтения и подсчёта не перехватываются, а передаются вызывающему
+    (так их получают batch.py и sampling.py)
 
     Args:
         filename: путь к файлу
-        layout_config: данные раскладки
-        chunk_size: размер части для чтения больших файлов (1мб)
+        layouts: список данных раскладок
+        chunk_size: размер части для чтения
+        engine: движок подсчёта
+        workers: количество процессов для больших файлов (None или 1 - без распараллеливания)
+        mode: 'text' или 'freq'
+        encoding: кодировка файла
+        profile: FileProfile или None
+        key_stats: словарь для KeyStats или None (см. analyze_file_multi)
+        metrics: словарь для MetricAccumulator или None (см. analyze_file_multi)
 
     Returns:
-        сумма штрафов, штраф по каждому пальцу, общее количество символов
-        (в случае ошибок - 0 и {})
+        Список кортежей (сумма штрафов, штраф по каждому пальцу, общее количество символов)
+        в порядке раскладок
     """
-    try:
-        file_size = os.path.getsize(filename)
+    file_size = os.path.getsize(filename)
+    compression = detect_compression(filename)
+    if compression:
+        print(f"Анализ файла: {filename} ({file_size / 1024 / 1024:.2f} МБ, сжат {compression})")
+    else:
         print(f"Анализ файла: {filename} ({file_size / 1024 / 1024:.2f} МБ)")
+    # Байты сжатого файла учитываются по мере распаковки (см. _read_compressed_chunks)
+    if profile is not None and not compression:
+        profile.count_bytes(file_size)
+
+    if mode == 'freq':
+        with timed(profile, 'freq'):
+            return analyze_frequency_file_multi(filename, layouts, engine, encoding)
+
+    utf8 = codecs.lookup(encoding).name == 'utf-8'
+    single_byte = False
+    if not utf8:
+        from engine import single_byte_points
+        single_byte = single_byte_points(encoding) is not None
+
+    # Сжатый файл читается только последовательно: его размер ничего не говорит о длине текста,
+    # а диапазоны для процессов parallel.py в нём не найти
+    if workers and workers > 1 and (utf8 or single_byte) and not compression:
+        from parallel import analyze_file_parallel, MIN_PART_SIZE
+        if file_size > MIN_PART_SIZE:
+            print(f"Файл большой, считаем в {workers} процессах...")
+            with timed(profile, 'parallel'):
+                return analyze_file_parallel(filename, layouts, workers, chunk_size, encoding=encoding)
+
+    analyzers = [Analyzer(layout_config, engine, encoding, key_stats is not None, metrics is not None)
+                 for layout_config in layouts]
+    points_input = engine == 'numpy' and not single_byte
+    chunks = _read_chunks(filename, chunk_size, engine, encoding, utf8, single_byte, compression, profile)
+
+    while True:
+        with timed(profile, 'read'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        if profile is not None:
+            if isinstance(chunk, bytes):
+                text = chunk.decode(encoding, errors='replace')
+                profile.count_text(text.replace('\r\n', '\n').replace('\r', '\n'), layouts)
+            else:
+                profile.count_text(chunk, layouts)
 
-        total_penalty = 0
-        total_chars = 0
-        finger_penalties = {f: 0 for f in layout_config['home_positions']}
+        for analyzer in analyzers:
+            with timed(profile, 'score', analyzer.compiled.name):
+                if points_input:
+                    analyzer.feed_points(chunk)
+                else:
+                    analyzer.feed(chunk)
 
-        with open(filename, 'r', encoding='utf-8') as file:
-            if file_size <= 10 * 1024 * 1024:
-                text = file.read()
-                return analyze_text(text, layout_config)
-            else:
-                print("Файл большой, читаем по частям...")
-                while True:
-                    chunk = file.read(chunk_size)
-                    if not chunk:
-                        break
+    for analyzer in analyzers:
+        analyzer.close()
+        if key_stats is not None:
+            key_stats[analyzer.compiled.name] = analyzer.key_stats
+        if metrics is not None:
+            metrics[analyzer.compiled.name] = analyzer.metrics
+    return [analyzer.result() for analyzer in analyzers]
 
-                    penalty, stats, chars = analyze_text(chunk, layout_config)
-                    total_penalty += penalty
-                    total_chars += chars
 
-                    for finger in finger_penalties:
-                        finger_penalties[finger] += stats[finger]
+def _read_chunks(filename, chunk_size, engine, encoding, utf8, single_byte, compression=None, profile=None):
+    """
+    Читает файл частями в том виде, в котором их принимает анализатор
 
-        return total_penalty, finger_penalties, total_chars
+    Args:
+        filename: путь к файлу
+        chunk_size: размер части для чтения
+        engine: движок подсчёта
+        encoding: кодировка файла
+        utf8: файл в UTF-8
+        single_byte: кодировка однобайтовая
+        compression: сжатие файла (см. compressed.detect_compression) или None
+        profile: FileProfile, в который записываются распакованные байты сжатого файла, или None
 
-    except FileNotFoundError:
-        print(f"Файл {filename} не найден")
-        return 0, {}, 0
-    except Exception as e:
-        print(f"Ошибка при обработке файла: {e}")
-        return 0, {}, 0
+    Returns:
+        Генератор частей: байты (numpy, однобайтовая кодировка), кодовые точки (numpy)
+        или строки (python)
+    """
+    if compression:
+        yield from _read_compressed_chunks(filename, chunk_size, engine, encoding, single_byte, compression,
+                                           profile)
+    elif engine == 'numpy' and single_byte:
+        with open(filename, 'rb') as file:
+            yield from iter(lambda: file.read(chunk_size), b'')
+    elif engine == 'numpy' and utf8:
+        from engine import mapped_points
+        yield from mapped_points(filename, chunk_size)
+    elif engine == 'numpy':
+        from engine import text_points
+        with open(filename, 'r', encoding=encoding) as file:
+            for chunk in iter(lambda: file.read(chunk_size), ''):
+                yield text_points(chunk)
+    else:
+        with open(filename, 'r', encoding=encoding) as file:
+            yield from iter(lambda: file.read(chunk_size), '')
+
+
+def _read_compressed_chunks(filename, chunk_size, engine, encoding, single_byte, compression, profile=None):
+    """
+    Читает сжатый файл без временных файлов: распаковка идёт в фоновом потоке
+    (compressed.decompressed_chunks), а части декодируются один раз для всех раскладок,
+    как при чтении файла в текстовом режиме (переводы строк приводятся к '\\n').
+    Распакованные байты учитываются в profile
+    """
+    from compressed import decompressed_chunks
+
+    chunks = decompressed_chunks(filename, chunk_size, compression)
+    if profile is not None:
+        chunks = _counted(chunks, profile)
+    if engine == 'numpy' and single_byte:
+        yield from chunks
+        return
+
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+    if engine == 'numpy':
+        from engine import text_points
+        for data in chunks:
+            yield text_points(decoder.decode(data))
+        yield text_points(decoder.decode(b'', final=True))
+    else:
+        for data in chunks:
+            yield decoder.decode(data)
+        yield decoder.decode(b'', final=True)
+
+
+def _counted(chunks, profile):
+    """
+    Передаёт части байтов дальше, учитывая их размер в profile
+    """
+    for data in chunks:
+        profile.count_bytes(len(data))
+        yield data
 
 
 def calculate_hand_penalties(finger_penalties):
@@ -248,18 +375,60 @@ def calculate_hand_penalties(finger_penalties):
     return left_penalty, right_penalty
 
 
-def plot_finger_penalties_comparison(all_results, filename):
+def layout_colors(count):
+    """
+    Подбирает цвета раскладок: первые три - как раньше, остальные - из палитры tab10
+
+    Args:
+        count: количество раскладок
+
+    Returns:
+        Список цветов
+    """
+    import matplotlib.pyplot as plt
+
+    base = ['red', 'black', 'purple']
+    extra = plt.get_cmap('tab10').colors
+    return [base[i] if i < len(base) else extra[(i - len(base)) % len(extra)] for i in range(count)]
+
+
+def finish_figure(figure, output):
+    """
+    Показывает график в окне или сохраняет его в файлы и закрывает
+
+    Args:
+        figure: фигура matplotlib
+        output: None - показать (plt.show), иначе путь или список путей (.png, .svg, ...)
+
+    Returns:
+        None
+    """
+    import matplotlib.pyplot as plt
+
+    if output is None:
+        plt.show()
+        return
+    for path in [output] if isinstance(output, str) else output:
+        figure.savefig(path, dpi=100)
+    plt.close(figure)
+
+
+def plot_finger_penalties_comparison(all_results, filename, output=None):
     """
     Строим общую диаграмму штрафов по пальцам для всех раскладок на одном графике
 
     Args:
         all_results: список кортежей (название раскладки, штрафы по пальцам)
         filename: имя анализируемого файла
+        output: None - показать окно, иначе путь или список путей для сохранения
 
     Returns:
         None
     """
 
+    import matplotlib.pyplot as plt
+    import numpy as np
+
     finger_order = ['f5l', 'f4l', 'f3l', 'f2l', 'f1l', 'f1r', 'f2r', 'f3r', 'f4r', 'f5r']
 
     finger_names_ru = {
@@ -277,11 +446,11 @@ def plot_finger_penalties_comparison(all_results, filename):
 
     labels = [finger_names_ru[f] for f in finger_order]
 
-    colors = ['red', 'black', 'purple']
+    colors = layout_colors(len(all_results))
 
-    plt.figure(figsize=(14, 10))
+    figure = plt.figure(figsize=(14, max(10, 10 * len(all_results) / 3)))
 
-    bar_width = 0.25
+    bar_width = 0.75 / max(len(all_results), 1)
     y_pos = np.arange(len(labels))
 
     for i, (layout_name, finger_penalties) in enumerate(all_results):
@@ -298,7 +467,7 @@ def plot_finger_penalties_comparison(all_results, filename):
         plt.barh(positions, penalties, bar_width, color=colors[i], alpha=0.8,
                  label=f'{display_name} = {total_penalty:,})', edgecolor='black')
 
-    plt.yticks(y_pos + bar_width, labels)
+    plt.yticks(y_pos + bar_width * (len(all_results) - 1) / 2, labels)
     plt.xlabel('Штрафные баллы', fontsize=12)
 
     plt.title(f'Нагрузка по каждому пальцу - {filename}',
@@ -330,21 +499,30 @@ def plot_finger_penalties_comparison(all_results, filename):
                          fontweight='bold', fontsize=9, color=colors[i])
 
     plt.tight_layout()
-    plt.show()
+    finish_figure(figure, output)
 
 
-def plot_hand_distribution(all_results, filename):
+def plot_hand_distribution(all_results, filename, output=None):
     """
     Строит круговые диаграммы распределения штрафов по рукам для каждой раскладки
+    (не больше четырёх диаграмм в ряду)
 
     Args:
         all_results: список кортежей (название раскладки, штрафы по пальцам)
         filename: имя анализируемого файла
+        output: None - показать окно, иначе путь или список путей для сохранения
 
     Returns:
         None
     """
-    fig, axes = plt.subplots(1, 3, figsize=(18, 7))
+    import matplotlib.pyplot as plt
+
+    columns = max(min(len(all_results), 4), 1)
+    rows = max(-(-len(all_results) // columns), 1)
+    fig, axes = plt.subplots(rows, columns, figsize=(6 * columns, 7 * rows), squeeze=False)
+    axes = axes.ravel()
+    for axis in axes[len(all_results):]:
+        axis.axis('off')
 
     layout_display_names = {
         'Йцукен': 'Йцукен',
@@ -373,70 +551,381 @@ def plot_hand_distribution(all_results, filename):
                           fontsize=11, fontweight='bold', pad=10)
 
     plt.suptitle(f'Нагрузка по каждой руке - {filename}',
-                 fontsize=16, fontweight='bold', y=0.97)
+                 fontsize=16, fontweight='bold', y=1 - 0.03 / rows)
     plt.tight_layout()
-    plt.subplots_adjust(top=0.85)
-    plt.show()
+    plt.subplots_adjust(top=1 - 0.15 / rows)
+    finish_figure(fig, output)
 
 
-def main():
+def plot_key_heatmap(key_stats, filename, output=None):
     """
-    Основная функция программы.
-    Анализирует 3 заданных файла на трех раскладках клавиатуры: Йцукен, Диктор, Вызов.
-    Выводит в консоль статистику по каждому файлу и раскладке, а также отображает 2 графика:
-    первый - нагрузка на пальцы
-    второй - нагрузка по рукам
+    Строит для каждой раскладки тепловую карту штрафов по клавишам (в подписи - символ
+    и количество нажатий) и матрицу переходов между пальцами
+
+    Args:
+        key_stats: список KeyStats (см. keystats.py)
+        filename: имя анализируемого файла
+        output: None - показать окно, иначе путь или список путей для сохранения
 
     Returns:
         None
     """
-    print("Анализатор нагрузки пальцев")
-    print("=" * 50)
+    import matplotlib.pyplot as plt
+
+    rows = max(len(key_stats), 1)
+    fig, axes = plt.subplots(rows, 2, figsize=(20, 5 * rows), squeeze=False,
+                             gridspec_kw={'width_ratios': [3, 1]})
+
+    for (key_axis, transition_axis), stats in zip(axes, key_stats):
+        image = key_axis.imshow(stats.grid(stats.penalties), cmap='YlOrRd', aspect='auto')
+        for position, presses in zip(stats.positions, stats.presses):
+            label = stats.labels.get(position, '')
+            key_axis.text(position[1], position[0], f'{label}\n{presses:,}', ha='center', va='center', fontsize=7)
+        key_axis.set_xticks([])
+        key_axis.set_yticks([])
+        key_axis.set_title(f'{stats.name}: штраф по клавишам (подпись - нажатия), '
+                           f'всего {int(stats.penalties.sum()):,}', fontsize=11, fontweight='bold')
+        fig.colorbar(image, ax=key_axis, fraction=0.02)
+
+        transition_axis.imshow(stats.transitions, cmap='Blues')
+        transition_axis.set_xticks(range(len(stats.fingers)))
+        transition_axis.set_xticklabels(stats.fingers, rotation=90, fontsize=8)
+        transition_axis.set_yticks(range(len(stats.fingers)))
+        transition_axis.set_yticklabels(stats.fingers, fontsize=8)
+        transition_axis.set_xlabel('следующий палец')
+        transition_axis.set_ylabel('предыдущий палец')
+        transition_axis.set_title('Переходы между пальцами', fontsize=11, fontweight='bold')
+
+    plt.suptitle(f'Нагрузка по клавишам - {filename}', fontsize=16, fontweight='bold')
+    plt.tight_layout()
+    finish_figure(fig, output)
+
+
+def print_results(layouts, results):
+    """
+    Выводит в консоль штрафы по пальцам, рукам и суммарный штраф для каждой раскладки
+
+    Args:
+        layouts: список данных раскладок
+        results: результаты analyze_file_multi
+
+    Returns:
+        Список кортежей (название раскладки, штрафы по пальцам) для графиков
+    """
+    ru_finger_names = {
+        'f5l': 'Левый мизинец', 'f4l': 'Левый безымянный', 'f3l': 'Левый средний',
+        'f2l': 'Левый указательный', 'f1l': 'Левый большой', 'f1r': 'Правый большой',
+        'f2r': 'Правый указательный', 'f3r': 'Правый средний', 'f4r': 'Правый безымянный',
+        'f5r': 'Правый мизинец'
+    }
+    file_results = []
 
-    layouts = [qwerty_layout(), dictor_layout(), vizov_layout()]
-    files_to_analyze = ['digramms.txt', 'voina-i-mir.txt', '1grams-3.txt']
+    for layout_config, (total_penalty, finger_penalties, total_chars) in zip(layouts, results):
+        print(f"\nРаскладка {layout_config['name']}:")
 
-    for filename in files_to_analyze:
-        if os.path.exists(filename):
-            file_results = []
+        if total_chars > 0:
+            print("Штрафы по пальцам:")
+            for finger_code, finger_name in ru_finger_names.items():
+                penalty = finger_penalties[finger_code]
+                print(f"  {finger_name}: {penalty}")
 
-            for layout_config in layouts:
-                print(f"\nАнализируем {filename} ({layout_config['name']})...")
-                total_penalty, finger_penalties, total_chars = analyze_file(filename, layout_config)
+            left_penalty, right_penalty = calculate_hand_penalties(finger_penalties)
+            print(f"\nШтрафы по рукам:")
+            print(f"  Левая рука: {left_penalty}")
+            print(f"  Правая рука: {right_penalty}")
 
-                if total_chars > 0:
-                    ru_finger_names = {
-                        'f5l': 'Левый мизинец', 'f4l': 'Левый безымянный', 'f3l': 'Левый средний',
-                        'f2l': 'Левый указательный', 'f1l': 'Левый большой', 'f1r': 'Правый большой',
-                        'f2r': 'Правый указательный', 'f3r': 'Правый средний', 'f4r': 'Правый безымянный',
-                        'f5r': 'Правый мизинец'
-                    }
+            print(f"\nСуммарный штраф: {total_penalty}")
+            print(f"Всего символов: {total_chars}")
 
-                    print("Штрафы по пальцам:")
-                    for finger_code, finger_name in ru_finger_names.items():
-                        penalty = finger_penalties[finger_code]
-                        print(f"  {finger_name}: {penalty}")
+            file_results.append((layout_config['name'], finger_penalties))
+        else:
+            print("Файл пуст или ошибка чтения")
+        print("=" * 50)
 
-                    left_penalty, right_penalty = calculate_hand_penalties(finger_penalties)
-                    print(f"\nШтрафы по рукам:")
-                    print(f"  Левая рука: {left_penalty}")
-                    print(f"  Правая рука: {right_penalty}")
+    return file_results
 
-                    print(f"\nСуммарный штраф: {total_penalty}")
-                    print(f"Всего символов: {total_chars}")
 
-                    file_results.append((layout_config['name'], finger_penalties))
-                else:
-                    print("Файл пуст или ошибка чтения")
-                print("=" * 50)
+def results_to_dict(layouts, results):
+    """
+    Переводит результаты в словарь для JSON (вывод --output json, server.py)
+
+    Args:
+        layouts: список данных раскладок
+        results: результаты analyze_file_multi
+
+    Returns:
+        Словарь название раскладки -> суммарный штраф, штрафы по пальцам, по рукам и количество символов
+    """
+    data = {}
+    for layout_config, (total_penalty, finger_penalties, total_chars) in zip(layouts, results):
+        left_penalty, right_penalty = calculate_hand_penalties(finger_penalties)
+        data[layout_config['name']] = {'total': total_penalty, 'fingers': finger_penalties,
+                                       'hands': {'left': left_penalty, 'right': right_penalty}, 'chars': total_chars}
+    return data
 
-            if file_results:
-                plot_finger_penalties_comparison(file_results, filename)
-                plot_hand_distribution(file_results, filename)
 
+def format_results(filename, layouts, results, output_format, metrics=None, sample=None):
+    """
+    Форматирует результаты по файлу для скриптов и конвейеров оболочки
+
+    Args:
+        filename: имя анализируемого файла
+        layouts: список данных раскладок
+        results: результаты analyze_file_multi
+        output_format: 'json' - одна строка JSON на файл, 'tsv' - строка на раскладку
+            (файл, раскладка, суммарный штраф, левая рука, правая рука, символы)
+        metrics: словарь раскладка -> результаты метрик (MetricAccumulator.result), только для json
+        sample: Sampling с доверительными интервалами выборочного подсчёта, только для json
+
+    Returns:
+        Строка без перевода строки в конце
+    """
+    if output_format == 'json':
+        data = results_to_dict(layouts, results)
+        for layout_name, values in (metrics or {}).items():
+            data[layout_name]['metrics'] = values
+        for layout_name, estimates in (sample.estimates if sample else {}).items():
+            data[layout_name]['intervals'] = estimates
+        file_data = {'file': filename, 'layouts': data}
+        if sample:
+            file_data['sample'] = {'fraction': sample.fraction, 'seed': sample.seed, 'blocks': sample.blocks,
+                                   'total_blocks': sample.total_blocks, 'confidence': sample.confidence}
+        return json.dumps(file_data, ensure_ascii=False)
+
+    lines = []
+    for layout_config, (total_penalty, finger_penalties, total_chars) in zip(layouts, results):
+        left_penalty, right_penalty = calculate_hand_penalties(finger_penalties)
+        lines.append('\t'.join(str(value) for value in (filename, layout_config['name'], total_penalty,
+                                                          left_penalty, right_penalty, total_chars)))
+    return '\n'.join(lines)
+
+
+def analyze_stdin(layouts, args):
+    """
+    Считает stdin потоком с постоянной памятью. Через каждые --flush-seconds секунд или --flush-mb мегабайт
+    выводятся результаты, накопленные с начала потока: в формате json - строка JSON (последняя - с final: true,
+    формат раскладок - как в results_to_dict), в формате text - строка с прочитанным объёмом и суммарными штрафами
+
+    Args:
+        layouts: список данных раскладок
+        args: разобранные аргументы командной строки (engine, encoding, output, flush_seconds, flush_mb)
+
+    Returns:
+        Результаты по всему потоку, как у analyze_file_multi
+    """
+    from live import iter_stream_results
+
+    flush_bytes = int(args.flush_mb * 1024 * 1024) if args.flush_mb else None
+    for snapshot in iter_stream_results(sys.stdin.buffer, layouts, args.engine, args.encoding,
+                                        args.flush_seconds or None, flush_bytes):
+        if args.output == 'json':
+            print(json.dumps({'file': '-', 'bytes': snapshot['bytes'], 'seconds': snapshot['seconds'],
+                              'final': snapshot['final'], 'layouts': results_to_dict(layouts, snapshot['results'])},
+                             ensure_ascii=False), flush=True)
+        elif not snapshot['final']:
+            totals = ', '.join(f"{layout_config['name']} {total_penalty:,}"
+                               for layout_config, (total_penalty, _, _) in zip(layouts, snapshot['results']))
+            print(f"Прочитано {snapshot['bytes'] / 1024 / 1024:.1f} МБ за {snapshot['seconds']:.1f} с: {totals}",
+                  flush=True)
+    return snapshot['results']
+
+
+def build_parser():
+    """
+    Создаёт разбор аргументов командной строки
+
+    Returns:
+        argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description='Анализатор нагрузки пальцев')
+    parser.add_argument('files', nargs='*', metavar='FILE',
+                        help='файлы для анализа (по умолчанию digramms.txt, voina-i-mir.txt, 1grams-3.txt); '
+                             "'-' - читать stdin потоком и выводить промежуточные результаты (-o text или json)")
+    add_layout_arguments(parser)
+    parser.add_argument('--mode', choices=MODES, default='text',
+                        help='режим для указанных файлов: text - текст, freq - частотный список')
+    parser.add_argument('--engine', choices=ENGINES, default='python', help='движок подсчёта')
+    parser.add_argument('--workers', type=int, default=None, help='количество процессов для больших файлов')
+    parser.add_argument('--encoding', default='utf-8', help='кодировка файлов')
+    parser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default='text',
+                        help='формат вывода результатов: text, json (строка на файл), tsv (строка на раскладку)')
+    parser.add_argument('--no-plot', action='store_true', help='не строить графики')
+    parser.add_argument('--no-cache', action='store_true', help='не использовать кеш результатов')
+    parser.add_argument('--incremental', action='store_true',
+                        help='считать дописываемые файлы с последней контрольной точки (<файл>.checkpoints.json)')
+    parser.add_argument('--heatmap', action='store_true',
+                        help='собрать нажатия и штрафы по клавишам и переходы между пальцами (движок numpy)')
+    parser.add_argument('--metrics', nargs='?', const='all', default=None, metavar='NAMES',
+                        help='метрики набора через запятую: same_finger, roll_in, roll_out, row_jump, home_row '
+                             '(по умолчанию все; движок numpy)')
+    parser.add_argument('--sample', type=float, default=None, metavar='FRACTION',
+                        help='приблизительный подсчёт по случайной доле блоков файла (например 0.01) '
+                             'с доверительными интервалами')
+    parser.add_argument('--seed', type=int, default=0, help='зерно выбора блоков для --sample')
+    parser.add_argument('--flush-seconds', type=float, default=5.0, metavar='SECONDS',
+                        help="для '-': выводить промежуточные результаты каждые SECONDS секунд")
+    parser.add_argument('--flush-mb', type=float, default=None, metavar='MB',
+                        help="для '-': выводить промежуточные результаты после каждых MB мегабайт")
+    parser.add_argument('--profile', nargs='?', const='profile.json', default=None, metavar='FILE',
+                        help='записать время фаз, нажатия по веткам и скорость в JSON (по умолчанию profile.json)')
+    parser.add_argument('--report', nargs='?', const=DEFAULT_REPORT_DIR, default=None, metavar='DIR',
+                        help='сохранить графики в папку без показа окон (по умолчанию reports)')
+    parser.add_argument('--format', default='png', help='форматы графиков через запятую: png, svg, pdf')
+    return parser
+
+
+def main(argv=None):
+    """
+    Основная функция программы.
+    Без аргументов анализирует 3 заданных файла на трех раскладках клавиатуры: Йцукен, Диктор, Вызов.
+    Выводит в консоль статистику по каждому файлу и раскладке, а также отображает 2 графика:
+    первый - нагрузка на пальцы
+    второй - нагрузка по рукам
+    Файлы, раскладки, формат вывода и отказ от графиков задаются аргументами (см. build_parser).
+    Файл '-' читается из stdin потоком (см. analyze_stdin).
+    С флагом --layout-dir к встроенным раскладкам добавляются файлы раскладок из папки (см. layout_registry.py).
+    С флагом --profile дополнительно записывает замеры по фазам в файл JSON.
+    С флагом --report (или без дисплея) графики не показываются, а сохраняются в файлы
+    фоновыми процессами, пока анализируются следующие файлы.
+    С флагом --heatmap для текстовых файлов выводятся самые тяжёлые клавиши и строится
+    тепловая карта клавиатуры с матрицей переходов между пальцами.
+    С флагом --metrics в том же проходе считаются метрики набора (см. metrics.py).
+    С флагом --sample текстовые файлы считаются по случайной выборке блоков,
+    и к результатам выводятся доверительные интервалы (см. sampling.py)
+
+    Args:
+        argv: аргументы командной строки (по умолчанию - sys.argv)
+
+    Returns:
+        Код завершения: 0 - все файлы найдены, 1 - нет
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    run_profile = RunProfile() if args.profile else None
+    if '-' in args.files:
+        unsupported = [flag for flag, used in (('-o tsv', args.output == 'tsv'), ('--mode freq', args.mode == 'freq'),
+                                               ('--sample', args.sample is not None), ('--heatmap', args.heatmap),
+                                               ('--metrics', args.metrics), ('--incremental', args.incremental))
+                       if used]
+        if unsupported:
+            parser.error(f"stdin ('-') нельзя считать с {', '.join(unsupported)}")
+    text_output = args.output == 'text'
+    # В форматах json и tsv в stdout идут только результаты, сообщения анализа - в stderr
+    messages = contextlib.nullcontext() if text_output else contextlib.redirect_stdout(sys.stderr)
+
+    renderer = None
+    if not args.no_plot:
+        if args.report is None and not has_display():
+            args.report = DEFAULT_REPORT_DIR
+            print(f"Дисплей не найден, графики будут сохранены в {args.report}", file=sys.stderr)
+        if args.report is not None:
+            try:
+                renderer = ReportRenderer(args.report, args.format.split(','))
+            except ValueError as e:
+                parser.error(str(e))
+
+    metric_names = None
+    if args.metrics:
+        from metrics import METRICS
+        metric_names = list(METRICS) if args.metrics == 'all' else args.metrics.split(',')
+        unknown = [name for name in metric_names if name not in METRICS]
+        if unknown:
+            parser.error(f"Неизвестные метрики: {', '.join(unknown)}")
+
+    if args.sample is not None:
+        if args.heatmap or metric_names:
+            parser.error("--sample нельзя использовать вместе с --heatmap и --metrics")
+        if not 0 < args.sample <= 1:
+            parser.error("--sample: доля должна быть больше 0 и не больше 1")
+
+    if (args.heatmap or metric_names) and args.engine != 'numpy':
+        print("Для --heatmap и --metrics используется движок numpy", file=sys.stderr)
+        args.engine = 'numpy'
+
+    if text_output:
+        print("Анализатор нагрузки пальцев")
+        print("=" * 50)
+
+    try:
+        layouts = resolve_layouts(args.layouts, args.layout_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    cache = None if args.no_cache else ResultCache()
+    files_to_analyze = [(filename, args.mode) for filename in args.files] or DEFAULT_FILES
+    exit_code = 0
+
+    for filename, mode in files_to_analyze:
+        streamed = filename == '-'
+        if not streamed and not os.path.exists(filename):
+            print(f"Файл {filename} не найден", file=sys.stdout if text_output else sys.stderr)
+            exit_code = 1
+            continue
+
+        if text_output:
+            print(f"\nАнализируем {'stdin' if streamed else filename}...")
+        file_profile = run_profile.file(filename) if run_profile else None
+        key_stats = {} if args.heatmap and mode == 'text' else None
+        metrics = {} if metric_names and mode == 'text' else None
+        sample = None
+        if args.sample is not None and mode == 'text':
+            from sampling import Sampling
+            sample = Sampling(args.sample, args.seed)
+        if streamed:
+            results = analyze_stdin(layouts, args)
+        else:
+            with messages:
+                results = analyze_file_multi(filename, layouts, engine=args.engine, workers=args.workers, mode=mode,
+                                             cache=cache, encoding=args.encoding, profile=file_profile,
+                                             checkpoints=args.incremental or None, key_stats=key_stats,
+                                             metrics=metrics, sample=sample)
+        key_stats = list(key_stats.values()) if key_stats else None
+        metrics = {name: accumulator.result(metric_names) for name, accumulator in metrics.items()} \
+            if metrics else None
+
+        if text_output:
+            file_results = print_results(layouts, results)
+            for stats in key_stats or []:
+                heaviest = ', '.join(f"{label} {penalty:,}" for label, (_, penalty) in list(stats.by_key().items())[:5])
+                print(f"Самые тяжёлые клавиши {stats.name}: {heaviest}")
+            for layout_name, values in (metrics or {}).items():
+                print(f"Метрики {layout_name}: " + ', '.join(f"{name} {value['count']:,} ({value['ratio']:.1%})"
+                                                             for name, value in values.items()))
+            if sample and sample.estimates:
+                print(f"Оценки по выборке ({sample.describe()}):")
+                for layout_name, estimates in sample.estimates.items():
+                    total, low, high = estimates['total']
+                    share, share_low, share_high = estimates['left_share']
+                    print(f"  {layout_name}: суммарный штраф {total:,.0f} [{low:,.0f} - {high:,.0f}], "
+                          f"левая рука {share:.1%} [{share_low:.1%} - {share_high:.1%}]")
         else:
-            print(f"Файл {filename} не найден")
+            if not streamed:
+                print(format_results(filename, layouts, results, args.output, metrics, sample), flush=True)
+            file_results = [(layout_config['name'], finger_penalties)
+                            for layout_config, (_, finger_penalties, total_chars) in zip(layouts, results)
+                            if total_chars > 0]
+
+        if file_results and not args.no_plot:
+            with timed(run_profile, 'plot'):
+                if renderer:
+                    renderer.submit(file_results, filename, key_stats)
+                else:
+                    plot_finger_penalties_comparison(file_results, filename)
+                    plot_hand_distribution(file_results, filename)
+                    if key_stats:
+                        plot_key_heatmap(key_stats, filename)
+
+    with messages:
+        if renderer:
+            with timed(run_profile, 'plot'):
+                paths = renderer.close()
+            print(f"Графики сохранены в {args.report}: {len(paths)} файлов")
+
+        if run_profile:
+            run_profile.write(args.profile)
+            print(f"Замеры записаны в {args.profile}")
+
+    return exit_code
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import numpy as np
+from compiled_layout import compile_layout, SKIP
+
+KEYSTROKE, TRANSITION = 'keystroke', 'transition'
+
+METRICS = {}
+
+
+class Metric:
+    """
+    Метрика набора. build(keys) строит по таблице клавиш KeyTable пару массивов:
+    что считается и от чего берётся доля. Для метрики нажатий (per='keystroke') это
+    массивы по клавишам, для метрики переходов (per='transition') - матрицы
+    предыдущая клавиша x следующая клавиша
+    """
+
+    def __init__(self, name, per, description, build):
+        if per not in (KEYSTROKE, TRANSITION):
+            raise ValueError(f"Неизвестный тип метрики: {per}")
+        self.name = name
+        self.per = per
+        self.description = description
+        self.build = build
+
+
+def register_metric(name, per, description):
+    """
+    Декоратор, регистрирующий функцию build новой метрики в METRICS
+
+    Args:
+        name: название метрики
+        per: 'keystroke' - по нажатиям, 'transition' - по переходам между соседними нажатиями
+        description: описание для вывода
+
+    Returns:
+        Декоратор
+    """
+    def register(build):
+        METRICS[name] = Metric(name, per, description, build)
+        return build
+    return register
+
+
+class KeyTable:
+    """
+    Свойства клавиш раскладки для построения таблиц метрик (массивы по номерам клавиш):
+    ряд, колонка, номер пальца (-1 - клавишей не пользуются), номер пальца на руке
+    (1 - большой, 5 - мизинец), рука и домашний ряд пальца
+    """
+
+    def __init__(self, compiled, tables):
+        fingers = compiled.fingers
+        home_positions = compiled.config['home_positions']
+        self.row = np.array([row for row, _ in compiled.positions])
+        self.column = np.array([column for _, column in compiled.positions])
+
+        self.finger = np.full(compiled.n_keys, -1)
+        self.finger[np.array(compiled.home_keys)] = np.arange(len(fingers))
+        pressed = tables.kind != SKIP
+        self.finger[tables.slot[pressed]] = tables.finger[pressed]
+
+        used = self.finger >= 0
+        finger = np.where(used, self.finger, 0)
+        self.digit = np.where(used, np.array([int(name[1]) for name in fingers])[finger], 0)
+        self.hand = np.where(used, np.array(compiled.finger_hand)[finger], -1)
+        self.home_row = np.where(used, np.array([home_positions[name][0] for name in fingers])[finger], -1)
+
+    def pairs(self, values):
+        """
+        Возвращает значения предыдущей и следующей клавиши перехода в виде столбца и строки
+        """
+        return values[:, None], values[None, :]
+
+
+def _same_hand_fingers(keys):
+    """
+    Переходы между клавишами одной руки, нажатыми разными пальцами (без больших)
+    """
+    hand_from, hand_to = keys.pairs(keys.hand)
+    digit_from, digit_to = keys.pairs(keys.digit)
+    return (hand_from == hand_to) & (hand_from >= 0) & (digit_from > 1) & (digit_to > 1) & (digit_from != digit_to)
+
+
+def _used_pairs(keys):
+    finger_from, finger_to = keys.pairs(keys.finger)
+    return (finger_from >= 0) & (finger_to >= 0)
+
+
+@register_metric('same_finger', TRANSITION, 'одним пальцем подряд по разным клавишам')
+def same_finger(keys):
+    finger_from, finger_to = keys.pairs(keys.finger)
+    different = ~np.eye(len(keys.finger), dtype=bool)
+    return (finger_from == finger_to) & (finger_from >= 0) & different, _used_pairs(keys)
+
+
+@register_metric('roll_in', TRANSITION, 'переход внутрь: от мизинца к указательному на одной руке')
+def roll_in(keys):
+    digit_from, digit_to = keys.pairs(keys.digit)
+    return _same_hand_fingers(keys) & (digit_to < digit_from), _used_pairs(keys)
+
+
+@register_metric('roll_out', TRANSITION, 'переход наружу: от указательного к мизинцу на одной руке')
+def roll_out(keys):
+    digit_from, digit_to = keys.pairs(keys.digit)
+    return _same_hand_fingers(keys) & (digit_to > digit_from), _used_pairs(keys)
+
+
+@register_metric('row_jump', TRANSITION, 'прыжок через ряд одной рукой (разница рядов 2 и больше)')
+def row_jump(keys):
+    hand_from, hand_to = keys.pairs(keys.hand)
+    digit_from, digit_to = keys.pairs(keys.digit)
+    row_from, row_to = keys.pairs(keys.row)
+    jumps = (hand_from == hand_to) & (digit_from > 1) & (digit_to > 1) & (abs(row_from - row_to) >= 2)
+    return jumps, _used_pairs(keys)
+
+
+@register_metric('home_row', KEYSTROKE, 'нажатия в домашнем ряду пальца (без больших)')
+def home_row(keys):
+    fingers = keys.digit > 1
+    return fingers & (keys.row == keys.home_row), fingers
+
+
+def _check_names(names):
+    """
+    Проверяет, что все метрики зарегистрированы, и возвращает их названия кортежем
+    """
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise ValueError(f"Неизвестные метрики: {', '.join(unknown)}")
+    return tuple(names)
+
+
+class MetricAccumulator:
+    """
+    Накопитель метрик за один проход: во время подсчёта (engine.score_codes) копятся только
+    количество нажатий каждой клавиши и количество переходов клавиша -> клавиша, а все
+    включённые метрики получаются из этих гистограмм в result() умножением на свои таблицы.
+    Поэтому пять метрик стоят почти столько же, сколько одна.
+    Нажатие символа с Shift или Alt учитывается как нажатие его основной клавиши,
+    пробел и enter - на своих клавишах
+    """
+
+    def __init__(self, layout_config, names=None):
+        from engine import layout_tables
+
+        self.compiled = compile_layout(layout_config)
+        self.names = _check_names(names or METRICS)
+
+        self.keys = KeyTable(self.compiled, layout_tables(self.compiled))
+        n_keys = self.compiled.n_keys
+        self.keystrokes = np.zeros(n_keys, dtype=np.int64)
+        self.transitions = np.zeros(n_keys * n_keys, dtype=np.int64)
+        self.last_key = -1
+
+    def add_keys(self, keys):
+        """
+        Добавляет последовательность нажатых клавиш (продолжая с прошлой части)
+
+        Args:
+            keys: массив номеров клавиш
+
+        Returns:
+            None
+        """
+        if len(keys) == 0:
+            return
+        n_keys = self.compiled.n_keys
+        keys = keys.astype(np.intp)
+        self.keystrokes += np.bincount(keys, minlength=n_keys)
+        pairs = keys[:-1] * n_keys
+        pairs += keys[1:]
+        self.transitions += np.bincount(pairs, minlength=n_keys * n_keys)
+        if self.last_key >= 0:
+            self.transitions[self.last_key * n_keys + keys[0]] += 1
+        self.last_key = int(keys[-1])
+
+    def result(self, names=None):
+        """
+        Считает метрики по накопленным гистограммам (повторного прохода по тексту не нужно)
+
+        Args:
+            names: названия метрик (None - включённые при создании)
+
+        Returns:
+            Словарь метрика -> {'count': сколько раз, 'total': из скольких нажатий или переходов,
+            'ratio': доля}
+        """
+        names = _check_names(names) if names else self.names
+        n_keys = self.compiled.n_keys
+        transitions = self.transitions.reshape(n_keys, n_keys)
+        results = {}
+        for name in names:
+            metric = METRICS[name]
+            counted, eligible = metric.build(self.keys)
+            histogram = self.keystrokes if metric.per == KEYSTROKE else transitions
+            count = int(histogram[counted].sum())
+            total = int(histogram[eligible].sum())
+            results[name] = {'count': count, 'total': total, 'ratio': count / total if total else 0.0}
+        return results
@@ -0,0 +1,393 @@
+import math
+import random
+import numpy as np
+from compiled_layout import compile_layout, SPACE, SHIFT, ALT, NEWLINE, PLAIN
+from engine import layout_tables, mapped_points, text_points
+
+FIXED_KEYS = (' ', 'space', 'shift', 'SHIFT', 'enter', 'alt')
+
+
+def movable_groups(layout_config):
+    """
+    Находит клавиши, которые можно переставлять: все символы раскладки на одной позиции
+    образуют группу (строчная и заглавная буква, alt-символ на той же клавише),
+    группа переставляется целиком. Клавиши без строчных букв (цифры, знаки)
+    и клавиши из FIXED_KEYS остаются на месте
+
+    Args:
+        layout_config: данные раскладки
+
+    Returns:
+        Список пар (позиция, список символов группы) в порядке позиций
+    """
+    by_position = {}
+    for key, position in layout_config['layout'].items():
+        by_position.setdefault(position, []).append(key)
+
+    groups = []
+    for position in sorted(by_position):
+        keys = by_position[position]
+        if any(key in FIXED_KEYS for key in keys):
+            continue
+        if any(len(key) == 1 and key.isalpha() and key.islower() for key in keys):
+            groups.append((position, keys))
+    return groups
+
+
+def bigram_counts(chunks, layout_config):
+    """
+    Считает пары подряд нажатых символов корпуса (пропускаемые символы не учитываются)
+
+    Args:
+        chunks: итерируемый объект с кодовыми точками частей текста (см. engine.text_points)
+        layout_config: данные раскладки
+
+    Returns:
+        Матрица количеств пар кодов символов раскладки (n_codes x n_codes)
+    """
+    compiled = compile_layout(layout_config)
+    counts = None
+    last = None
+
+    for points in chunks:
+        tables = layout_tables(compiled)
+        codes = tables.codes(points)
+        tables = layout_tables(compiled)
+        n_codes = len(tables.kind)
+        if counts is None or len(counts) < n_codes:
+            grown = np.zeros((n_codes, n_codes), dtype=np.int64)
+            if counts is not None:
+                grown[:len(counts), :len(counts)] = counts
+            counts = grown
+        if not len(codes):
+            continue
+        if last is not None:
+            counts[last, codes[0]] += 1
+        pairs = codes[:-1].astype(np.int64) * n_codes + codes[1:]
+        counts += np.bincount(pairs, minlength=n_codes * n_codes).reshape(n_codes, n_codes)
+        last = codes[-1]
+
+    if counts is None:
+        n_codes = len(layout_tables(compiled).kind)
+        counts = np.zeros((n_codes, n_codes), dtype=np.int64)
+    return counts
+
+
+def text_bigram_counts(text, layout_config):
+    """
+    Считает пары подряд нажатых символов текста (см. bigram_counts)
+    """
+    return bigram_counts([text_points(text)], layout_config)
+
+
+def file_bigram_counts(filename, layout_config, chunk_size=1024 * 1024):
+    """
+    Считает пары подряд нажатых символов файла в UTF-8 (см. bigram_counts)
+    """
+    return bigram_counts(mapped_points(filename, chunk_size), layout_config)
+
+
+class SwapModel:
+    """
+    Приближённая модель штрафов для перестановки клавиш. Штраф каждого нажатия
+    зависит только от предыдущего нажатия: смена руки, выбор shift, alt, пробел и enter
+    считаются точно, а перемещение пальца - от клавиши предыдущего нажатия, если это
+    тот же палец, иначе - от домашней позиции.
+
+    Тогда сумма штрафов - квадратичная форма sum(F[t, u] * D[P[t], P[u]]), где F - количества
+    пар токенов (группа клавиш и тип нажатия или неподвижный символ), D - штраф пары
+    состояний (позиция, палец, тип нажатия), P - текущее состояние каждого токена.
+    Перестановка двух групп меняет только строки и столбцы их токенов, поэтому
+    разница штрафов считается за O(количество токенов), без повторного прохода по тексту
+    """
+
+    def __init__(self, layout_config, bigrams):
+        compiled = compile_layout(layout_config)
+        tables = layout_tables(compiled)
+        self.config = layout_config
+        self.groups = movable_groups(layout_config)
+
+        finger_assignment = layout_config['finger_assignment']
+        slot_index = {position: i for i, (position, _) in enumerate(self.groups)}
+        self.slot_fingers = []
+        for position, keys in self.groups:
+            letters = [key for key in keys if len(key) == 1 and key.isalpha() and key.islower()]
+            self.slot_fingers.append(finger_assignment.get(letters[0], 'f1l'))
+
+        kinds = (PLAIN, SHIFT, ALT)
+        states = []
+        state_index = {}
+
+        def state_of(kind, finger, key):
+            state = (kind, finger, key)
+            if state not in state_index:
+                state_index[state] = len(states)
+                states.append(state)
+            return state_index[state]
+
+        self._slot_states = np.array(
+            [[state_of(kind, compiled.finger_index[self.slot_fingers[slot]], compiled.key_index[position])
+              for kind in kinds] for slot, (position, _) in enumerate(self.groups)], dtype=np.int64)
+
+        n_codes = len(tables.kind)
+        token_of_code = np.zeros(n_codes, dtype=np.int64)
+        tokens = {}
+        group_tokens = [[] for _ in self.groups]
+        placement = []
+        for code in range(1, n_codes):
+            kind, finger, key = int(tables.kind[code]), int(tables.finger[code]), int(tables.key[code])
+            slot = slot_index.get(compiled.positions[key]) if kind in kinds else None
+            token = ('slot', slot, kind) if slot is not None else ('state', state_of(kind, finger, key))
+            if token not in tokens:
+                tokens[token] = len(placement)
+                if slot is not None:
+                    group_tokens[slot].append((len(placement), kinds.index(kind)))
+                    placement.append(self._slot_states[slot, kinds.index(kind)])
+                else:
+                    placement.append(token[1])
+            token_of_code[code] = tokens[token]
+
+        n_tokens = len(placement)
+        bigrams = np.asarray(bigrams, dtype=np.int64)[:n_codes, :n_codes]
+        pairs = token_of_code[:len(bigrams), None] * n_tokens + token_of_code[None, :len(bigrams)]
+        self.counts = np.bincount(pairs.ravel(), weights=bigrams.ravel(),
+                                  minlength=n_tokens * n_tokens).astype(np.int64).reshape(n_tokens, n_tokens)
+        self.costs = self._state_costs(compiled, states)
+        self.placement = np.array(placement, dtype=np.int64)
+        self.group_tokens = group_tokens
+        self.slots = list(range(len(self.groups)))
+        # потенциалы считаются в float64 (целые значения представлены точно, а умножение матриц быстрее)
+        self._float_counts = self.counts.astype(np.float64)
+        self._float_costs = self.costs.astype(np.float64)
+        self.rows = self._float_counts @ self._float_costs[:, self.placement].T
+        self.columns = self._float_counts.T @ self._float_costs[self.placement]
+        self.score = self.total()
+
+        self._slot_state_lists = self._slot_states.tolist()
+        self._cost_lists = self.costs.tolist()
+        self._count_lists = self.counts.tolist()
+
+    @staticmethod
+    def _state_costs(compiled, states):
+        """
+        Строит матрицу штрафов нажатия состояния j сразу после состояния i
+
+        Args:
+            compiled: скомпилированная раскладка
+            states: список состояний (тип нажатия, палец, клавиша)
+
+        Returns:
+            Матрица штрафов
+        """
+        finger_hand = compiled.finger_hand
+        cost = compiled.cost
+        n_keys = compiled.n_keys
+        costs = np.zeros((len(states), len(states)), dtype=np.int64)
+
+        for i, (prev_kind, prev_finger, prev_key) in enumerate(states):
+            if prev_kind == SPACE:
+                prev_hand = 0
+            elif prev_kind == NEWLINE:
+                prev_hand = 1
+            else:
+                prev_hand = finger_hand[prev_finger]
+            prev_moves = prev_kind in (PLAIN, SHIFT, ALT)
+
+            for j, (kind, finger, key) in enumerate(states):
+                hand = finger_hand[finger]
+                if kind == SPACE:
+                    costs[i, j] = 1 + (prev_hand == 1)
+                    continue
+                if kind == NEWLINE:
+                    costs[i, j] = 2 + (prev_hand == 0)
+                    continue
+
+                start = prev_key if prev_moves and prev_finger == finger else compiled.home_keys[finger]
+                penalty = cost[start * n_keys + key]
+                if kind == PLAIN:
+                    penalty += prev_hand != hand
+                elif kind == SHIFT:
+                    penalty += 1 + (hand != (prev_hand == 1))
+                else:
+                    penalty += 1 + (prev_hand == 0) + (hand == 0)
+                costs[i, j] = penalty
+        return costs
+
+    def total(self):
+        """
+        Возвращает приближённую сумму штрафов текущей перестановки
+        """
+        return int((self.counts * self.costs[np.ix_(self.placement, self.placement)]).sum())
+
+    def _changes(self, a, b):
+        """
+        Возвращает для токенов групп a и b тройки (токен, текущее состояние, состояние после перестановки)
+        """
+        states_a = self._slot_state_lists[self.slots[a]]
+        states_b = self._slot_state_lists[self.slots[b]]
+        return ([(token, states_a[kind], states_b[kind]) for token, kind in self.group_tokens[a]]
+                + [(token, states_b[kind], states_a[kind]) for token, kind in self.group_tokens[b]])
+
+    def delta(self, a, b):
+        """
+        Считает изменение приближённого штрафа при перестановке групп a и b.
+        Используются потенциалы rows[t, s] = sum(F[t, u] * D[s, P[u]]) и
+        columns[u, s] = sum(F[t, u] * D[P[t], s]), поэтому разница считается по нескольким
+        токенам двух групп и поправке для пар токенов внутри них
+
+        Args:
+            a: номер первой группы
+            b: номер второй группы
+
+        Returns:
+            Разница штрафов (отрицательная - перестановка выгодна)
+        """
+        changes = self._changes(a, b)
+        row, column = self.rows.item, self.columns.item
+        costs, counts = self._cost_lists, self._count_lists
+
+        delta = 0
+        for token, old, new in changes:
+            delta += row(token, new) - row(token, old) + column(token, new) - column(token, old)
+            token_counts, old_costs, new_costs = counts[token], costs[old], costs[new]
+            for other, other_old, other_new in changes:
+                count = token_counts[other]
+                if count:
+                    delta += count * (new_costs[other_new] - new_costs[other_old]
+                                      - old_costs[other_new] + old_costs[other_old])
+        return int(delta)
+
+    def swap(self, a, b, delta=None):
+        """
+        Переставляет группы a и b и обновляет потенциалы
+
+        Args:
+            a: номер первой группы
+            b: номер второй группы
+            delta: уже посчитанная разница штрафов (если None - считается)
+
+        Returns:
+            None
+        """
+        if delta is None:
+            delta = self.delta(a, b)
+        changes = self._changes(a, b)
+        tokens = [token for token, _, _ in changes]
+        old = [state for _, state, _ in changes]
+        new = [state for _, _, state in changes]
+        counts, costs = self._float_counts, self._float_costs
+        self.rows += counts[:, tokens] @ (costs[:, new] - costs[:, old]).T
+        self.columns += counts[tokens].T @ (costs[new] - costs[old])
+        self.placement[tokens] = new
+        self.slots[a], self.slots[b] = self.slots[b], self.slots[a]
+        self.score += delta
+
+    def layout(self, slots=None, name=None):
+        """
+        Собирает данные раскладки в формате layout.py для перестановки
+
+        Args:
+            slots: номер позиции для каждой группы (по умолчанию - текущая перестановка)
+            name: название раскладки
+
+        Returns:
+            Данные раскладки
+        """
+        slots = self.slots if slots is None else slots
+        layout = dict(self.config['layout'])
+        finger_assignment = dict(self.config['finger_assignment'])
+        for group, slot in enumerate(slots):
+            position = self.groups[slot][0]
+            for key in self.groups[group][1]:
+                layout[key] = position
+                finger_assignment[key] = self.slot_fingers[slot]
+
+        result = dict(self.config)
+        result['name'] = name or self.config['name']
+        result['layout'] = layout
+        result['finger_assignment'] = finger_assignment
+        return result
+
+
+def optimize_layout(layout_config, bigrams, iterations=1000000, seed=None, temperature=None, name=None):
+    """
+    Ищет перестановку клавиш с меньшим штрафом методом имитации отжига.
+    Каждая попытка - перестановка двух случайных групп клавиш с оценкой SwapModel.delta;
+    температура убывает геометрически от temperature до тысячной её доли
+
+    Args:
+        layout_config: исходная раскладка
+        bigrams: количества пар символов корпуса (см. bigram_counts)
+        iterations: количество попыток перестановки
+        seed: зерно генератора случайных чисел
+        temperature: начальная температура (по умолчанию - средний модуль разницы штрафов
+            случайной перестановки)
+        name: название новой раскладки (по умолчанию - исходное)
+
+    Returns:
+        Лучшая найденная раскладка в формате layout.py и её приближённый штраф
+    """
+    model = SwapModel(layout_config, bigrams)
+    n_groups = len(model.groups)
+    rng = random.Random(seed)
+    best_slots, best_score = list(model.slots), model.score
+    if n_groups < 2 or iterations <= 0:
+        return model.layout(best_slots, name), best_score
+
+    if temperature is None:
+        samples = [abs(model.delta(*rng.sample(range(n_groups), 2))) for _ in range(200)]
+        temperature = max(sum(samples) / len(samples), 1)
+    cooling = 0.001 ** (1 / iterations)
+
+    for _ in range(iterations):
+        a, b = rng.sample(range(n_groups), 2)
+        delta = model.delta(a, b)
+        if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+            model.swap(a, b, delta)
+            if model.score < best_score:
+                best_slots, best_score = list(model.slots), model.score
+        temperature *= cooling
+
+    return model.layout(best_slots, name), best_score
+
+
+def layout_source(layout_config, function_name='optimized_layout'):
+    """
+    Записывает раскладку в виде функции, как в layout.py
+
+    Args:
+        layout_config: данные раскладки
+        function_name: имя функции
+
+    Returns:
+        Исходный код функции
+    """
+    def mapping(values):
+        items = [f"{key!r}: {value!r}" for key, value in values.items()]
+        lines = [', '.join(items[i:i + 6]) for i in range(0, len(items), 6)]
+        return '{\n        ' + ',\n        '.join(lines) + '\n    }'
+
+    lines = [
+        f"def {function_name}():",
+        '    """',
+        f"    Раскладка {layout_config['name']}, найденная optimizer.optimize_layout",
+        '',
+        '    Returns:',
+        '        Название раскладки, положение букв, домашний ряд и положение пальцев',
+        '    """',
+        f"    layout = {mapping(layout_config['layout'])}",
+        '',
+        f"    home_positions = {mapping(layout_config['home_positions'])}",
+        '',
+        f"    finger_assignment = {mapping(layout_config['finger_assignment'])}",
+        '',
+        '    return {',
+        f"        'name': {layout_config['name']!r},",
+        "        'layout': layout,",
+        "        'home_positions': home_positions,",
+        "        'finger_assignment': finger_assignment,",
+    ]
+    if 'alt_symbols' in layout_config:
+        lines.append(f"        'alt_symbols': {set(sorted(layout_config['alt_symbols']))!r},")
+    lines.append('    }')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,168 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from analyzer import Analyzer, AnalysisState, score_text
+from compiled_layout import compile_layout
+
+MIN_PART_SIZE = 16 * 1024 * 1024
+
+
+def split_ranges(filename, parts):
+    """
+    Делит файл на диапазоны байтов примерно одинакового размера.
+    Границы сдвигаются вперёд до начала символа UTF-8 и не разрывают пару '\\r\\n'
+
+    Args:
+        filename: путь к файлу
+        parts: желаемое количество диапазонов
+
+    Returns:
+        Список пар (начало, конец)
+    """
+    file_size = os.path.getsize(filename)
+    parts = max(1, min(parts, file_size))
+    bounds = [0]
+
+    with open(filename, 'rb') as file:
+        for i in range(1, parts):
+            position = file_size * i // parts
+            file.seek(position - 1)
+            window = file.read(8)
+            offset = 1
+            while offset < len(window) and (window[offset] & 0xC0) == 0x80:
+                offset += 1
+            if window[offset - 1:offset + 1] == b'\r\n':
+                offset += 1
+            position = min(position + offset - 1, file_size)
+            if position > bounds[-1]:
+                bounds.append(position)
+
+    bounds.append(file_size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _score_range(filename, start, end, layouts, chunk_size, encoding='utf-8'):
+    """
+    Анализирует диапазон байтов файла, начиная с домашних позиций и без предыдущего нажатия.
+    Выполняется в отдельном процессе
+
+    Args:
+        filename: путь к файлу
+        start: начало диапазона
+        end: конец диапазона
+        layouts: список данных раскладок
+        chunk_size: размер части для чтения
+        encoding: utf-8 или однобайтовая кодировка
+
+    Returns:
+        Список частичных состояний AnalysisState (по одному на раскладку)
+    """
+    from engine import mapped_points, score_points, single_byte_points
+
+    if single_byte_points(encoding) is not None:
+        analyzers = [Analyzer(layout_config, 'numpy', encoding) for layout_config in layouts]
+        for analyzer in analyzers:
+            analyzer.state = AnalysisState(analyzer.compiled, track_first=True)
+        with open(filename, 'rb') as file:
+            file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = file.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                for analyzer in analyzers:
+                    analyzer.feed(data)
+        for analyzer in analyzers:
+            analyzer.close()
+        return [analyzer.state for analyzer in analyzers]
+
+    compiled_layouts = [compile_layout(layout_config) for layout_config in layouts]
+    states = [AnalysisState(compiled, track_first=True) for compiled in compiled_layouts]
+
+    for points in mapped_points(filename, chunk_size, start, end):
+        for compiled, state in zip(compiled_layouts, states):
+            score_points(points, compiled, state)
+
+    return states
+
+
+def merge_states(compiled, partials):
+    """
+    Склеивает частичные состояния соседних диапазонов в результат последовательного прохода.
+    На каждом стыке пересчитываются штрафы первого нажатия диапазона с учётом руки
+    предыдущего нажатия и перемещения пальцев с их настоящих позиций, а не с домашних
+
+    Args:
+        compiled: скомпилированная раскладка
+        partials: частичные состояния в порядке диапазонов
+
+    Returns:
+        Итоговое AnalysisState
+    """
+    state = AnalysisState(compiled)
+    cost = compiled.cost
+    n_keys = compiled.n_keys
+
+    for partial in partials:
+        if partial.first_char is None:
+            continue
+
+        if state.previous_hand >= 0:
+            seam = AnalysisState(compiled)
+            seam.previous_hand = state.previous_hand
+            score_text(compiled, partial.first_char, seam)
+            alone = AnalysisState(compiled)
+            score_text(compiled, partial.first_char, alone)
+            for finger in range(len(compiled.fingers)):
+                state.penalties[finger] += seam.penalties[finger] - alone.penalties[finger]
+
+        for finger, key in enumerate(partial.first_keys):
+            if key is not None:
+                home = compiled.home_keys[finger]
+                state.penalties[finger] += (cost[state.positions[finger] * n_keys + key]
+                                            - cost[home * n_keys + key])
+                state.positions[finger] = partial.positions[finger]
+
+        for finger, penalty in enumerate(partial.penalties):
+            state.penalties[finger] += penalty
+        state.total_chars += partial.total_chars
+        state.previous_hand = partial.previous_hand
+
+    return state
+
+
+def analyze_file_parallel(filename, layouts, workers=None, chunk_size=1024 * 1024, min_part_size=MIN_PART_SIZE,
+                          encoding='utf-8'):
+    """
+    Анализ большого файла на нескольких ядрах: файл делится на диапазоны байтов,
+    каждый диапазон считается в отдельном процессе (движком numpy), а результаты
+    склеиваются так, что совпадают с последовательным проходом
+
+    Args:
+        filename: путь к файлу
+        layouts: список данных раскладок
+        workers: количество процессов (по умолчанию - количество ядер)
+        chunk_size: размер части для чтения внутри диапазона
+        min_part_size: минимальный размер диапазона
+        encoding: utf-8 или однобайтовая кодировка (cp1251, koi8-r, ...)
+
+    Returns:
+        Список кортежей (сумма штрафов, штраф по каждому пальцу, общее количество символов)
+        в порядке раскладок
+    """
+    workers = workers or os.cpu_count() or 1
+    file_size = os.path.getsize(filename)
+    parts = max(1, min(workers * 2, file_size // max(min_part_size, 1)))
+    ranges = split_ranges(filename, parts)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+        futures = [pool.submit(_score_range, filename, start, end, layouts, chunk_size, encoding)
+                   for start, end in ranges]
+        partials = [future.result() for future in futures]
+
+    results = []
+    for index, layout_config in enumerate(layouts):
+        compiled = compile_layout(layout_config)
+        state = merge_states(compiled, [states[index] for states in partials])
+        results.append(state.result(compiled.fingers))
+    return results
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import sys
+
+DEFAULT_REPORT_DIR = 'reports'
+FORMATS = ('png', 'svg', 'pdf')
+
+
+def has_display():
+    """
+    Проверяет, можно ли показывать окна matplotlib (на Linux без DISPLAY и WAYLAND_DISPLAY - нельзя)
+
+    Returns:
+        True, если окна показывать можно
+    """
+    if sys.platform.startswith('linux'):
+        return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    return True
+
+
+def report_name(filename, taken):
+    """
+    Выбирает имя отчёта для файла: имя файла без расширения, а если оно уже занято другим файлом
+    в этом запуске (a/text.txt и b/text.txt) - с коротким хешем полного пути
+
+    Args:
+        filename: имя анализируемого файла
+        taken: словарь имя отчёта -> полный путь файла, уже получившего это имя (дополняется)
+
+    Returns:
+        Имя отчёта
+    """
+    path = os.path.abspath(filename)
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if taken.get(name, path) != path:
+        name = f"{name}_{hashlib.blake2b(path.encode('utf-8'), digest_size=4).hexdigest()}"
+    taken.setdefault(name, path)
+    return name
+
+
+def report_paths(filename, output_dir, formats, name=None):
+    """
+    Составляет пути файлов отчёта для анализируемого файла
+
+    Args:
+        filename: имя анализируемого файла
+        output_dir: папка отчётов
+        formats: форматы файлов ('png', 'svg', 'pdf')
+        name: имя отчёта (None - имя файла без расширения, см. report_name)
+
+    Returns:
+        Пара списков путей: диаграмма по пальцам, диаграммы по рукам
+    """
+    name = name or os.path.splitext(os.path.basename(filename))[0]
+    fingers = [os.path.join(output_dir, f"{name}_fingers.{fmt}") for fmt in formats]
+    hands = [os.path.join(output_dir, f"{name}_hands.{fmt}") for fmt in formats]
+    return fingers, hands
+
+
+def render_file_report(file_results, filename, output_dir, formats=('png',), key_stats=None, name=None):
+    """
+    Рисует обе диаграммы для одного файла без окон (бэкенд Agg) и сохраняет их,
+    а с key_stats - ещё и тепловую карту клавиш (<имя>_keys.<формат>)
+
+    Args:
+        file_results: список кортежей (название раскладки, штрафы по пальцам)
+        filename: имя анализируемого файла
+        output_dir: папка отчётов
+        formats: форматы файлов
+        key_stats: список KeyStats (см. keystats.py) или None
+        name: имя отчёта (см. report_paths)
+
+    Returns:
+        Список путей сохранённых файлов
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from main import plot_finger_penalties_comparison, plot_hand_distribution, plot_key_heatmap
+
+    os.makedirs(output_dir, exist_ok=True)
+    fingers, hands = report_paths(filename, output_dir, formats, name)
+    plot_finger_penalties_comparison(file_results, filename, fingers)
+    plot_hand_distribution(file_results, filename, hands)
+    if not key_stats:
+        return fingers + hands
+    keys = [path.replace('_fingers.', '_keys.') for path in fingers]
+    plot_key_heatmap(key_stats, filename, keys)
+    return fingers + hands + keys
+
+
+class ReportRenderer:
+    """
+    Рисует отчёты в фоновых процессах: submit() сразу возвращает управление,
+    поэтому анализ следующих файлов не ждёт matplotlib. close() дожидается всех отчётов.
+    Файлы с одинаковым именем из разных папок получают разные имена отчётов (см. report_name).
+    С workers=0 отчёты рисуются сразу в текущем процессе
+    """
+
+    def __init__(self, output_dir=DEFAULT_REPORT_DIR, formats=('png',), workers=None):
+        unknown = [fmt for fmt in formats if fmt not in FORMATS]
+        if unknown:
+            raise ValueError(f"Неизвестные форматы отчёта: {', '.join(unknown)}")
+
+        self.output_dir = output_dir
+        self.formats = tuple(formats)
+        self.paths = []
+        self._names = {}
+        self._futures = []
+        self._pool = None
+        if workers != 0:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, file_results, filename, key_stats=None):
+        """
+        Ставит в очередь отчёт по одному файлу
+
+        Args:
+            file_results: список кортежей (название раскладки, штрафы по пальцам)
+            filename: имя анализируемого файла
+            key_stats: список KeyStats для тепловой карты клавиш или None
+
+        Returns:
+            None
+        """
+        name = report_name(filename, self._names)
+        if self._pool is None:
+            self.paths.extend(render_file_report(file_results, filename, self.output_dir, self.formats, key_stats,
+                                                 name))
+        else:
+            self._futures.append(self._pool.submit(render_file_report, file_results, filename,
+                                                   self.output_dir, self.formats, key_stats, name))
+
+    def close(self):
+        """
+        Дожидается всех отчётов
+
+        Returns:
+            Список путей всех сохранённых файлов
+        """
+        try:
+            for future in self._futures:
+                self.paths.extend(future.result())
+        finally:
+            self._futures = []
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        return self.paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from analyzer import SCORING_VERSION
+from compiled_layout import compile_layout
+
+DEFAULT_CACHE_PATH = '.layout_cache.sqlite'
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def file_content_digest(filename, block_size=1024 * 1024):
+    """
+    Вычисляет хеш содержимого файла
+
+    Args:
+        filename: путь к файлу
+        block_size: размер блока для чтения
+
+    Returns:
+        Шестнадцатеричная строка хеша
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Дисковый кеш результатов анализа в файле SQLite.
+    Ключ - хеш содержимого файла, хеш раскладки (layout, home_positions,
+    finger_assignment, alt_symbols), версия модели подсчёта и режим чтения файла.
+    При превышении max_entries удаляются записи, которые дольше всего не использовались.
+    Хеш файла запоминается по (путь, размер, время изменения), чтобы не перечитывать
+    неизменившиеся файлы при каждом запуске; запомненные хеши, для которых не осталось
+    результатов, удаляются вместе с вытесненными записями
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS results (
+                file_digest TEXT, layout_digest TEXT, version INTEGER, mode TEXT,
+                total_penalty INTEGER, finger_penalties TEXT, total_chars INTEGER, last_used REAL,
+                PRIMARY KEY (file_digest, layout_digest, version, mode)
+            );
+            CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+            CREATE TABLE IF NOT EXISTS file_digests (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT
+            );
+        ''')
+
+    def file_digest(self, filename):
+        """
+        Возвращает хеш содержимого файла, пересчитывая его только после изменения файла
+
+        Args:
+            filename: путь к файлу
+
+        Returns:
+            Шестнадцатеричная строка хеша
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        row = self.connection.execute(
+            'SELECT digest FROM file_digests WHERE path = ? AND size = ? AND mtime_ns = ?',
+            (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+
+        digest = file_content_digest(path)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO file_digests VALUES (?, ?, ?, ?)',
+                                    (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def get(self, file_digest, layout_config, mode='text'):
+        """
+        Ищет результат в кеше
+
+        Args:
+            file_digest: хеш содержимого файла
+            layout_config: данные раскладки
+            mode: режим чтения файла
+
+        Returns:
+            Кортеж (сумма штрафов, штраф по каждому пальцу, общее количество символов) или None
+        """
+        key = (file_digest, compile_layout(layout_config).digest, SCORING_VERSION, mode)
+        row = self.connection.execute(
+            'SELECT total_penalty, finger_penalties, total_chars FROM results '
+            'WHERE file_digest = ? AND layout_digest = ? AND version = ? AND mode = ?', key).fetchone()
+        if row is None:
+            return None
+
+        with self.connection:
+            self.connection.execute(
+                'UPDATE results SET last_used = ? '
+                'WHERE file_digest = ? AND layout_digest = ? AND version = ? AND mode = ?', (time.time(),) + key)
+        return row[0], json.loads(row[1]), row[2]
+
+    def put(self, file_digest, layout_config, result, mode='text'):
+        """
+        Сохраняет результат в кеш, удаляет самые давние записи сверх max_entries
+        и запомненные хеши файлов, на которые больше не ссылается ни одна запись
+
+        Args:
+            file_digest: хеш содержимого файла
+            layout_config: данные раскладки
+            result: кортеж (сумма штрафов, штраф по каждому пальцу, общее количество символов)
+            mode: режим чтения файла
+
+        Returns:
+            None
+        """
+        total_penalty, finger_penalties, total_chars = result
+        key = (file_digest, compile_layout(layout_config).digest, SCORING_VERSION, mode)
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                key + (total_penalty, json.dumps(finger_penalties, ensure_ascii=False), total_chars, time.time()))
+            self.connection.execute(
+                'DELETE FROM results WHERE rowid IN '
+                '(SELECT rowid FROM results ORDER BY last_used DESC, rowid DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+            self.connection.execute(
+                'DELETE FROM file_digests WHERE digest NOT IN (SELECT file_digest FROM results)')
+
+    def close(self):
+        """
+        Закрывает соединение с базой
+        """
+        self.connection.close()
@@ -0,0 +1,246 @@
+import codecs
+import math
+import mmap
+import os
+import random
+from statistics import NormalDist
+from analyzer import Analyzer
+
+DEFAULT_BLOCK_SIZE = 256 * 1024
+MIN_BLOCKS = 2
+WARMUP_SIZE = 512
+
+
+class Sampling:
+    """
+    Параметры выборочного подсчёта и его результаты. После analyze_file_sampled
+    в estimates лежат оценки по каждой раскладке: кортежи (оценка, нижняя граница, верхняя граница)
+    доверительного интервала для суммарного штрафа, каждого пальца, каждой руки,
+    доли левой руки и количества символов
+    """
+
+    def __init__(self, fraction=0.01, seed=0, block_size=DEFAULT_BLOCK_SIZE, confidence=0.95):
+        if not 0 < fraction <= 1:
+            raise ValueError('Доля выборки должна быть больше 0 и не больше 1')
+        if block_size <= 0:
+            raise ValueError('Размер блока должен быть положительным')
+        if not 0 < confidence < 1:
+            raise ValueError('Уровень доверия должен быть между 0 и 1')
+
+        self.fraction = fraction
+        self.seed = seed
+        self.block_size = block_size
+        self.confidence = confidence
+        self.blocks = 0
+        self.total_blocks = 0
+        self.bytes_read = 0
+        self.estimates = {}
+
+    def describe(self):
+        """
+        Returns:
+            Строка для вывода: доля выборки, блоки и уровень доверия
+        """
+        return (f"выборка {self.fraction:.2%}: {self.blocks} из {self.total_blocks} блоков "
+                f"по {self.block_size // 1024} КБ, интервалы {self.confidence:.0%}")
+
+
+def _boundary(mapped, position, size, utf8):
+    """
+    Сдвигает границу блока вперёд до начала символа UTF-8 и так, чтобы не разорвать пару '\\r\\n'
+    """
+    if position <= 0 or position >= size:
+        return min(max(position, 0), size)
+    if utf8:
+        while position < size and (mapped[position] & 0xC0) == 0x80:
+            position += 1
+    if position < size and mapped[position - 1] == 13 and mapped[position] == 10:
+        position += 1
+    return position
+
+
+def t_quantile(confidence, df):
+    """
+    Квантиль распределения Стьюдента для двустороннего интервала: P(|T| < t) = confidence.
+    P(|T| < t) для целого числа степеней свободы считается конечным рядом (Абрамовиц и Стиган, 26.7.3-26.7.4),
+    а t находится делением отрезка пополам; при df > 1000 берётся квантиль нормального распределения
+
+    Args:
+        confidence: уровень доверия
+        df: число степеней свободы (целое, не меньше 1)
+
+    Returns:
+        Квантиль t
+    """
+    if df > 1000:
+        return NormalDist().inv_cdf((1 + confidence) / 2)
+
+    def coverage(t):
+        theta = math.atan(t / math.sqrt(df))
+        cos2 = math.cos(theta) ** 2
+        term, series = 1.0, 1.0
+        if df % 2:
+            for k in range(2, df - 1, 2):
+                term *= cos2 * k / (k + 1)
+                series += term
+            return 2 / math.pi * (theta + (math.sin(theta) * math.cos(theta) * series if df > 1 else 0.0))
+        for k in range(2, df, 2):
+            term *= cos2 * (k - 1) / k
+            series += term
+        return math.sin(theta) * series
+
+    low, high = 0.0, 1.0
+    while coverage(high) < confidence:
+        low, high = high, high * 2
+    for _ in range(100):
+        middle = (low + high) / 2
+        if coverage(middle) < confidence:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def _ratio_estimate(values, sizes, population_size, population_blocks, z):
+    """
+    Оценка отношения по простой случайной выборке блоков без возвращения: сумма по файлу
+    оценивается как (сумма значений / сумма байтов в выборке) * размер файла, дисперсия -
+    по остаткам значений от этого отношения с поправкой на конечную совокупность
+
+    Args:
+        values: значения по блокам выборки
+        sizes: размеры блоков выборки в байтах
+        population_size: размер файла в байтах
+        population_blocks: количество блоков в файле
+        z: квантиль распределения Стьюдента для уровня доверия (см. t_quantile)
+
+    Returns:
+        Кортеж (оценка, нижняя граница, верхняя граница)
+    """
+    count = len(values)
+    ratio = sum(values) / sum(sizes)
+    estimate = ratio * population_size
+    if count < 2 or count >= population_blocks:
+        return estimate, estimate, estimate
+    residual = sum((value - ratio * size) ** 2 for value, size in zip(values, sizes)) / (count - 1)
+    mean_size = sum(sizes) / count
+    variance = population_size ** 2 * (1 - count / population_blocks) * residual / (count * mean_size ** 2)
+    error = z * math.sqrt(variance)
+    return estimate, estimate - error, estimate + error
+
+
+def _share_estimate(parts, wholes, population_blocks, z):
+    """
+    Оценка доли (например, левой руки в суммарном штрафе) с доверительным интервалом
+
+    Returns:
+        Кортеж (оценка, нижняя граница, верхняя граница)
+    """
+    count = len(parts)
+    ratio = sum(parts) / sum(wholes) if sum(wholes) else 0.0
+    if count < 2 or count >= population_blocks or not sum(wholes):
+        return ratio, ratio, ratio
+    residual = sum((part - ratio * whole) ** 2 for part, whole in zip(parts, wholes)) / (count - 1)
+    mean_whole = sum(wholes) / count
+    error = z * math.sqrt((1 - count / population_blocks) * residual / (count * mean_whole ** 2))
+    return ratio, max(ratio - error, 0.0), min(ratio + error, 1.0)
+
+
+def analyze_file_sampled(filename, layouts, sampling, engine='python', encoding='utf-8'):
+    """
+    Приблизительный подсчёт по случайной выборке блоков файла. Файл делится на блоки
+    по sampling.block_size байт, из них выбирается доля sampling.fraction (не меньше MIN_BLOCKS)
+    генератором с зерном sampling.seed. С диска читаются только выбранные блоки (через mmap),
+    поэтому выборка 1% стоит примерно 1% чтения. Каждый блок считается отдельно; перед ним
+    набираются WARMUP_SIZE байтов предыдущего текста без учёта штрафов, чтобы пальцы стояли
+    там же, где при подсчёте всего файла, а не в домашних позициях.
+    Суммы по файлу экстраполируются по числу байтов, а доверительные интервалы (по распределению Стьюдента,
+    т.к. блоков в выборке бывает мало) записываются в sampling.estimates. Если выбраны все блоки,
+    файл считается целиком обычным подсчётом, и результат точный
+
+    Args:
+        filename: путь к файлу (UTF-8 или однобайтовая кодировка, без сжатия)
+        layouts: список данных раскладок
+        sampling: Sampling - параметры выборки (результаты записываются в него же)
+        engine: движок подсчёта
+        encoding: кодировка файла
+
+    Returns:
+        Список кортежей (оценка суммы штрафов, оценка штрафа по каждому пальцу, оценка количества символов)
+        в порядке раскладок
+    """
+    from main import calculate_hand_penalties, analyze_file_uncached
+    from compressed import detect_compression
+
+    if detect_compression(filename):
+        raise ValueError(f"Выборка невозможна для сжатого файла: {filename}")
+    utf8 = codecs.lookup(encoding).name == 'utf-8'
+    if not utf8:
+        from engine import single_byte_points
+        if single_byte_points(encoding) is None:
+            raise ValueError(f"Выборка поддерживается только для UTF-8 и однобайтовых кодировок: {encoding}")
+
+    size = os.path.getsize(filename)
+    total_blocks = max(-(-size // sampling.block_size), 1)
+    count = min(max(math.ceil(total_blocks * sampling.fraction), MIN_BLOCKS), total_blocks)
+    chosen = sorted(random.Random(sampling.seed).sample(range(total_blocks), count))
+    z = t_quantile(sampling.confidence, max(count - 1, 1))
+
+    sizes = []
+    samples = [[] for _ in layouts]
+    population_blocks = total_blocks
+    if size and count >= total_blocks:
+        # Выбраны все блоки: файл считается целиком, точно и с интервалами нулевой ширины
+        sizes.append(size)
+        samples = [[result] for result in analyze_file_uncached(filename, layouts, engine=engine, encoding=encoding)]
+        population_blocks = 1
+    elif size:
+        with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for block in chosen:
+                start = _boundary(mapped, block * sampling.block_size, size, utf8)
+                end = _boundary(mapped, (block + 1) * sampling.block_size, size, utf8)
+                warmup = _boundary(mapped, start - WARMUP_SIZE, size, utf8)
+                texts = [mapped[begin:stop].decode(encoding).replace('\r\n', '\n').replace('\r', '\n')
+                         for begin, stop in ((warmup, start), (start, end))]
+                sizes.append(end - start)
+                if engine == 'numpy':
+                    from engine import text_points
+                    texts = [text_points(text) for text in texts]
+                for layout_samples, layout_config in zip(samples, layouts):
+                    analyzer = Analyzer(layout_config, engine)
+                    feed = analyzer.feed if engine == 'python' else analyzer.feed_points
+                    feed(texts[0])
+                    before_penalty, before_fingers, before_chars = analyzer.result()
+                    feed(texts[1])
+                    total_penalty, finger_penalties, total_chars = analyzer.result()
+                    layout_samples.append((total_penalty - before_penalty,
+                                           {f: value - before_fingers[f] for f, value in finger_penalties.items()},
+                                           total_chars - before_chars))
+
+    sampling.blocks, sampling.total_blocks, sampling.bytes_read = count if size else 0, total_blocks, sum(sizes)
+    results = []
+    for layout_samples, layout_config in zip(samples, layouts):
+        if not sizes or not sum(sizes):
+            results.append((0, {}, 0))
+            continue
+
+        def estimate(values):
+            return _ratio_estimate(values, sizes, size, population_blocks, z)
+
+        fingers = list(layout_samples[0][1])
+        hands = [calculate_hand_penalties(finger_penalties) for _, finger_penalties, _ in layout_samples]
+        totals = [total_penalty for total_penalty, _, _ in layout_samples]
+        lefts, rights = [left for left, _ in hands], [right for _, right in hands]
+        layout_estimates = {
+            'total': estimate(totals),
+            'fingers': {f: estimate([finger_penalties[f] for _, finger_penalties, _ in layout_samples])
+                        for f in fingers},
+            'hands': {'left': estimate(lefts), 'right': estimate(rights)},
+            'left_share': _share_estimate(lefts, [left + right for left, right in hands], population_blocks, z),
+            'chars': estimate([total_chars for _, _, total_chars in layout_samples]),
+        }
+        sampling.estimates[layout_config['name']] = layout_estimates
+        results.append((round(layout_estimates['total'][0]),
+                        {f: round(value[0]) for f, value in layout_estimates['fingers'].items()},
+                        round(layout_estimates['chars'][0])))
+    return results
@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BATCH = 64
+MAX_BODY = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+_worker_layouts = None
+_worker_engine = None
+
+
+def _compile_layouts(layouts, engine):
+    """
+    Компилирует раскладки (для движка numpy - вместе с таблицами), чтобы запросы их не строили
+
+    Args:
+        layouts: словарь {идентификатор: данные раскладки} (см. layout_registry.resolve_layout_names)
+        engine: движок подсчёта
+
+    Returns:
+        Словарь {идентификатор: CompiledLayout}
+    """
+    from compiled_layout import compile_layout
+
+    compiled = {}
+    for name, layout_config in layouts.items():
+        compiled[name] = compile_layout(layout_config)
+        if engine == 'numpy':
+            from engine import layout_tables
+            layout_tables(compiled[name])
+    return compiled
+
+
+def _init_worker(layouts, engine):
+    """
+    Компилирует раскладки один раз при запуске процесса пула (см. _compile_layouts)
+
+    Args:
+        layouts: словарь {идентификатор: данные раскладки}
+        engine: движок подсчёта
+    """
+    global _worker_layouts, _worker_engine
+    _worker_layouts = _compile_layouts(layouts, engine)
+    _worker_engine = engine
+
+
+def score_batch(requests, layouts=None, engine=None):
+    """
+    Считает пачку запросов за один вызов
+
+    Args:
+        requests: список словарей запросов ('text' или 'path', 'layouts', 'mode')
+        layouts: словарь {идентификатор: CompiledLayout} (None - раскладки процесса пула, см. _init_worker)
+        engine: движок подсчёта (None - движок процесса пула)
+
+    Returns:
+        Список пар (HTTP-статус, ответ) в порядке запросов
+    """
+    if layouts is None:
+        layouts, engine = _worker_layouts, _worker_engine
+    results = []
+    for request in requests:
+        try:
+            results.append(_score_request(request, layouts, engine))
+        except Exception as e:
+            results.append((500, {'error': f"{type(e).__name__}: {e}"}))
+    return results
+
+
+def _score_request(request, layouts, engine):
+    """
+    Считает один запрос; ошибка в данных запроса возвращается в ответе со статусом 400 или 404
+    """
+    from analyzer import Analyzer
+    from frequency import analyze_frequency_file_multi, count_frequency_lines, score_frequencies
+    from main import MODES, results_to_dict
+
+    try:
+        names = request.get('layouts') or list(layouts)
+        unknown = [name for name in names if name not in layouts]
+        if unknown:
+            return 400, {'error': f"Неизвестные раскладки: {', '.join(unknown)}"}
+        mode = request.get('mode', 'text')
+        if mode not in MODES:
+            return 400, {'error': f"Неизвестный режим: {mode}"}
+        compiled = [layouts[name] for name in names]
+        text, path = request.get('text'), request.get('path')
+        if (text is None) == (path is None):
+            return 400, {'error': "Нужно передать ровно одно из полей 'text' и 'path'"}
+        if not isinstance(text if path is None else path, str):
+            return 400, {'error': f"Поле '{'text' if path is None else 'path'}' должно быть строкой"}
+
+        if mode == 'freq':
+            if path is not None:
+                results = analyze_frequency_file_multi(path, compiled, engine,
+                                                       request.get('encoding', 'utf-8'))
+            else:
+                counts = count_frequency_lines(text.splitlines())
+                results = [score_frequencies(counts, layout, engine) for layout in compiled]
+        else:
+            analyzers = [Analyzer(layout, engine, request.get('encoding', 'utf-8')) for layout in compiled]
+            if path is not None:
+                with open(path, 'rb') as file:
+                    for chunk in iter(lambda: file.read(READ_SIZE), b''):
+                        for analyzer in analyzers:
+                            analyzer.feed(chunk)
+            else:
+                for analyzer in analyzers:
+                    analyzer.feed(text)
+            for analyzer in analyzers:
+                analyzer.close()
+            results = [analyzer.result() for analyzer in analyzers]
+
+        return 200, {'layouts': results_to_dict([layout.config for layout in compiled], results)}
+
+    except FileNotFoundError:
+        return 404, {'error': f"Файл {request.get('path')} не найден"}
+    except OSError as e:
+        return 400, {'error': f"Файл {request.get('path')} не читается: {type(e).__name__}"}
+    except (ValueError, TypeError, UnicodeDecodeError, LookupError) as e:
+        return 400, {'error': f"{type(e).__name__}: {e}"}
+
+
+class ScoringService:
+    """
+    Сервис подсчёта: раскладки (встроенные и из папки layout_dir) загружаются один раз, одновременные запросы
+    собираются в пачки. Пока все процессы пула заняты, новые запросы копятся в очереди,
+    и освободившийся процесс получает их одной пачкой (до max_batch) - при малой нагрузке
+    запрос уходит сразу, без ожидания, при большой растёт размер пачки, а не очередь вызовов.
+    С workers=0 подсчёт идёт в одном потоке текущего процесса
+    """
+
+    def __init__(self, layout_names=None, engine='numpy', workers=None, max_batch=MAX_BATCH, layout_dir=None):
+        from analyzer import ENGINES
+        from layout_registry import resolve_layout_names
+
+        if engine not in ENGINES:
+            raise ValueError(f"Неизвестный движок: {engine}")
+        self.layout_names, layouts = resolve_layout_names(layout_names, layout_dir)
+        self._layouts = dict(zip(self.layout_names, layouts))
+        self.engine = engine
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_batch = max_batch
+        self.batches = 0
+        self.requests = 0
+        self._pool = None
+        self._compiled = None
+        self._queue = None
+        self._slots = None
+        self._dispatcher = None
+
+    async def start(self):
+        """
+        Запускает пул и задачу, собирающую пачки
+        """
+        if self.workers == 0:
+            from concurrent.futures import ThreadPoolExecutor
+            # Без пула раскладки хранятся в сервисе, а не в глобальных переменных модуля,
+            # поэтому несколько сервисов в одном процессе не мешают друг другу
+            self._compiled = _compile_layouts(self._layouts, self.engine)
+            self._pool = ThreadPoolExecutor(max_workers=1)
+            slots = 1
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self._layouts, self.engine))
+            slots = self.workers
+            # Процессы пула стартуют и компилируют раскладки до первого запроса
+            await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(self._pool, score_batch, [])
+                                   for _ in range(slots)))
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(slots)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def score(self, request):
+        """
+        Ставит запрос в очередь и ждёт результат
+
+        Args:
+            request: словарь запроса ('text' или 'path', 'layouts', 'mode', 'encoding')
+
+        Returns:
+            Пара (HTTP-статус, ответ)
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self.batches += 1
+            self.requests += len(batch)
+            task = loop.run_in_executor(self._pool, score_batch, [request for request, _ in batch], self._compiled,
+                                        self.engine)
+            task.add_done_callback(lambda task, batch=batch: self._finish(task, batch))
+
+    def _finish(self, task, batch):
+        self._slots.release()
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_result((500, {'error': f"{type(task.exception()).__name__}: {task.exception()}"}))
+            else:
+                future.set_result(task.result()[i])
+
+    async def close(self):
+        """
+        Останавливает сбор пачек и пул
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+async def _read_request(reader):
+    """
+    Читает один HTTP-запрос
+
+    Returns:
+        Метод, путь с параметрами, заголовки (имена в нижнем регистре) и тело, или None, если соединение закрыто
+    """
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise ValueError('Слишком большой запрос')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+def _parse_score_request(target, headers, body):
+    """
+    Собирает словарь запроса из тела и параметров: JSON ({"text": ..., "path": ..., "layouts": [...],
+    "mode": ...}) или текст документа в теле, а раскладки и режим - в параметрах (?layout=vizov&mode=text)
+    """
+    query = parse_qs(urlsplit(target).query)
+    if 'json' in headers.get('content-type', ''):
+        request = json.loads(body.decode('utf-8'))
+        if not isinstance(request, dict):
+            raise ValueError('Ожидается объект JSON')
+    else:
+        request = {'text': body.decode(headers.get('x-encoding', 'utf-8'))}
+    if 'layout' in query:
+        request['layouts'] = query['layout']
+    if 'mode' in query:
+        request['mode'] = query['mode'][0]
+    return request
+
+
+async def _handle_connection(service, reader, writer):
+    """
+    Обслуживает соединение: POST /score - подсчёт, GET /layouts - список раскладок,
+    GET /health - состояние. Соединение остаётся открытым между запросами (keep-alive)
+    """
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except ValueError as e:
+                await _respond(writer, 400, {'error': str(e)}, close=True)
+                break
+            if request is None:
+                break
+            method, target, headers, body = request
+            path = urlsplit(target).path
+
+            if method == 'POST' and path == '/score':
+                try:
+                    status, response = await service.score(_parse_score_request(target, headers, body))
+                except (ValueError, UnicodeDecodeError) as e:
+                    status, response = 400, {'error': f"{type(e).__name__}: {e}"}
+            elif method == 'GET' and path == '/layouts':
+                status, response = 200, {'layouts': service.layout_names}
+            elif method == 'GET' and path == '/health':
+                status, response = 200, {'engine': service.engine, 'workers': service.workers,
+                                         'requests': service.requests, 'batches': service.batches}
+            else:
+                status, response = 404, {'error': f"Неизвестный запрос: {method} {path}"}
+
+            close = headers.get('connection', '').lower() == 'close'
+            await _respond(writer, status, response, close)
+            if close:
+                break
+    finally:
+        writer.close()
+
+
+async def _respond(writer, status, response, close=False):
+    """
+    Отправляет ответ HTTP/1.1 с телом JSON
+
+    Args:
+        writer: asyncio.StreamWriter соединения
+        status: код ответа
+        response: словарь для тела ответа
+        close: True - закрыть соединение после ответа (Connection: close)
+
+    Returns:
+        None
+    """
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+    body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+    writer.write(f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+                 f"Content-Type: application/json; charset=utf-8\r\n"
+                 f"Content-Length: {len(body)}\r\n"
+                 f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, ready=None):
+    """
+    Запускает сервис и HTTP-сервер на localhost или на Unix-сокете и работает до отмены
+
+    Args:
+        service: ScoringService (ещё не запущенный)
+        host: адрес
+        port: порт (0 - любой свободный)
+        unix_socket: путь к Unix-сокету (вместо host и port)
+        ready: функция ready(адрес), вызывается, когда сервер принимает соединения
+
+    Returns:
+        None
+    """
+    await service.start()
+
+    def handler(reader, writer):
+        return _handle_connection(service, reader, writer)
+
+    if unix_socket:
+        server = await asyncio.start_unix_server(handler, path=unix_socket)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    try:
+        if ready:
+            ready(unix_socket or server.sockets[0].getsockname()[:2])
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+def main(argv=None):
+    """
+    Запуск сервиса из командной строки; работает до Ctrl+C
+
+    Args:
+        argv: аргументы командной строки (None - sys.argv)
+
+    Returns:
+        Код завершения 0
+    """
+    from analyzer import ENGINES
+    from layout_registry import add_layout_arguments
+
+    parser = argparse.ArgumentParser(description='Локальный сервис подсчёта нагрузки пальцев')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='адрес')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='порт')
+    parser.add_argument('--unix', default=None, metavar='PATH', help='слушать Unix-сокет вместо порта')
+    add_layout_arguments(parser)
+    parser.add_argument('--engine', choices=ENGINES, default='numpy', help='движок подсчёта')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='количество процессов (0 - считать в потоке сервера, по умолчанию - по ядрам)')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='наибольший размер пачки запросов')
+    args = parser.parse_args(argv)
+
+    try:
+        service = ScoringService(args.layouts, args.engine, args.workers, args.max_batch, args.layout_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    def ready(address):
+        print(f"Сервис слушает {address}", file=sys.stderr, flush=True)
+
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,52 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
-from main import calculate_fines
+from unittest import mock
+from analyzer import Analyzer
+from parallel import analyze_file_parallel
+from frequency import parse_frequency_line, score_frequencies
+from result_cache import ResultCache
+from server import ScoringService, serve
+from batch import collect_files, run_batch, write_table
+from bench import generate_corpus, check_regressions
+from checkpoint import analyze_file_incremental, load_checkpoints
+from compressed import decompressed_chunks, detect_compression
+from corpus_index import CorpusIndex, build_index, rank_layouts, score_index
+from instrumentation import FileProfile
+from keystats import KeyStats
+from live import iter_stream_results
+from layout_registry import LayoutRegistry, layout_json, load_layout_file, resolve_layouts
+from layout_registry import main as layout_registry_main
+from metrics import METRICS, KEYSTROKE, register_metric
+from report import ReportRenderer
+from sampling import Sampling, analyze_file_sampled
+from windows import WindowWriter, iter_windows, load_windows
+from windows import main as windows_main
+from optimizer import FIXED_KEYS, SwapModel, layout_source, optimize_layout, text_bigram_counts
+from main import calculate_fines, analyze_text, analyze_file, analyze_file_multi, main
+from engine import analyze_text_numpy, mapped_points
+from compiled_layout import compile_layout, SPACE, NEWLINE
+from layout import qwerty_layout, dictor_layout, vizov_layout
+
+SAMPLE_TEXT = ('Война и мир. Ещё раз: «Ну, что, князь?» — сказала Анна Павловна!\n'
+               'Юла, эхо, подъезд, № 5; (тест) _+ 100% ЁЖ\n'
+               'Latin text, tab\tи emoji 😀 ЪЭЮ ю э ъ\n\n')
+
+SAMPLE_RESULTS = {
+    'Йцукен': (238, {'f5l': 27, 'f4l': 1, 'f3l': 11, 'f2l': 32, 'f1l': 42,
+                     'f1r': 0, 'f2r': 39, 'f3r': 2, 'f4r': 12, 'f5r': 72}, 143),
+    'Диктор': (219, {'f5l': 27, 'f4l': 14, 'f3l': 10, 'f2l': 48, 'f1l': 31,
+                     'f1r': 0, 'f2r': 34, 'f3r': 7, 'f4r': 8, 'f5r': 40}, 143),
+    'Вызов': (229, {'f5l': 20, 'f4l': 3, 'f3l': 20, 'f2l': 41, 'f1l': 35,
+                    'f1r': 9, 'f2r': 35, 'f3r': 15, 'f4r': 7, 'f5r': 44}, 148),
+}
+
 
 class TestFingerMovement(unittest.TestCase):
     def test_no_fine(self):
@@ -11,5 +58,766 @@ class TestFingerMovement(unittest.TestCase):
     def test_fine_two(self):
         self.assertEqual(calculate_fines((2, 4), (3, 5)), 2)
 
+
+class TestAnalyzeText(unittest.TestCase):
+    def test_sample_results(self):
+        for layout_config in (qwerty_layout(), dictor_layout(), vizov_layout()):
+            self.assertEqual(analyze_text(SAMPLE_TEXT, layout_config), SAMPLE_RESULTS[layout_config['name']])
+
+
+class TestCompiledLayout(unittest.TestCase):
+    def test_cached(self):
+        self.assertIs(compile_layout(qwerty_layout()), compile_layout(qwerty_layout()))
+        self.assertIsNot(compile_layout(qwerty_layout()), compile_layout(dictor_layout()))
+
+    def test_cost_matrix(self):
+        compiled = compile_layout(vizov_layout())
+        for i, pos1 in enumerate(compiled.positions):
+            for j, pos2 in enumerate(compiled.positions):
+                self.assertEqual(compiled.cost[i * compiled.n_keys + j], calculate_fines(pos1, pos2))
+
+    def test_char_tables(self):
+        config = vizov_layout()
+        compiled = compile_layout(config)
+        code = compiled.char_code['Ж']
+        self.assertTrue(compiled.shifted[code])
+        self.assertEqual(compiled.fingers[compiled.finger[code]], config['finger_assignment']['ж'])
+        self.assertEqual(compiled.positions[compiled.key[code]], config['layout']['ж'])
+        self.assertTrue(compiled.alt[compiled.char_code['ю']])
+        self.assertNotIn('\t', compiled.char_code)
+
+
+class TestNumpyEngine(unittest.TestCase):
+    def test_matches_analyze_text(self):
+        for layout_config in (qwerty_layout(), dictor_layout(), vizov_layout()):
+            for text in ('', ' ', 'Ю', SAMPLE_TEXT, SAMPLE_TEXT * 50):
+                self.assertEqual(analyze_text_numpy(text, layout_config), analyze_text(text, layout_config))
+
+    def test_mapped_points(self):
+        fd, filename = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\r\n') as file:
+            file.write(SAMPLE_TEXT + '\r')
+        try:
+            for chunk_size in (1, 2, 3, 7, 1024):
+                text = ''.join(chr(point) for points in mapped_points(filename, chunk_size) for point in points)
+                self.assertEqual(text, SAMPLE_TEXT + '\n')
+        finally:
+            os.remove(filename)
+
+
+class TestAnalyzer(unittest.TestCase):
+    def test_chunk_size_independent(self):
+        text = SAMPLE_TEXT * 10
+        for layout_config in (qwerty_layout(), vizov_layout()):
+            expected = analyze_text(text, layout_config)
+            for engine in ('python', 'numpy'):
+                for size in (1, 7, 100, len(text)):
+                    analyzer = Analyzer(layout_config, engine)
+                    analyzer.feed_iter(text[i:i + size] for i in range(0, len(text), size))
+                    self.assertEqual(analyzer.result(), expected)
+
+    def test_binary_stream(self):
+        text = SAMPLE_TEXT * 10
+        layout_config = dictor_layout()
+        stream = io.BytesIO(text.replace('\n', '\r\n').encode('utf-8'))
+        analyzer = Analyzer(layout_config).feed_stream(stream, chunk_size=3)
+        self.assertEqual(analyzer.result(), analyze_text(text, layout_config))
+
+
+class TestAnalyzeFileMulti(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(SAMPLE_TEXT * 20)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_matches_analyze_file(self):
+        layouts = [qwerty_layout(), dictor_layout(), vizov_layout()]
+        for engine in ('python', 'numpy'):
+            results = analyze_file_multi(self.filename, layouts, engine=engine)
+            self.assertEqual(results, [analyze_file(self.filename, layout_config) for layout_config in layouts])
+
+    def test_profile(self):
+        layouts = [qwerty_layout(), vizov_layout()]
+        for engine in ('python', 'numpy'):
+            profile = FileProfile(self.filename)
+            results = analyze_file_multi(self.filename, layouts, chunk_size=100, engine=engine, profile=profile)
+            self.assertEqual(results, analyze_file_multi(self.filename, layouts, engine=engine))
+
+            report = profile.to_dict()
+            self.assertEqual(report['chars'], len(SAMPLE_TEXT) * 20)
+            self.assertGreater(report['phases']['read']['calls'], 1)
+            branches = report['layouts']['Вызов']['branches']
+            self.assertEqual(sum(branches.values()), report['chars'])
+            self.assertEqual(branches['newline'], SAMPLE_TEXT.count('\n') * 20)
+            self.assertGreater(branches['alt'], 0)
+
+        profile = FileProfile(self.filename)
+        analyze_file_multi(self.filename, layouts, mode='freq', profile=profile)
+        report = profile.to_dict()
+        self.assertIsNone(report['chars'])
+        self.assertTrue(all(data['branches'] is None for data in report['layouts'].values()))
+
+        import gzip
+        data = (SAMPLE_TEXT * 20).encode('utf-8')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'sample.txt.gz')
+            with gzip.open(filename, 'wb') as file:
+                file.write(data)
+            profile = FileProfile(filename)
+            analyze_file_multi(filename, layouts, chunk_size=1000, profile=profile)
+            self.assertEqual(profile.to_dict()['bytes'], len(data))
+
+    def test_single_byte_encodings(self):
+        layouts = [qwerty_layout(), dictor_layout(), vizov_layout()]
+        for encoding in ('cp1251', 'koi8-r'):
+            text = SAMPLE_TEXT.encode(encoding, errors='ignore').decode(encoding)
+            expected = [analyze_text(text, layout_config) for layout_config in layouts]
+            with open(self.filename, 'w', encoding=encoding, newline='\r\n') as file:
+                file.write(text)
+            for engine in ('python', 'numpy'):
+                results = analyze_file_multi(self.filename, layouts, chunk_size=5, engine=engine, encoding=encoding)
+                self.assertEqual(results, expected)
+
+
+class TestParallel(unittest.TestCase):
+    def test_matches_sequential(self):
+        fd, filename = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\r\n') as file:
+            file.write(SAMPLE_TEXT * 20)
+        try:
+            layouts = [qwerty_layout(), dictor_layout(), vizov_layout()]
+            results = analyze_file_parallel(filename, layouts, workers=3, min_part_size=1)
+            self.assertEqual(results, [analyze_text(SAMPLE_TEXT * 20, layout_config) for layout_config in layouts])
+        finally:
+            os.remove(filename)
+
+
+class TestFrequencyList(unittest.TestCase):
+    def test_parse_line(self):
+        self.assertEqual(parse_frequency_line('то\n'), ('то', 1))
+        self.assertEqual(parse_frequency_line('Война\t1234\n'), ('Война', 1234))
+        self.assertIsNone(parse_frequency_line('Digramms for qwerty\n'))
+        self.assertIsNone(parse_frequency_line('\n'))
+
+    def test_weighted_scores(self):
+        counts = {'то': 3, 'Ъю,': 2, 'эх': 5}
+        for layout_config in (qwerty_layout(), vizov_layout()):
+            total_penalty, finger_penalties, total_chars = 0, {}, 0
+            for ngram, count in counts.items():
+                penalty, stats, chars = analyze_text(ngram, layout_config)
+                total_penalty += penalty * count
+                total_chars += chars * count
+                for finger, value in stats.items():
+                    finger_penalties[finger] = finger_penalties.get(finger, 0) + value * count
+            expected = (total_penalty, finger_penalties, total_chars)
+            for engine in ('python', 'numpy'):
+                self.assertEqual(score_frequencies(counts, layout_config, engine), expected)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'text.txt')
+        with open(self.filename, 'w', encoding='utf-8') as file:
+            file.write(SAMPLE_TEXT)
+        self.cache = ResultCache(os.path.join(self.directory.name, 'cache.sqlite'), max_entries=2)
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_only_missing_layouts_computed(self):
+        layouts = [qwerty_layout(), dictor_layout()]
+        expected = [SAMPLE_RESULTS[layout_config['name']] for layout_config in layouts]
+        self.assertEqual(analyze_file_multi(self.filename, layouts, cache=self.cache), expected)
+
+        digest = self.cache.file_digest(self.filename)
+        fake = (1, {'f1l': 1}, 1)
+        self.cache.put(digest, qwerty_layout(), fake)
+        results = analyze_file_multi(self.filename, layouts + [vizov_layout()], cache=self.cache)
+        self.assertEqual(results, [fake, expected[1], SAMPLE_RESULTS['Вызов']])
+
+    def test_lru_eviction(self):
+        digest = self.cache.file_digest(self.filename)
+        for layout_config in (qwerty_layout(), dictor_layout(), vizov_layout()):
+            self.cache.put(digest, layout_config, SAMPLE_RESULTS[layout_config['name']])
+        self.assertIsNone(self.cache.get(digest, qwerty_layout()))
+        self.assertEqual(self.cache.get(digest, vizov_layout()), SAMPLE_RESULTS['Вызов'])
+
+    def test_file_digests_pruned(self):
+        digest = self.cache.file_digest(self.filename)
+        self.cache.put(digest, qwerty_layout(), SAMPLE_RESULTS['Йцукен'])
+        for i in range(3):
+            other = os.path.join(self.directory.name, f'other{i}.txt')
+            with open(other, 'w', encoding='utf-8') as file:
+                file.write(SAMPLE_TEXT + str(i))
+            self.cache.put(self.cache.file_digest(other), qwerty_layout(), SAMPLE_RESULTS['Йцукен'])
+
+        paths = [row[0] for row in self.cache.connection.execute('SELECT path FROM file_digests')]
+        self.assertEqual(len(paths), 2)
+        self.assertNotIn(os.path.abspath(self.filename), paths)
+
+
+class TestCompressed(unittest.TestCase):
+    def test_compressed_files(self):
+        import bz2
+        import gzip
+        import lzma
+
+        data = (SAMPLE_TEXT * 30).replace('\n', '\r\n').encode('utf-8')
+        layouts = [qwerty_layout(), vizov_layout()]
+        expected = [analyze_text(SAMPLE_TEXT * 30, layout_config) for layout_config in layouts]
+        with tempfile.TemporaryDirectory() as directory:
+            for name, module in (('gzip', gzip), ('bz2', bz2), ('xz', lzma)):
+                filename = os.path.join(directory, 'sample.' + name)
+                with module.open(filename, 'wb') as file:
+                    file.write(data)
+                self.assertEqual(detect_compression(filename), name)
+                self.assertEqual(b''.join(decompressed_chunks(filename, chunk_size=100)), data)
+                for engine in ('python', 'numpy'):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        results = analyze_file_multi(filename, layouts, chunk_size=101, engine=engine)
+                    self.assertEqual(results, expected)
+
+            plain = os.path.join(directory, 'plain.txt')
+            with open(plain, 'wb') as file:
+                file.write(b'BZhello')
+            self.assertIsNone(detect_compression(plain))
+
+            broken = os.path.join(directory, 'broken.gz')
+            with open(broken, 'wb') as file:
+                file.write(gzip.compress(data)[:-40])
+            with self.assertRaises(EOFError):
+                list(decompressed_chunks(broken))
+
+
+class TestCheckpoints(unittest.TestCase):
+    def test_resume_after_append(self):
+        layouts = [qwerty_layout(), dictor_layout(), vizov_layout()]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.txt')
+            path = os.path.join(directory, 'log.json')
+            text = (SAMPLE_TEXT * 10).replace('\n', '\r\n')
+            for engine in ('python', 'numpy'):
+                if os.path.exists(path):
+                    os.remove(path)
+                for end in (text.index('\r') + 1, len(text) // 2, len(text)):
+                    with open(filename, 'wb') as file:
+                        file.write(text[:end].encode('utf-8'))
+                    results = analyze_file_incremental(filename, layouts, engine, path=path, interval=100,
+                                                       chunk_size=37)
+                    if end < len(text):
+                        continue
+                    self.assertEqual(results, analyze_file_multi(filename, layouts, engine=engine))
+
+                # Изменённое начало файла той же длины: проверка по умолчанию отбрасывает все точки
+                with open(filename, 'r+b') as file:
+                    file.write('Г'.encode('utf-8'))
+                results = analyze_file_incremental(filename, layouts, engine, path=path)
+                self.assertEqual(results, analyze_file_multi(filename, layouts, engine=engine))
+                entry = next(iter(load_checkpoints(path).values()))
+                self.assertEqual(len(entry['chain']), 1)
+
+
+class TestSampling(unittest.TestCase):
+    def test_single_block_is_exact(self):
+        fd, filename = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\r\n') as file:
+            file.write(SAMPLE_TEXT * 20)
+        try:
+            layouts = [qwerty_layout(), vizov_layout()]
+            for engine in ('python', 'numpy'):
+                sampling = Sampling(0.5, block_size=1 << 20)
+                results = analyze_file_sampled(filename, layouts, sampling, engine)
+                self.assertEqual(results, [analyze_text(SAMPLE_TEXT * 20, layout_config) for layout_config in layouts])
+                total, low, high = sampling.estimates['Йцукен']['total']
+                self.assertEqual((low, high), (total, total))
+        finally:
+            os.remove(filename)
+
+    def test_interval_covers_total(self):
+        text = ''.join(SAMPLE_TEXT[i:] + SAMPLE_TEXT[:i] for i in range(0, 400, 7)) * 10
+        fd, filename = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+        try:
+            total_penalty, finger_penalties, _ = analyze_text(text, qwerty_layout())
+            sampling = Sampling(0.2, seed=1, block_size=1000, confidence=0.99)
+            analyze_file_sampled(filename, [qwerty_layout()], sampling, 'numpy')
+            estimates = sampling.estimates['Йцукен']
+            self.assertLess(sampling.bytes_read, os.path.getsize(filename) / 3)
+            self.assertLessEqual(estimates['total'][1], total_penalty)
+            self.assertGreaterEqual(estimates['total'][2], total_penalty)
+            self.assertEqual(set(estimates['fingers']), set(finger_penalties))
+            self.assertLess(estimates['left_share'][1], estimates['left_share'][2])
+            with self.assertRaises(ValueError):
+                Sampling(0)
+
+            sampling = Sampling(1, block_size=1000)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = analyze_file_sampled(filename, [qwerty_layout()], sampling)
+            self.assertEqual(results, [analyze_text(text, qwerty_layout())])
+            self.assertEqual(sampling.estimates['Йцукен']['total'], (total_penalty,) * 3)
+            self.assertEqual(sampling.blocks, sampling.total_blocks)
+        finally:
+            os.remove(filename)
+
+
+class TestLiveStream(unittest.TestCase):
+    def test_stream_snapshots(self):
+        data = (SAMPLE_TEXT * 3).replace('\n', '\r\n').encode('utf-8')
+        layouts = [qwerty_layout(), vizov_layout()]
+        expected = [analyze_text(SAMPLE_TEXT * 3, layout_config) for layout_config in layouts]
+        for engine in ('python', 'numpy'):
+            snapshots = list(iter_stream_results(io.BytesIO(data), layouts, engine, flush_seconds=None,
+                                                 flush_bytes=200, read_size=7))
+            self.assertEqual([snapshot['final'] for snapshot in snapshots],
+                             [False] * (len(snapshots) - 1) + [True])
+            self.assertGreater(len(snapshots), 2)
+            self.assertEqual(snapshots[-1]['bytes'], len(data))
+            self.assertEqual(snapshots[-1]['results'], expected)
+            totals = [snapshot['results'][0][0] for snapshot in snapshots]
+            self.assertEqual(totals, sorted(totals))
+
+        snapshots = list(iter_stream_results(io.StringIO(SAMPLE_TEXT), layouts, flush_seconds=None))
+        self.assertEqual(snapshots[-1]['results'], [analyze_text(SAMPLE_TEXT, layout_config)
+                                                    for layout_config in layouts])
+
+    def test_stdin_cli(self):
+        stdin = io.TextIOWrapper(io.BytesIO(SAMPLE_TEXT.replace('\n', '\r\n').encode('utf-8')))
+        stdout = io.StringIO()
+        with mock.patch('sys.stdin', stdin), contextlib.redirect_stdout(stdout):
+            self.assertEqual(main(['-', '-l', 'vizov', '-o', 'json', '--no-plot', '--no-cache']), 0)
+        line = json.loads(stdout.getvalue().splitlines()[-1])
+        result = line['layouts']['Вызов']
+        self.assertTrue(line['final'])
+        self.assertEqual((result['total'], result['fingers'], result['chars']), SAMPLE_RESULTS['Вызов'])
+        for flags in (['-o', 'tsv'], ['--mode', 'freq'], ['--sample', '0.1'], ['--metrics']):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                main(['-', '--no-plot'] + flags)
+
+
+class TestWindows(unittest.TestCase):
+    def test_windows_sum_to_total(self):
+        layouts = [qwerty_layout(), vizov_layout()]
+        text = SAMPLE_TEXT * 5
+        for chunks, engine in (([text[:100], text[100:]], 'python'), ([text.encode('utf-8')], 'numpy')):
+            windows = list(iter_windows(chunks, layouts, 64, engine))
+            self.assertEqual([end - start for start, end, _ in windows[:-1]], [64] * (len(windows) - 1))
+            for i, layout_config in enumerate(layouts):
+                expected = analyze_text(text, layout_config)
+                self.assertEqual(sum(results[i][0] for _, _, results in windows), expected[0])
+                self.assertEqual(sum(results[i][2] for _, _, results in windows), expected[2])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sample.windows')
+            with WindowWriter(path, ['Йцукен', 'Вызов'], 64) as writer:
+                for window in windows:
+                    writer.write(*window)
+            meta, table = load_windows(path)
+            self.assertEqual(table.shape, (len(windows), len(meta['columns'])))
+            column = meta['columns'].index('Вызов.total')
+            self.assertEqual(int(table[:, column].sum()), analyze_text(text, vizov_layout())[0])
+            del table
+
+    def test_trailing_carriage_return(self):
+        data = 'ава\r'.encode('utf-8')
+        for engine, encoding, chunk in (('python', 'utf-8', data), ('numpy', 'utf-8', data),
+                                        ('numpy', 'cp1251', 'ава\r'.encode('cp1251'))):
+            windows = list(iter_windows([chunk], [qwerty_layout()], len(chunk), engine, encoding))
+            expected = analyze_text('ава\n', qwerty_layout())
+            self.assertEqual(sum(results[0][0] for _, _, results in windows), expected[0])
+            self.assertEqual(sum(results[0][2] for _, _, results in windows), expected[2])
+
+
+class TestKeyStats(unittest.TestCase):
+    def test_key_penalties_sum_to_total(self):
+        text = SAMPLE_TEXT * 5
+        for layout_config in (qwerty_layout(), dictor_layout(), vizov_layout()):
+            whole = Analyzer(layout_config, 'numpy', key_stats=True)
+            whole.feed(text)
+            parts = Analyzer(layout_config, 'numpy', key_stats=True)
+            for i in range(0, len(text), 37):
+                parts.feed(text[i:i + 37].encode('utf-8'))
+            parts.close()
+
+            self.assertEqual(whole.result(), analyze_text(text, layout_config))
+            stats = whole.key_stats
+            self.assertIsInstance(stats, KeyStats)
+            self.assertEqual(int(stats.penalties.sum()), whole.result()[0])
+            self.assertEqual(stats.penalties.tolist(), parts.key_stats.penalties.tolist())
+            self.assertEqual(stats.presses.tolist(), parts.key_stats.presses.tolist())
+            self.assertEqual(stats.transitions.tolist(), parts.key_stats.transitions.tolist())
+
+        with self.assertRaises(ValueError):
+            Analyzer(qwerty_layout(), 'python', key_stats=True)
+
+    def test_file_key_stats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'sample.txt')
+            with open(filename, 'w', encoding='utf-8') as file:
+                file.write(SAMPLE_TEXT * 3)
+            key_stats = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = analyze_file_multi(filename, [qwerty_layout(), vizov_layout()], engine='numpy',
+                                             key_stats=key_stats)
+            self.assertEqual(list(key_stats), ['Йцукен', 'Вызов'])
+            for (total_penalty, _, _), stats in zip(results, key_stats.values()):
+                self.assertEqual(int(stats.penalties.sum()), total_penalty)
+                self.assertEqual(stats.grid(stats.presses).shape[0], 5)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_metrics_match_direct_count(self):
+        text = SAMPLE_TEXT * 5
+        layout_config = qwerty_layout()
+        compiled = compile_layout(layout_config)
+        analyzer = Analyzer(layout_config, 'numpy', metrics=True)
+        for i in range(0, len(text), 41):
+            analyzer.feed(text[i:i + 41])
+        values = analyzer.metrics.result()
+        self.assertEqual(list(values), list(METRICS))
+
+        # пробел и enter стоят на своих клавишах, символы с Shift и Alt - на основной
+        pressed = [(finger, -kind if kind in (SPACE, NEWLINE) else key)
+                   for kind, finger, key, _ in (compiled.entries[char] for char in text if char in compiled.entries)]
+        same_finger = sum(1 for (finger_a, key_a), (finger_b, key_b) in zip(pressed, pressed[1:])
+                          if finger_a == finger_b and key_a != key_b)
+        self.assertEqual(values['same_finger']['count'], same_finger)
+        self.assertEqual(values['same_finger']['total'], len(pressed) - 1)
+
+    def test_registered_metric(self):
+        @register_metric('test_space', KEYSTROKE, 'нажатия пробела')
+        def test_space(keys):
+            return keys.digit == 1, keys.digit >= 0
+
+        try:
+            analyzer = Analyzer(vizov_layout(), 'numpy', metrics=['test_space'])
+            analyzer.feed('а б в\n')
+            self.assertEqual(analyzer.metrics.result()['test_space']['count'], 2)
+        finally:
+            del METRICS['test_space']
+
+
+class TestCorpusIndex(unittest.TestCase):
+    def test_index_scores(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'sample.txt')
+            with open(filename, 'w', encoding='utf-8') as file:
+                file.write(SAMPLE_TEXT * 20)
+            index = build_index(filename, order=4)
+            path = os.path.join(directory, 'sample.index.npz')
+            index.save(path)
+            index = CorpusIndex.load(path)
+
+            self.assertEqual(index.summary()['chars'], len(SAMPLE_TEXT) * 20)
+            self.assertEqual(int(index.bigram_counts.sum()), len(SAMPLE_TEXT) * 20)
+            for layout_config in (qwerty_layout(), dictor_layout(), vizov_layout()):
+                exact = analyze_text(SAMPLE_TEXT * 20, layout_config)
+                (total_penalty, finger_penalties, total_chars), bound = score_index(index, layout_config)
+                self.assertEqual(total_chars, exact[2])
+                self.assertLessEqual(abs(total_penalty - exact[0]), bound)
+            ranked = rank_layouts(index, [qwerty_layout(), vizov_layout()])
+            self.assertEqual(len(ranked), 2)
+            for name, result, bound, shift in ranked:
+                self.assertLessEqual(shift, bound)
+                self.assertLess(bound, result[0] * 0.4)
+
+    def test_exact_when_window_covers_text(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'short.txt')
+            with open(filename, 'w', encoding='utf-8') as file:
+                file.write('Ну, князь!')
+            index = build_index(filename, order=12)
+            for layout_config in (qwerty_layout(), vizov_layout()):
+                result, bound = score_index(index, layout_config)
+                self.assertEqual(bound, 0)
+                self.assertEqual(result, analyze_text('Ну, князь!', layout_config))
+
+
+class TestLayoutRegistry(unittest.TestCase):
+    def test_files_and_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, layout_function in (('qwerty', qwerty_layout), ('vizov', vizov_layout)):
+                with open(os.path.join(directory, name + '.json'), 'w', encoding='utf-8') as file:
+                    file.write(layout_json(layout_function()))
+            with open(os.path.join(directory, 'short.toml'), 'w', encoding='utf-8') as file:
+                file.write('name = "Короткая"\nfinger_assignment = { "а" = "f2l" }\n[layout]\n"а" = [2, 4]\n'
+                           '[home_positions]\n' + ''.join(f'{finger} = [2, {i}]\n' for i, finger in
+                                                          enumerate(('f5l', 'f4l', 'f3l', 'f2l', 'f1l', 'f1r',
+                                                                     'f2r', 'f3r', 'f4r', 'f5r'))))
+            with open(os.path.join(directory, 'broken.json'), 'w', encoding='utf-8') as file:
+                file.write('{"name": "Сломанная", "layout": {}}')
+
+            self.assertEqual(load_layout_file(os.path.join(directory, 'vizov.json')), vizov_layout())
+            registry = LayoutRegistry(directory).load()
+            self.assertEqual(registry.names(), ['qwerty', 'short', 'vizov'])
+            self.assertEqual((registry.parsed, list(registry.errors)), (3, [os.path.join(directory, 'broken.json')]))
+            self.assertEqual(analyze_text(SAMPLE_TEXT, registry.get('vizov')), SAMPLE_RESULTS['Вызов'])
+            self.assertEqual(analyze_text('ааа', registry.get('short'))[2], 3)
+
+            registry = LayoutRegistry(directory).load()
+            self.assertEqual(registry.parsed, 0)
+            self.assertEqual(registry.get('qwerty'), qwerty_layout())
+            with mock.patch('layout_registry._cache_version', ('старая версия',)):
+                self.assertEqual(LayoutRegistry(directory).load().parsed, 3)
+            self.assertEqual(LayoutRegistry(directory).load().parsed, 3)
+
+            renamed = dict(vizov_layout(), name='Вызов 2')
+            with open(os.path.join(directory, 'vizov.json'), 'w', encoding='utf-8') as file:
+                file.write(layout_json(renamed))
+            os.utime(os.path.join(directory, 'qwerty.json'), ns=(0, 0))
+            registry = LayoutRegistry(directory).load()
+            self.assertEqual(registry.parsed, 1)
+            self.assertEqual(registry.get('vizov')['name'], 'Вызов 2')
+            self.assertEqual(analyze_text(SAMPLE_TEXT, registry.get('vizov')), SAMPLE_RESULTS['Вызов'])
+
+    def test_export_and_layout_dir(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(layout_registry_main(['export', directory]), 0)
+            self.assertEqual([layout_config['name'] for layout_config in resolve_layouts(None, directory)],
+                             ['Йцукен', 'Диктор', 'Вызов'])
+            filename = os.path.join(directory, 'sample.txt')
+            with open(filename, 'w', encoding='utf-8') as file:
+                file.write(SAMPLE_TEXT)
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+                main([filename, '--layout-dir', directory, '-l', 'vizov', '-l', 'vizov', '-o', 'tsv',
+                      '--no-plot', '--no-cache'])
+            rows = [line.split('\t') for line in stdout.getvalue().splitlines()]
+            self.assertEqual([(row[1], int(row[2])) for row in rows], [('Вызов', SAMPLE_RESULTS['Вызов'][0])])
+
+    def test_layout_dir_in_sub_clis(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'mine.json'), 'w', encoding='utf-8') as file:
+                file.write(layout_json(dict(vizov_layout(), name='Моя')))
+            filename = os.path.join(directory, 'sample.txt')
+            with open(filename, 'w', encoding='utf-8') as file:
+                file.write(SAMPLE_TEXT)
+
+            async def run():
+                service = ScoringService(['mine', 'qwerty'], workers=0, layout_dir=directory)
+                await service.start()
+                response = await service.score({'text': SAMPLE_TEXT, 'layouts': ['mine']})
+                await service.close()
+                return response
+
+            status, response = asyncio.run(run())
+            self.assertEqual(status, 200)
+            self.assertEqual(response['layouts']['Моя']['total'], SAMPLE_RESULTS['Вызов'][0])
+            with self.assertRaises(ValueError):
+                ScoringService(['mine'], workers=0)
+
+            output = os.path.join(directory, 'sample.windows')
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(windows_main([filename, '--layout-dir', directory, '-l', 'mine', '-o', output]), 0)
+            self.assertEqual(load_windows(output)[0]['layouts'], ['Моя'])
+
+
+class TestOptimizer(unittest.TestCase):
+    def test_delta_matches_total(self):
+        for layout_config in (qwerty_layout(), vizov_layout()):
+            model = SwapModel(layout_config, text_bigram_counts(SAMPLE_TEXT * 5, layout_config))
+            for a, b in ((0, 5), (3, 17), (5, 17), (20, 1)):
+                model.swap(a, b, model.delta(a, b))
+                self.assertEqual(model.score, model.total())
+
+    def test_optimized_layout(self):
+        layout_config = vizov_layout()
+        bigrams = text_bigram_counts(SAMPLE_TEXT * 5, layout_config)
+        optimized, score = optimize_layout(layout_config, bigrams, iterations=3000, seed=1)
+        self.assertLessEqual(score, SwapModel(layout_config, bigrams).score)
+        self.assertEqual(SwapModel(optimized, bigrams).score, score)
+        self.assertEqual(set(optimized['layout']), set(layout_config['layout']))
+        for key in FIXED_KEYS:
+            self.assertEqual(optimized['layout'].get(key), layout_config['layout'].get(key))
+
+        namespace = {}
+        exec(layout_source(optimized), namespace)
+        self.assertEqual(namespace['optimized_layout'](), optimized)
+
+
+class TestBench(unittest.TestCase):
+    def test_corpus_deterministic(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = os.path.join(directory, 'a.txt'), os.path.join(directory, 'b.txt')
+            chars = generate_corpus(first, 100000, seed=3)
+            self.assertEqual(generate_corpus(second, 100000, seed=3), chars)
+            with open(first, encoding='utf-8') as a, open(second, encoding='utf-8') as b:
+                text = a.read()
+                self.assertEqual(text, b.read())
+            self.assertEqual(len(text), chars)
+            for char in ('ю', 'э', 'ъ', '№', '!', '\n'):
+                self.assertIn(char, text)
+            self.assertNotEqual(text.lower(), text)
+
+    def test_check_regressions(self):
+        baseline = {'numpy/1MB': {'chars_per_sec': 100.0}}
+        self.assertEqual(check_regressions({'numpy/1MB': {'chars_per_sec': 85.0}}, baseline, 0.2), [])
+        self.assertEqual(len(check_regressions({'numpy/1MB': {'chars_per_sec': 75.0}}, baseline, 0.2)), 1)
+
+
+class TestReport(unittest.TestCase):
+    def test_renders_many_layouts(self):
+        finger_penalties = analyze_text(SAMPLE_TEXT, qwerty_layout())[1]
+        file_results = [(f"Раскладка {i}", finger_penalties) for i in range(5)]
+
+        for workers in (0, 1):
+            with tempfile.TemporaryDirectory() as directory:
+                with ReportRenderer(directory, ('png', 'svg'), workers=workers) as renderer:
+                    renderer.submit(file_results, 'sample.txt')
+                    renderer.submit(file_results[:2], 'other.txt')
+                self.assertEqual(len(renderer.paths), 8)
+                self.assertEqual(sorted(os.listdir(directory)), [
+                    'other_fingers.png', 'other_fingers.svg', 'other_hands.png', 'other_hands.svg',
+                    'sample_fingers.png', 'sample_fingers.svg', 'sample_hands.png', 'sample_hands.svg'])
+                for path in renderer.paths:
+                    self.assertGreater(os.path.getsize(path), 0)
+
+    def test_same_name_in_different_folders(self):
+        finger_penalties = analyze_text(SAMPLE_TEXT, qwerty_layout())[1]
+        with tempfile.TemporaryDirectory() as directory:
+            with ReportRenderer(directory, ('png',), workers=0) as renderer:
+                for filename in ('a/text.txt', 'b/text.txt', 'a/text.txt'):
+                    renderer.submit([('Йцукен', finger_penalties)], filename)
+            files = sorted(os.listdir(directory))
+            self.assertEqual(len(files), 4)
+            self.assertIn('text_fingers.png', files)
+            self.assertEqual(len(renderer.paths), 6)
+
+
+class TestCli(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        code = 'import sys, main; print(sorted(m for m in ("matplotlib", "numpy") if m in sys.modules))'
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_output_formats(self):
+        fd, filename = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(SAMPLE_TEXT)
+        try:
+            for output_format in ('json', 'tsv'):
+                stdout = io.StringIO()
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+                    exit_code = main([filename, '-l', 'vizov', '-l', 'qwerty', '-o', output_format,
+                                      '--no-plot', '--no-cache'])
+                self.assertEqual(exit_code, 0)
+                if output_format == 'json':
+                    result = json.loads(stdout.getvalue())['layouts']['Вызов']
+                    self.assertEqual((result['total'], result['fingers'], result['chars']),
+                                     SAMPLE_RESULTS['Вызов'])
+                else:
+                    rows = [line.split('\t') for line in stdout.getvalue().splitlines()]
+                    self.assertEqual([row[1] for row in rows], ['Вызов', 'Йцукен'])
+                    self.assertEqual(int(rows[1][2]), SAMPLE_RESULTS['Йцукен'][0])
+        finally:
+            os.remove(filename)
+
+
+class TestBatch(unittest.TestCase):
+    def test_batch_survives_bad_files(self):
+        layouts = [qwerty_layout(), vizov_layout()]
+        with tempfile.TemporaryDirectory() as directory:
+            os.mkdir(os.path.join(directory, 'sub'))
+            small, large = os.path.join(directory, 'small.txt'), os.path.join(directory, 'sub', 'large.txt')
+            bad = os.path.join(directory, 'bad.txt')
+            with open(small, 'w', encoding='utf-8') as file:
+                file.write(SAMPLE_TEXT)
+            with open(large, 'w', encoding='utf-8') as file:
+                file.write(SAMPLE_TEXT * 30)
+            with open(bad, 'wb') as file:
+                file.write(b'\xff\xfe')
+
+            files = collect_files([directory, os.path.join(directory, 'missing.txt')])
+            self.assertEqual(sorted(files[:3]), sorted([small, large, bad]))
+            progress = []
+            rows = run_batch(files, layouts, workers=1, engine='python',
+                             progress=lambda done, total, file_rows: progress.append(file_rows[0]['file']))
+
+            self.assertEqual(len(rows), len(files) * len(layouts))
+            self.assertEqual(progress.index(large), progress.index(small) - 1)
+            statuses = {row['file']: row['status'] for row in rows}
+            self.assertEqual(statuses, {small: 'ok', large: 'ok', bad: 'error', files[3]: 'missing'})
+            for row in rows:
+                if row['file'] == small:
+                    expected = SAMPLE_RESULTS[row['layout']]
+                    self.assertEqual((row['total'], row['chars']), (expected[0], expected[2]))
+                    self.assertEqual(row['left'] + row['right'], row['total'])
+
+            table = os.path.join(directory, 'results.json')
+            write_table(rows, table)
+            with open(table, encoding='utf-8') as file:
+                columns = json.load(file)
+            self.assertEqual(columns['status'], [row['status'] for row in rows])
+
+
+class TestServer(unittest.TestCase):
+    def test_score_requests(self):
+        async def run():
+            address = asyncio.get_running_loop().create_future()
+            server = asyncio.create_task(serve(ScoringService(['qwerty', 'vizov'], workers=0), port=0,
+                                               ready=address.set_result))
+            host, port = await address
+            reader, writer = await asyncio.open_connection(host, port)
+            responses = []
+            for body, content_type in ((SAMPLE_TEXT.encode('utf-8'), 'text/plain'),
+                                       (json.dumps({'text': SAMPLE_TEXT, 'layouts': ['vizov']}).encode('utf-8'),
+                                        'application/json'),
+                                       (json.dumps({'path': 'missing.txt'}).encode('utf-8'), 'application/json')):
+                writer.write(f"POST /score HTTP/1.1\r\nContent-Type: {content_type}\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+                status = int((await reader.readline()).split()[1])
+                headers = {}
+                while (line := await reader.readline()) != b'\r\n':
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.lower()] = value.strip()
+                responses.append((status, json.loads(await reader.readexactly(int(headers['content-length'])))))
+            writer.close()
+            server.cancel()
+            return responses
+
+        (status, both), (_, vizov), (missing_status, _) = asyncio.run(run())
+        self.assertEqual(status, 200)
+        self.assertEqual(list(both['layouts']), ['Йцукен', 'Вызов'])
+        result = vizov['layouts']['Вызов']
+        self.assertEqual((result['total'], result['fingers'], result['chars']), SAMPLE_RESULTS['Вызов'])
+        self.assertEqual(result['hands']['left'] + result['hands']['right'], result['total'])
+        self.assertEqual(missing_status, 404)
+
+    def test_bad_request_in_batch(self):
+        async def run():
+            service = ScoringService(['qwerty'], workers=0)
+            await service.start()
+            with tempfile.TemporaryDirectory() as directory:
+                responses = await asyncio.gather(*(service.score(request) for request in (
+                    {'text': SAMPLE_TEXT}, {'text': 5}, {'path': directory}, {'path': ['x']}, {'text': SAMPLE_TEXT})))
+            await service.close()
+            return responses
+
+        responses = asyncio.run(run())
+        self.assertEqual([status for status, _ in responses], [200, 400, 400, 400, 200])
+        self.assertEqual(responses[4][1]['layouts']['Йцукен']['total'], SAMPLE_RESULTS['Йцукен'][0])
+
+    def test_services_in_one_process(self):
+        async def run():
+            first, second = ScoringService(['qwerty'], workers=0), ScoringService(['vizov'], workers=0)
+            await first.start()
+            await second.start()
+            responses = await asyncio.gather(first.score({'text': SAMPLE_TEXT}), second.score({'text': SAMPLE_TEXT}))
+            await first.close()
+            await second.close()
+            return responses
+
+        (_, first), (_, second) = asyncio.run(run())
+        self.assertEqual(list(first['layouts']), ['Йцукен'])
+        self.assertEqual(list(second['layouts']), ['Вызов'])
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,223 @@
+import argparse
+import json
+import sys
+from array import array
+from analyzer import Analyzer
+from layout import FINGERS
+
+LAYOUT_COLUMNS = ('total', 'left', 'right', 'chars') + FINGERS
+UNITS = ('chars', 'bytes')
+
+
+def iter_windows(chunks, layouts, window, engine='python', encoding='utf-8'):
+    """
+    Потоковый подсчёт по окнам: текст считается за один проход, и через каждые window
+    символов (части - строки) или байтов (части - байты) выдаются штрафы, набранные в этом окне.
+    Позиции пальцев и рука предыдущего нажатия переносятся через границы окон, поэтому
+    сумма окон равна результату по всему тексту, а память не зависит от его размера
+
+    Args:
+        chunks: итерируемый объект со строками или байтами
+        layouts: список данных раскладок
+        window: размер окна в символах или байтах
+        engine: движок подсчёта
+        encoding: кодировка байтов
+
+    Returns:
+        Генератор кортежей (начало окна, конец окна, результаты по раскладкам), где результаты -
+        список кортежей (сумма штрафов, штраф по каждому пальцу, количество символов) только за окно.
+        Последнее окно может быть короче (и пустым, если в нём только '\r', досчитанный в конце)
+    """
+    if window <= 0:
+        raise ValueError('Размер окна должен быть положительным')
+
+    analyzers = [Analyzer(layout_config, engine, encoding) for layout_config in layouts]
+    previous = [([0] * len(analyzer.state.penalties), 0) for analyzer in analyzers]
+    start = position = 0
+
+    def emit():
+        results = []
+        for i, analyzer in enumerate(analyzers):
+            penalties, total_chars = analyzer.state.penalties, analyzer.state.total_chars
+            delta = [penalty - before for penalty, before in zip(penalties, previous[i][0])]
+            results.append((sum(delta), dict(zip(analyzer.compiled.fingers, delta)), total_chars - previous[i][1]))
+            previous[i] = (list(penalties), total_chars)
+        return results
+
+    for chunk in chunks:
+        offset = 0
+        while offset < len(chunk):
+            piece = chunk[offset:offset + start + window - position]
+            for analyzer in analyzers:
+                analyzer.feed(piece)
+            offset += len(piece)
+            position += len(piece)
+            if position == start + window:
+                yield start, position, emit()
+                start = position
+
+    # close() досчитывает отложенный '\r' и байты в декодере: если после последнего полного окна
+    # что-то добавилось, оно выдаётся в последнем окне, даже пустом по длине
+    for analyzer in analyzers:
+        analyzer.close()
+    changed = any(analyzer.state.total_chars != before_chars or list(analyzer.state.penalties) != before
+                  for analyzer, (before, before_chars) in zip(analyzers, previous))
+    if position > start or start == 0 or changed:
+        yield start, position, emit()
+
+
+def file_windows(filename, layouts, window, unit='chars', engine='python', encoding='utf-8',
+                 chunk_size=1024 * 1024):
+    """
+    Подсчёт файла по окнам (см. iter_windows)
+
+    Args:
+        filename: путь к файлу
+        layouts: список данных раскладок
+        window: размер окна
+        unit: 'chars' - окна по символам текста, 'bytes' - по байтам файла
+        engine: движок подсчёта
+        encoding: кодировка файла
+        chunk_size: размер части для чтения
+
+    Returns:
+        Генератор окон (см. iter_windows)
+    """
+    if unit not in UNITS:
+        raise ValueError(f"Неизвестная единица окна: {unit}")
+    if unit == 'bytes':
+        with open(filename, 'rb') as file:
+            yield from iter_windows(iter(lambda: file.read(chunk_size), b''), layouts, window, engine, encoding)
+    else:
+        with open(filename, 'r', encoding=encoding) as file:
+            yield from iter_windows(iter(lambda: file.read(chunk_size), ''), layouts, window, engine, encoding)
+
+
+def window_row(start, end, results):
+    """
+    Переводит окно в строку таблицы: начало, конец и для каждой раскладки столбцы LAYOUT_COLUMNS
+    """
+    from main import calculate_hand_penalties
+
+    row = [start, end]
+    for total_penalty, finger_penalties, total_chars in results:
+        left, right = calculate_hand_penalties(finger_penalties)
+        row.extend((total_penalty, left, right, total_chars))
+        row.extend(finger_penalties.get(f, 0) for f in FINGERS)
+    return row
+
+
+class WindowWriter:
+    """
+    Пишет окна в компактный двоичный файл: строки из целых int64 (порядок байтов платформы),
+    столбцы - start, end и LAYOUT_COLUMNS для каждой раскладки. Рядом, в <путь>.json,
+    записываются названия столбцов, раскладки, размер окна и количество окон - этого достаточно,
+    чтобы прочитать файл через load_windows или numpy.fromfile
+    """
+
+    def __init__(self, path, layout_names, window, unit='chars', source=None):
+        self.path = path
+        self.meta = {
+            'columns': ['start', 'end'] + [f"{name}.{column}" for name in layout_names for column in LAYOUT_COLUMNS],
+            'layouts': list(layout_names),
+            'window': window,
+            'unit': unit,
+            'source': source,
+            'dtype': 'int64',
+            'byteorder': sys.byteorder,
+            'windows': 0,
+        }
+        self._file = open(path, 'wb')
+
+    def write(self, start, end, results):
+        """
+        Добавляет одно окно (см. iter_windows)
+        """
+        array('q', window_row(start, end, results)).tofile(self._file)
+        self.meta['windows'] += 1
+
+    def close(self):
+        """
+        Закрывает файл и записывает описание столбцов
+        """
+        if self._file.closed:
+            return
+        self._file.close()
+        with open(self.path + '.json', 'w', encoding='utf-8') as file:
+            json.dump(self.meta, file, ensure_ascii=False, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_windows(path):
+    """
+    Читает файл окон без повторного анализа (numpy.memmap - файл не загружается в память целиком)
+
+    Args:
+        path: путь к файлу WindowWriter
+
+    Returns:
+        Описание (словарь из <путь>.json) и массив numpy формы (окна, столбцы)
+    """
+    import numpy as np
+
+    with open(path + '.json', encoding='utf-8') as file:
+        meta = json.load(file)
+    dtype = np.dtype(meta['dtype']).newbyteorder('<' if meta['byteorder'] == 'little' else '>')
+    if not meta['windows']:
+        return meta, np.zeros((0, len(meta['columns'])), dtype=dtype)
+    return meta, np.memmap(path, dtype=dtype, mode='r', shape=(meta['windows'], len(meta['columns'])))
+
+
+def main(argv=None):
+    """
+    Подсчёт по окнам из командной строки: записывает окна в двоичный файл
+    и выводит самые тяжёлые окна для первой раскладки
+
+    Args:
+        argv: аргументы командной строки (None - sys.argv)
+
+    Returns:
+        Код завершения 0
+    """
+    from analyzer import ENGINES
+    from layout_registry import add_layout_arguments, resolve_layouts
+
+    parser = argparse.ArgumentParser(description='Штрафы по окнам текста: где в корпусе растёт нагрузка')
+    parser.add_argument('file', help='анализируемый файл')
+    parser.add_argument('-w', '--window', type=int, default=10000, help='размер окна')
+    parser.add_argument('--unit', choices=UNITS, default='chars', help='окна по символам или по байтам')
+    add_layout_arguments(parser)
+    parser.add_argument('--engine', choices=ENGINES, default='python', help='движок подсчёта')
+    parser.add_argument('--encoding', default='utf-8', help='кодировка файла')
+    parser.add_argument('-o', '--output', default=None, help='двоичный файл окон (по умолчанию <файл>.windows)')
+    parser.add_argument('--top', type=int, default=5, help='сколько самых тяжёлых окон вывести')
+    args = parser.parse_args(argv)
+
+    try:
+        layouts = resolve_layouts(args.layouts, args.layout_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    output = args.output or args.file + '.windows'
+    heaviest = []
+    with WindowWriter(output, [layout_config['name'] for layout_config in layouts], args.window, args.unit,
+                      args.file) as writer:
+        for start, end, results in file_windows(args.file, layouts, args.window, args.unit, args.engine,
+                                                args.encoding):
+            writer.write(start, end, results)
+            density = results[0][0] / max(results[0][2], 1)
+            heaviest = sorted(heaviest + [(density, start, end)], reverse=True)[:args.top]
+
+    print(f"Окон: {writer.meta['windows']}, записано в {output} (описание столбцов - {output}.json)")
+    print(f"Самые тяжёлые окна для раскладки {layouts[0]['name']} (штраф на символ):")
+    for density, start, end in heaviest:
+        print(f"  {start}-{end}: {density:.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())